@@ -4,10 +4,25 @@ let sound_a_file = require('./sound_a.mp3');
 let hash = window.location.hash.substring(1);
 let params = hash.split("|")
 
-let filter = "tickets/" + params[0].toLocaleLowerCase();
+// only tickets of this orga group, or all of them
+let orga = params[0].toLocaleLowerCase();
 let host_port = params[1];
+let topics = orga ? "tickets/" + orga + "/#" : "tickets/#";
+// retained snapshot of all open tickets, to start from
+let snapshot_topic = orga ? "tickets/" + orga + "/_snapshot" : "tickets/_snapshot";
+// or, if given, from the bot's HTTP snapshot server
+let snapshot_url = params[3]
+    ? params[3].replace(/\/$/, "") + (orga ? "/tickets/" + orga : "/tickets")
+    : null;
+let snapshot_etag = null;
+let bootstrapped = false;
+// last update applied per orga group, to notice missed ones
+let epoch = null;
+let seqs = {};
 
-let client = mqtt.connect('ws://' + host_port); // create a client
+// optional password, where the broker only lets the orga's user read its tickets
+let options = params[2] ? { username: orga, password: params[2] } : {};
+let client = mqtt.connect('ws://' + host_port, options); // create a client
 
 let sound_a = new Audio(sound_a_file);
 let allow_play = false;
@@ -15,57 +30,328 @@ let allow_play = false;
 alert("Drücke irgendwo um in Vollbild zu wechseln. Wenn Sound nervig, den Tab muten.");
   
 client.on('connect', function () {
-    client.subscribe('#', { qos: 0 })
+    // (re)subscribing delivers the retained snapshot again
+    bootstrapped = false;
+    client.subscribe([topics, 'status'], { qos: 0 })
+    if (snapshot_url) {
+        fetchSnapshot();
+    }
 })
 client.on('message', function (topic, message) {
   // message is Buffer
-  message = message.toString();
-  if (message == "") {
+  if (message.length == 0) {
+    return;
+  }
+  if (topic == "status") {
+    document.body.dataset.status = decodeMessage(message).status;
+    return;
+  }
+  if (topic.startsWith("tickets/_") || topic.endsWith("/_snapshot")) {
+    if (topic == snapshot_topic && !snapshot_url) {
+      takeSnapshot(decodeSnapshot(decodeMessage(message)));
+    }
     return;
   }
-  message = JSON.parse(message);
-  if (topic.toLocaleLowerCase().startsWith(filter)) {
+  message = decodeTicket(decodeMessage(message));
+  if (message != null && isNext(message)) {
     handleTicket(message);
   }
 })
 
+// Check the sequence number of an update, and ask for a new snapshot if
+// updates were missed. Returns false for updates already applied.
+function isNext(ticket) {
+    if (ticket.seq === undefined || !bootstrapped) {
+        return true;
+    }
+    let last = seqs[ticket.group_tasked] || 0;
+    if (ticket.epoch == epoch && ticket.seq <= last) {
+        return false;
+    }
+    if (ticket.epoch != epoch || ticket.seq > last + 1) {
+        console.warn("Missed updates of " + ticket.group_tasked + ", resyncing");
+        // take the next snapshot
+        bootstrapped = false;
+        if (snapshot_url) {
+            fetchSnapshot();
+        } else {
+            client.publish("tickets/_resync", orga, { qos: 1 });
+        }
+    }
+    seqs[ticket.group_tasked] = ticket.seq;
+    return true;
+}
+
+function takeSnapshot(snapshot) {
+    // a new epoch means the bot restarted
+    if (snapshot != null && (!bootstrapped || snapshot.epoch != epoch)) {
+        applySnapshot(snapshot.tickets);
+        epoch = snapshot.epoch;
+        seqs = snapshot.seqs;
+        bootstrapped = true;
+    }
+}
+
+function fetchSnapshot() {
+    // revalidated with the ETag, unchanged snapshots cost a 304 only
+    fetch(snapshot_url, { cache: "no-cache" })
+        .then(function (response) {
+            if (!response.ok) {
+                throw new Error("HTTP " + response.status);
+            }
+            let etag = response.headers.get("ETag");
+            if (bootstrapped && etag != null && etag == snapshot_etag) {
+                return;
+            }
+            snapshot_etag = etag;
+            return response.arrayBuffer().then(function (body) {
+                takeSnapshot(decodeSnapshot(decodeMessage(new Uint8Array(body))));
+            });
+        })
+        .catch((error) => console.warn("Fetching snapshot failed: " + error));
+}
+
+if (snapshot_url) {
+    // notices restarts of the bot even while MQTT is down
+    window.setInterval(fetchSnapshot, 60 * 1000);
+}
+
+// Tickets come as minified JSON or MessagePack (see src/wire.py), told apart
+// by the first byte.
+function decodeMessage(buffer) {
+    if (buffer[0] == 0x7b) {  // '{'
+        return JSON.parse(new TextDecoder().decode(buffer));
+    }
+    return decodeMsgpack(buffer);
+}
+
+function decodeTicket(message) {
+    if (message.v === undefined) {
+        // sent by a bot from before the versioned format
+        return message;
+    }
+    if (message.v != 1) {
+        console.warn("Unknown ticket format version " + message.v);
+        return null;
+    }
+    let ticket = ticketFields(message);
+    ticket.epoch = message.e;
+    ticket.seq = message.q;
+    return ticket;
+}
+
+function decodeSnapshot(message) {
+    if (message.v != 1) {
+        console.warn("Unknown snapshot format version " + message.v);
+        return null;
+    }
+    return {
+        epoch: message.e,
+        seqs: message.q,
+        tickets: message.ts.map(ticketFields),
+    };
+}
+
+function ticketFields(message) {
+    return {
+        uid: message.u,
+        status: message.s,
+        group_requesting: message.r,
+        group_tasked: message.g,
+        text: message.t,
+        who: message.w,
+    };
+}
+
+function decodeMsgpack(buffer) {
+    let view = new DataView(buffer.buffer, buffer.byteOffset, buffer.byteLength);
+    let decoder = new TextDecoder();
+    let pos = 0;
+
+    function str(n) {
+        let value = decoder.decode(buffer.subarray(pos, pos + n));
+        pos += n;
+        return value;
+    }
+    function array(n) {
+        let items = [];
+        for (let i = 0; i < n; i++) {
+            items.push(next());
+        }
+        return items;
+    }
+    function map(n) {
+        let result = {};
+        for (let i = 0; i < n; i++) {
+            let key = next();
+            result[key] = next();
+        }
+        return result;
+    }
+    function sized(bytes, read) {
+        let value = read(pos);
+        pos += bytes;
+        return value;
+    }
+    function next() {
+        let code = view.getUint8(pos++);
+        if (code < 0x80) return code;
+        if (code >= 0xe0) return code - 0x100;
+        if (code <= 0x8f) return map(code & 0x0f);
+        if (code <= 0x9f) return array(code & 0x0f);
+        if (code <= 0xbf) return str(code & 0x1f);
+        switch (code) {
+            case 0xc0: return null;
+            case 0xc2: return false;
+            case 0xc3: return true;
+            case 0xcb: return sized(8, (p) => view.getFloat64(p));
+            case 0xcc: return sized(1, (p) => view.getUint8(p));
+            case 0xcd: return sized(2, (p) => view.getUint16(p));
+            case 0xce: return sized(4, (p) => view.getUint32(p));
+            case 0xcf: return sized(8, (p) => Number(view.getBigUint64(p)));
+            case 0xd0: return sized(1, (p) => view.getInt8(p));
+            case 0xd1: return sized(2, (p) => view.getInt16(p));
+            case 0xd2: return sized(4, (p) => view.getInt32(p));
+            case 0xd3: return sized(8, (p) => Number(view.getBigInt64(p)));
+            case 0xd9: return str(sized(1, (p) => view.getUint8(p)));
+            case 0xda: return str(sized(2, (p) => view.getUint16(p)));
+            case 0xdb: return str(sized(4, (p) => view.getUint32(p)));
+            case 0xdc: return array(sized(2, (p) => view.getUint16(p)));
+            case 0xdd: return array(sized(4, (p) => view.getUint32(p)));
+            case 0xde: return map(sized(2, (p) => view.getUint16(p)));
+            case 0xdf: return map(sized(4, (p) => view.getUint32(p)));
+        }
+        throw new Error("Unsupported MessagePack type 0x" + code.toString(16));
+    }
+    return next();
+}
+
+// Displayed tickets, uid -> ticket. Updates only change this state and are
+// rendered once per animation frame, and only the tickets within (or close
+// to) the visible part of the page get DOM elements.
+let tickets = new Map();
+let sorted = [];  // uids of `tickets`, newest first
+let sorted_dirty = false;
+let rows = new Map();  // uid -> element, for rendered tickets
+let row_height = null;  // px, measured from the first rendered ticket
+let render_scheduled = false;
+let play_sound = false;
+
+const ROW_GAP = 20;  // px between tickets
+const OVERSCAN = 5;  // tickets rendered above and below the visible ones
+
+// show exactly the tickets of the snapshot, without sound
+function applySnapshot(snapshot_tickets) {
+    tickets = new Map(snapshot_tickets.map((ticket) => [ticket.uid, ticket]));
+    sorted_dirty = true;
+    scheduleRender();
+}
+
 function handleTicket(message) {
-    let uid = message.uid;
-    let ticketContainer = document.getElementById(uid);
+    if (message.status == "CLOSED" || message.status == "REVOKED") {
+        sorted_dirty = sorted_dirty || tickets.delete(message.uid);
+    } else {
+        if (!tickets.has(message.uid)) {
+            sorted_dirty = true;
+            play_sound = play_sound || message.status == "OPEN";
+        }
+        tickets.set(message.uid, message);
+    }
+    scheduleRender();
+}
+
+function scheduleRender() {
+    if (!render_scheduled) {
+        render_scheduled = true;
+        window.requestAnimationFrame(render);
+    }
+}
 
+function render() {
+    render_scheduled = false;
+    if (play_sound && allow_play) {
+        sound_a.play();
+    }
+    play_sound = false;
+    if (sorted_dirty) {
+        sorted = Array.from(tickets.keys()).sort((a, b) => b - a);
+        sorted_dirty = false;
+    }
 
-    if (ticketContainer == null) {
-        ticketContainer = document.createElement("div");
-        ticketContainer.id = uid
-        let container_tickets = document.getElementById("container-tickets");
-        let first_ticket_container = container_tickets.firstChild;
-        container_tickets.insertBefore(ticketContainer, first_ticket_container);
+    let container_tickets = document.getElementById("container-tickets");
+    if (row_height == null) {
+        let row = createRow();
+        container_tickets.appendChild(row);
+        row_height = row.offsetHeight + ROW_GAP;
+        container_tickets.removeChild(row);
+    }
+    container_tickets.style.height = ROW_GAP + sorted.length * row_height + "px";
 
+    // rows in view, relative to the top of the ticket list
+    let top = window.scrollY - container_tickets.offsetTop - ROW_GAP;
+    let first = Math.max(0, Math.floor(top / row_height) - OVERSCAN);
+    let last = Math.min(
+        sorted.length,
+        Math.ceil((top + window.innerHeight) / row_height) + OVERSCAN,
+    );
+    let visible = new Set(sorted.slice(first, last));
 
-        let pTicketText = document.createElement("p");
-        pTicketText.className = "ticket-text";
-        ticketContainer.appendChild(pTicketText);
-        let pTicketNo = document.createElement("p");
-        pTicketNo.className = "ticket-no";
-        ticketContainer.appendChild(pTicketNo);
+    for (let [uid, row] of rows) {
+        if (!visible.has(uid)) {
+            container_tickets.removeChild(row);
+            rows.delete(uid);
+        }
     }
+    for (let i = first; i < last; i++) {
+        let uid = sorted[i];
+        let row = rows.get(uid);
+        if (row == null) {
+            row = createRow();
+            rows.set(uid, row);
+            container_tickets.appendChild(row);
+        }
+        updateRow(row, tickets.get(uid), i);
+    }
+}
 
-    ticketContainer.className = message.status;
+function createRow() {
+    let ticketContainer = document.createElement("div");
+    let pTicketText = document.createElement("p");
+    pTicketText.className = "ticket-text";
+    ticketContainer.appendChild(pTicketText);
+    let pTicketNo = document.createElement("p");
+    pTicketNo.className = "ticket-no";
+    ticketContainer.appendChild(pTicketNo);
+    return ticketContainer;
+}
+
+function updateRow(ticketContainer, message, position) {
     let secondary_text = "#" + message.uid;
     if (message.who) {
         secondary_text = message.who + " | " + secondary_text;
     }
-    ticketContainer.lastChild.innerText = secondary_text;
-    ticketContainer.firstChild.innerText = message.text;
-
-    if (message.status == "CLOSED") {
-        document.getElementById("container-tickets").removeChild(ticketContainer);
+    // only touch what changed, so unchanged tickets cause no layout work
+    let top = ROW_GAP + position * row_height + "px";
+    if (ticketContainer.style.top != top) {
+        ticketContainer.style.top = top;
     }
-    else if (message.status == "OPEN" && allow_play) {
-        sound_a.play();
+    if (ticketContainer.className != message.status) {
+        ticketContainer.className = message.status;
+    }
+    if (ticketContainer.lastChild.textContent != secondary_text) {
+        ticketContainer.lastChild.textContent = secondary_text;
+    }
+    if (ticketContainer.firstChild.textContent != message.text) {
+        ticketContainer.firstChild.textContent = message.text;
     }
 }
 
+window.addEventListener("scroll", scheduleRender, { passive: true });
+window.addEventListener("resize", function () {
+    row_height = null;
+    scheduleRender();
+});
+
 function goFullscreen() {
     document.documentElement.requestFullscreen();
     allow_play = true;
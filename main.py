@@ -1,67 +1,43 @@
 import os
 import logging
+import secrets
+import signal
 import socket
+import threading
+
+from queue import Queue
 
 from rich.traceback import install
 
-from telegram.ext import (
-    Updater,
-    Filters,
-    CommandHandler,
-    MessageHandler,
-    CallbackQueryHandler,
-    ConversationHandler,
-    PicklePersistence,
-)
+from telegram.ext import JobQueue, Updater
 
 from src.dashboard_bridge import (
     dashboard_init,
     dashboard_publish,
     dashboard_start,
     dashboard_stop,
-    mqtt_send_all_tickets,
+    mqtt_set_snapshots,
     mqtt_set_tickets,
 )
-from src.config import CONNECT_BROKER, TOKEN
-from src.utils import set_log_level_format, get_logging_level, channel_msg
-from src.commands import (
-    error_handler,
-    start,
-    help,
-    unknown,
-    register,
-    unregister,
-    status,
-    details,
-    register_button,
-    task_button,
-    feature,
-    bug,
-    resetall,
-    closeall,
-    reset_counter,
-    system_status,
+from src.config import ConfigError, load_config
+from src.utils import (
+    set_log_level_format,
+    get_logging_level,
+    channel_msg,
+    get_bot,
+    CON_POOL_SIZE,
 )
-from src.states import (
-    reset_user,
-    cancel,
-    request,
-    money,
-    cups,
-    free_next,
-    ask_amount,
-    amount,
-    collect,
-    change,
-    free,
-    REQUEST,
-    MONEY,
-    CUPS,
-    AMOUNT,
-    FREE,
-)
-from src.tickets import close, wip, all, tickets, help2, message, dashboard, revoke
-from src.parser import create_parser
+from src.concurrency import ChatSerialDispatcher
+from src.outbox import outbox_stop
+from src.tickets_data import ticket_store
+from src.persistence import SQLitePersistence
+from src.journal import journal_init, journal_stop
+from src.archive import archive_init, archive_stop
+from src.snapshot_server import snapshot_server_start, snapshot_server_stop
+from src.handlers import add_handlers, add_hook
+from src.metrics import gauge, metrics_server_start, metrics_server_stop, time_handler
+from src.recorder import recorder_init, record_updates, recorder_stop
+from src.parser import parse_args
 
 # activate tracebacks with `rich` formatting support
 install(show_locals=True)
@@ -74,112 +50,76 @@ def main(**kwargs):
     user_data['group_association'] for group membership
     bot_data['group_association'] for dict Group -> [chat_id]
     bot_data['highest'] for int of next highest ticket id
-    bot_data['tickets'] for dict id -> src.tickets.Ticket
+    bot_data['tickets'] for src.tickets_data.TicketStore, id -> Ticket
     """
+    from src.config import CONNECT_BROKER
 
-    persistence = PicklePersistence(filename="bot_persistence.cntx")
-    updater = Updater(token=TOKEN, persistence=persistence)
-    dispatcher = updater.dispatcher
+    journal = journal_init(kwargs["journal"]) if kwargs.get("journal") else None
+    # closed and revoked tickets, kept out of the persisted state
+    archive_init("ticket_archive.sqlite")
 
-    # add various handlers here
-    dispatcher.add_handler(CommandHandler("start", start))
-
-    dispatcher.add_handler(
-        CallbackQueryHandler(task_button, pattern="^(cancel|wip|close|revoke) #[0-9]+$")
+    # only changed rows are written, instead of pickling everything each update
+    persistence = SQLitePersistence(
+        filename="bot_persistence.sqlite", store_tickets=journal is None
     )
-    dispatcher.add_handler(CallbackQueryHandler(register_button))
-
-    # large request handler
-    dispatcher.add_handler(
-        ConversationHandler(
-            entry_points=[CommandHandler("request", request)],
-            states={
-                REQUEST: [
-                    MessageHandler(Filters.regex("^Geld$"), money),
-                    MessageHandler(Filters.regex("^Becher$"), cups),
-                    MessageHandler(Filters.regex("^Sonstiges$"), free_next),
-                    MessageHandler(Filters.regex("^(Bier|Cocktail)$"), free_next),
-                    CommandHandler("cancel", cancel),
-                ],
-                MONEY: [
-                    MessageHandler(Filters.regex("^Geld Abholen$"), collect),
-                    MessageHandler(Filters.regex("^Freitext$"), free_next),
-                    MessageHandler(Filters.regex("^Wechselgeld$"), change),
-                    CommandHandler("cancel", cancel),
-                ],
-                CUPS: [
-                    MessageHandler(
-                        Filters.regex("^(Shotbecher|Normale Becher)$"), ask_amount
-                    ),
-                    MessageHandler(Filters.regex("^Normale Becher$"), ask_amount),
-                    MessageHandler(Filters.regex("^Dreckige Abholen$"), collect),
-                    CommandHandler("cancel", cancel),
-                ],
-                # and three options with free text fields
-                # BEER: [free_text],
-                # COCKTAIL: [free_text],
-                # OTHER: [free_text],
-                FREE: [
-                    MessageHandler(Filters.text & ~Filters.command, free),
-                    CommandHandler("cancel", cancel),
-                ],
-                AMOUNT: [
-                    MessageHandler(Filters.text & ~Filters.command, amount),
-                    CommandHandler("cancel", cancel),
-                ],
-            },
-            fallbacks=[
-                CommandHandler("cancel", cancel),
-            ],
-            name="ticket_requests",
-            persistent=True,
+    # state from before the switch to sqlite
+    persistence.import_pickle("bot_persistence.cntx")
+    # share one bot (and its connection pool) with all messaging helpers
+    workers = kwargs.get("workers", 0)
+    if workers > 0:
+        # every worker may hold a connection of its own
+        bot = get_bot(CON_POOL_SIZE + workers, kwargs.get("base_url"))
+        job_queue = JobQueue()
+        dispatcher = ChatSerialDispatcher(
+            bot,
+            Queue(),
+            job_queue=job_queue,
+            persistence=persistence,
+            chat_workers=workers,
         )
-    )
+        job_queue.set_dispatcher(dispatcher)
+        updater = Updater(dispatcher=dispatcher, workers=None)
+    else:
+        bot = get_bot(base_url=kwargs.get("base_url"))
+        updater = Updater(bot=bot, persistence=persistence)
+    dispatcher = updater.dispatcher
 
-    # regular commands for users
-    dispatcher.add_handler(CommandHandler("register", register))
-    dispatcher.add_handler(CommandHandler("unregister", unregister))
-
-    dispatcher.add_handler(CommandHandler("request", request))
-    dispatcher.add_handler(CommandHandler("bug", bug))
-    dispatcher.add_handler(CommandHandler("feature", feature))
-    dispatcher.add_handler(CommandHandler("help", help))
-    dispatcher.add_handler(CommandHandler("status", status))
-    dispatcher.add_handler(CommandHandler("revoke", revoke))
-
-    # hidden commands
-    # potentially helpful for debugging problems (not in help)
-    dispatcher.add_handler(CommandHandler("details", details))
-    dispatcher.add_handler(CommandHandler("reset", reset_user))
-
-    # Orga commands
-    # only available for groups in ORGA_GROUPS
-    dispatcher.add_handler(CommandHandler("help2", help2))
-    dispatcher.add_handler(CommandHandler("system", system_status))
-    dispatcher.add_handler(CommandHandler("all", all))
-    dispatcher.add_handler(CommandHandler("tickets", tickets))
-    dispatcher.add_handler(CommandHandler("message", message))
-    dispatcher.add_handler(CommandHandler("close", close))
-    dispatcher.add_handler(CommandHandler("wip", wip))
-    dispatcher.add_handler(CommandHandler("dashboard", dashboard))
-
-    # Developer commands
-    # only available from DEVELOPER_CHAT_ID
-    dispatcher.add_handler(CommandHandler("resetall", resetall))
-    dispatcher.add_handler(CommandHandler("closeall", closeall))
-    dispatcher.add_handler(CommandHandler("resetcount", reset_counter))
-
-    # register handlers for unknown commands and errors
-    dispatcher.add_handler(MessageHandler(Filters.command, unknown))
-    dispatcher.add_handler(MessageHandler(Filters.text & ~Filters.command, unknown))
-    dispatcher.add_error_handler(error_handler)
+    if journal:
+        if journal.is_empty():
+            # take over tickets from before the journal was used
+            journal.snapshot(ticket_store(dispatcher.bot_data))
+        dispatcher.bot_data["tickets"] = journal.load()
+        # the journal has them now
+        persistence.clear_tickets()
+
+    if kwargs.get("record"):
+        recorder_init(kwargs["record"])
+        record_updates(dispatcher)
+    add_handlers(dispatcher)
+    if kwargs.get("metrics_port"):
+        add_hook(time_handler)
+        gauge(
+            "bot_updates_queued",
+            "Updates received but not yet taken by the dispatcher",
+            func=dispatcher.update_queue.qsize,
+        )
+        if workers > 0:
+            gauge(
+                "bot_updates_pending",
+                "Updates waiting for a chat worker",
+                func=dispatcher.pending,
+            )
+        metrics_server_start(kwargs["metrics_listen"], kwargs["metrics_port"])
 
     if CONNECT_BROKER:
         dashboard_init()
-        if dispatcher.bot_data.get("tickets"):
-            # send out initial tickets if there are any.
-            mqtt_set_tickets(dispatcher.bot_data["tickets"])
-            mqtt_send_all_tickets()
+        # snapshots of open tickets are sent out once connected
+        mqtt_set_tickets(ticket_store(dispatcher.bot_data))
+    if kwargs.get("snapshot_port"):
+        snapshot_server_start(
+            dispatcher.bot_data, kwargs["snapshot_listen"], kwargs["snapshot_port"]
+        )
+        mqtt_set_snapshots(False)
 
     # Startup message
     channel_msg(f"🔘 Started from {socket.gethostname()}")
@@ -187,13 +127,41 @@ def main(**kwargs):
 
     # Begin action loop
     dashboard_start()
-    updater.start_polling()
-    updater.idle()
+    if kwargs.get("webhook"):
+        secret = kwargs.get("webhook_secret") or secrets.token_urlsafe(32)
+        webhook_url = kwargs.get("webhook_url")
+        updater.start_webhook(
+            listen=kwargs["webhook_listen"],
+            port=kwargs["webhook_port"],
+            url_path=secret,
+            webhook_url=f"{webhook_url.rstrip('/')}/{secret}" if webhook_url else None,
+            max_connections=kwargs["webhook_max_connections"],
+        )
+    else:
+        updater.start_polling()
+    # instead of `updater.idle()`, which flushes the persistence before the
+    # dispatcher and the outbox are done with it
+    stopping = threading.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM, signal.SIGABRT):
+        signal.signal(signum, lambda *_: stopping.set())
+    while not stopping.wait(1):
+        pass
+    updater.stop()
+    # members found to have blocked the bot from now on stay until next time,
+    # the dispatcher is gone
+    outbox_stop()
+    dispatcher.update_persistence()
+    persistence.flush()
     dashboard_stop()
+    snapshot_server_stop()
+    metrics_server_stop()
+    recorder_stop()
+    journal_stop()
+    archive_stop()
 
 
 if __name__ == "__main__":
-    args = create_parser().parse_args()
+    args = parse_args()
 
     loglevels = [
         logging.DEBUG,
@@ -230,4 +198,11 @@ if __name__ == "__main__":
     log.info("Executing as main")
     log.debug("Using terminal color output: %r" % (not nocolor))
 
+    try:
+        # before anything uses them, rather than deep within a handler
+        load_config()
+    except ConfigError as e:
+        log.critical(f"🔴 Invalid configuration: {e}")
+        raise SystemExit(1)
+
     main(**vars(args))
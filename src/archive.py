@@ -0,0 +1,110 @@
+import logging
+import sqlite3
+import threading
+import time
+
+from src.tickets_data import Ticket, TicketStatus
+
+log = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tickets (
+    uid INTEGER NOT NULL,
+    group_requesting TEXT NOT NULL,
+    group_tasked TEXT NOT NULL,
+    text TEXT NOT NULL,
+    who TEXT NOT NULL,
+    status TEXT NOT NULL,
+    archived_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS by_requesting ON tickets (group_requesting, archived_at);
+CREATE INDEX IF NOT EXISTS by_tasked ON tickets (group_tasked, archived_at);
+CREATE INDEX IF NOT EXISTS by_archived_at ON tickets (archived_at);
+"""
+
+_filename = None
+_db = None
+_lock = threading.Lock()
+
+
+def archive_init(filename: str):
+    """Open (or create) the archive of closed and revoked tickets."""
+    global _filename, _db
+    _filename = filename
+    _db = sqlite3.connect(filename, check_same_thread=False)
+    _db.execute("PRAGMA journal_mode=WAL")
+    _db.execute("PRAGMA synchronous=NORMAL")
+    _db.executescript(SCHEMA)
+
+
+def archive_ticket(ticket: Ticket):
+    """Append a closed or revoked `ticket` to the archive."""
+    if not _db:
+        return
+    with _lock, _db:
+        _db.execute(
+            "INSERT INTO tickets VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (
+                ticket.uid,
+                ticket.group_requesting,
+                ticket.group_tasked,
+                ticket.text,
+                ticket.who,
+                ticket.status.name,
+                time.time(),
+            ),
+        )
+
+
+def archive_query(
+    group: str = None,
+    since: float = None,
+    status: TicketStatus = None,
+    limit: int = None,
+):
+    """Iterate over archived tickets as (archived_at, Ticket), newest first.
+
+    Optionally only tickets requested by or tasked to `group`, archived after
+    timestamp `since`, or with `status`. Rows are streamed from disk, the
+    archive is never loaded as a whole.
+    """
+    if not _filename:
+        return
+    clauses, params = [], []
+    if group is not None:
+        clauses.append("(group_requesting = ? OR group_tasked = ?)")
+        params += [group, group]
+    if since is not None:
+        clauses.append("archived_at >= ?")
+        params.append(since)
+    if status is not None:
+        clauses.append("status = ?")
+        params.append(status.name)
+    query = "SELECT * FROM tickets"
+    if clauses:
+        query += " WHERE " + " AND ".join(clauses)
+    query += " ORDER BY archived_at DESC"
+    if limit is not None:
+        query += f" LIMIT {int(limit)}"
+
+    # separate connection, so reading does not block archiving tickets
+    db = sqlite3.connect(_filename)
+    try:
+        for uid, requesting, tasked, text, who, status, archived_at in db.execute(
+            query, params
+        ):
+            ticket = Ticket(
+                requesting, tasked, text, uid=uid, status=TicketStatus[status]
+            )
+            ticket.who = who
+            yield archived_at, ticket
+    finally:
+        db.close()
+
+
+def archive_stop():
+    global _db
+    if _db:
+        with _lock:
+            _db.close()
+            _db = None
@@ -2,24 +2,26 @@ from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
 
 from telegram.ext import CallbackContext
 
+import functools
 import logging
 import json
 
-from src.config import (
-    GROUPS_LIST,
-    ORGA_GROUPS,
-    ALL_GROUPS,
-    DEVELOPER_CHAT_ID,
-)
 from src.utils import who, dev_msg, channel_msg, autoselect_keyboard, dev_html
+from src.tickets_data import ticket_store
 
 log = logging.getLogger(__name__)
 
+PROFILE_SECONDS = 60  # default duration of /profile
+PROFILE_TOP = 25  # hot spots in the message, all are in the attached document
+
 
 def developer_command(func):
     """Decorator for commands only the developer is allowed to execute"""
 
+    @functools.wraps(func)
     def wrapper(update: Update, context: CallbackContext):
+        from src.config import DEVELOPER_CHAT_ID
+
         if update.effective_chat.id == DEVELOPER_CHAT_ID:
             func(update, context)
             message = "Successfully executed command."
@@ -176,12 +178,14 @@ def register(update: Update, context: CallbackContext) -> None:
 
     See `register_button` for more details on handling the inline-buttons.
     """
+    from src.config import GROUP_NAMES, GROUPS_LIST, ORGA_GROUPS
+
     if context.user_data.get("group_association"):
         unregister(update, context)
 
     name = " ".join(context.args)
-    if name and name.upper() in map(str.upper, ALL_GROUPS):
-        name_actual = ALL_GROUPS[list(map(str.upper, ALL_GROUPS)).index(name.upper())]
+    if name and name.casefold() in GROUP_NAMES:
+        name_actual = GROUP_NAMES[name.casefold()]
         register_group(update, context, name_actual)
         if name_actual in ORGA_GROUPS:
             from src.tickets import help2
@@ -206,12 +210,9 @@ def register_group(update: Update, context: CallbackContext, group_name: str):
     """
     context.user_data["group_association"] = group_name
     chat_id = update.effective_chat.id
-    if context.bot_data.get("group_association") is None:
-        context.bot_data["group_association"] = {}
-    if context.bot_data["group_association"].get(group_name) is None:
-        context.bot_data["group_association"][group_name] = [chat_id]
-    else:
-        context.bot_data["group_association"][group_name].append(chat_id)
+    # setdefault is atomic, updates of other chats might be handled concurrently
+    groups = context.bot_data.setdefault("group_association", {})
+    groups.setdefault(group_name, []).append(chat_id)
 
     association_msg(update, group_name)
     try:
@@ -271,10 +272,10 @@ def status(update: Update, context: CallbackContext) -> None:
             "Keine Gruppenmitgliedschaft.",
             reply_markup=autoselect_keyboard(update, context),
         )
-    open_tickets = []
-    for (uid, ticket) in context.bot_data.get("tickets", {}).items():
-        if ticket.group_requesting == group:
-            open_tickets.append(str(ticket))
+    open_tickets = [
+        str(ticket)
+        for ticket in ticket_store(context.bot_data, create=False).requesting(group)
+    ]
 
     if open_tickets:
         update.message.reply_text(
@@ -301,6 +302,8 @@ def register_button(update: Update, context: CallbackContext) -> None:
     """Parses the CallbackQuery for group registration.
     Registers user with selected group, or cancel registration.
     """
+    from src.config import GROUPS_LIST
+
     query = update.callback_query
 
     # for GROUP association updates
@@ -333,23 +336,16 @@ def task_button(update: Update, context: CallbackContext) -> None:
     from src.tickets import close_uid, wip_uid, revoke_uid
 
     try:
+        # None if someone else was faster, who is told by the functions
         if "wip #" in query.data:
-            uid = int(query.data[5:])
-            wip_uid(update, context, uid)
-            ticket = context.bot_data["tickets"].get(uid)
-            query.edit_message_text(text=f"{str(ticket)}")
+            if ticket := wip_uid(update, context, int(query.data[5:])):
+                query.edit_message_text(text=f"{str(ticket)}")
         elif "close #" in query.data:
-            uid = int(query.data[7:])
-            ticket = context.bot_data["tickets"].get(uid)
-            close_uid(update, context, uid)
-            ticket.close()
-            query.edit_message_text(text=f"{str(ticket)}")
+            if ticket := close_uid(update, context, int(query.data[7:])):
+                query.edit_message_text(text=f"{str(ticket)}")
         elif "revoke #" in query.data:
-            uid = int(query.data[8:])
-            ticket = context.bot_data["tickets"].get(uid)
-            revoke_uid(update, context, uid)
-            ticket.revoke()
-            query.edit_message_text(text=f"{str(ticket)}")
+            if ticket := revoke_uid(update, context, int(query.data[8:])):
+                query.edit_message_text(text=f"{str(ticket)}")
         elif "cancel" in query.data:
             query.edit_message_text(text="❌ Abgebrochen.")
     except ValueError as e:
@@ -397,8 +393,17 @@ def bug(update: Update, context: CallbackContext) -> None:
 @developer_command
 def resetall(update: Update, context: CallbackContext) -> None:
     """Developer command to reset all bot context data."""
+    from src.dashboard_bridge import mqtt_send_snapshots, mqtt_set_tickets
+    from src.journal import journal_snapshot
+
     log.critical("resetting all bot context data.")
     context.bot_data.clear()
+    tickets = ticket_store(context.bot_data)
+    # or the journal brings back the cleared tickets on the next start
+    journal_snapshot(tickets)
+    # dashboards must not keep showing the cleared tickets
+    mqtt_set_tickets(tickets)
+    mqtt_send_snapshots()
     dev_msg("☑️ successfully cleared all context data.")
 
 
@@ -409,7 +414,7 @@ def closeall(update: Update, context: CallbackContext) -> None:
 
     log.critical("closing all open tickets.")
     # cannot mutate dictionary while iteration
-    uids = [uid for uid in context.bot_data["tickets"].keys()]
+    uids = ticket_store(context.bot_data, create=False).keys()
     for uid in uids:
         close_uid(update, context, uid)
 
@@ -431,6 +436,79 @@ def system_status(update: Update, context: CallbackContext) -> None:
     dev_html(update, context, message)
 
 
+@developer_command
+def profile(update: Update, context: CallbackContext) -> None:
+    """Developer command to profile handlers with cProfile, for some seconds
+    or a number of updates: `/profile [seconds]`, `/profile <n> updates`, or
+    `/profile stop` to end early. Hot spots are sent to the developer.
+    """
+    from src.handlers import add_hook, remove_hook
+    from src.profiling import profiling_start, profiling_stop
+
+    args = context.args or []
+    if args[:1] == ["stop"]:
+        if not profiling_stop():
+            update.message.reply_text("Not profiling at the moment.")
+        return
+    try:
+        n = int(args[0]) if args else PROFILE_SECONDS
+        if n <= 0:
+            # would never end, or right away
+            raise ValueError(n)
+    except ValueError:
+        update.message.reply_text(
+            "Usage: /profile [seconds], /profile <n> updates or /profile stop"
+        )
+        return
+    by_updates = len(args) > 1 and args[1].startswith("update")
+
+    def done(session):
+        remove_hook(session.hook)
+        send_profile(update, context, session)
+
+    if by_updates:
+        session = profiling_start(done, updates=n)
+    else:
+        session = profiling_start(done, seconds=n)
+    if session is None:
+        update.message.reply_text("Profiling already, /profile stop ends it.")
+        return
+    add_hook(session.hook)
+    update.message.reply_text(
+        f"Profiling the next {n} updates." if by_updates else f"Profiling for {n}s."
+    )
+
+
+def send_profile(update: Update, context: CallbackContext, session):
+    """Send the hot spots of a profiling `session` to the developer, and
+    all of them as a document."""
+    import html
+    from src.config import DEVELOPER_CHAT_ID
+    from src.outbox import get_outbox
+
+    summary = (
+        f"⏱ Profile of {session.calls} handler calls in "
+        f"{session.stopped - session.started:.0f}s"
+    )
+    if session.skipped:
+        summary += f", {session.skipped} more ran in parallel unprofiled"
+    report = session.report(limit=PROFILE_TOP)
+    dev_html(update, context, f"{summary}\n<pre>{html.escape(report)}</pre>")
+    # bytes rather than a stream, which a retry after flood control would
+    # find consumed
+    document = session.report(sort="cumulative").encode()
+    get_outbox().put(
+        DEVELOPER_CHAT_ID,
+        functools.partial(
+            context.bot.send_document,
+            chat_id=DEVELOPER_CHAT_ID,
+            document=document,
+            filename="profile.txt",
+            caption=summary,
+        ),
+    )
+
+
 @developer_command
 def reset_counter(update: Update, context: CallbackContext) -> None:
     context.bot_data["highest_id"] = 0
@@ -0,0 +1,171 @@
+import collections
+import concurrent.futures
+import functools
+import heapq
+import itertools
+import logging
+import queue
+import threading
+import time
+
+from telegram import Update
+from telegram.ext import Dispatcher
+
+log = logging.getLogger(__name__)
+
+
+class Postpone(Exception):
+    """Raised by a job of a `KeyedExecutor` to be run again later, after the
+    `delay` of its key."""
+
+
+class KeyedExecutor:
+    """Run jobs on a pool of worker threads, strictly in order per key.
+
+    Jobs are kept in one lane per key. A lane is worked on by at most one
+    worker at a time, so jobs with the same key never overlap and keep their
+    order, while a slow key only ever occupies a single worker.
+
+    `delay(key)`, if given, returns the seconds the next job of `key` has to
+    wait, e.g. for a rate limit. Meanwhile, the lane is put aside instead of
+    occupying a worker.
+    """
+
+    def __init__(
+        self,
+        workers: int,
+        max_pending: int = None,
+        name: str = "keyed",
+        delay=None,
+    ):
+        self._lanes = {}  # key -> deque of jobs, present while scheduled
+        self._ready = queue.Queue()  # keys waiting for a worker
+        self._slots = threading.BoundedSemaphore(max_pending) if max_pending else None
+        self._lock = threading.Lock()
+        self._delay = delay
+        self._delayed = []  # heap of (due, order, key), keys waiting for `delay`
+        self._order = itertools.count()  # keys might not be comparable
+        self._timer = threading.Condition()
+        self._stopped = False
+        self._threads = [
+            threading.Thread(target=self._work, name=f"{name}-{i}", daemon=True)
+            for i in range(workers)
+        ]
+        if delay:
+            self._threads.append(
+                threading.Thread(target=self._wake, name=f"{name}-timer", daemon=True)
+            )
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, key, func, *args, timeout: float = None, **kwargs):
+        """Schedule `func(*args, **kwargs)` after all other jobs for `key`.
+        Returns a future for its result.
+
+        Raises `queue.Full` if there still is no room for the job after
+        `timeout` seconds.
+        """
+        if self._slots and not self._slots.acquire(timeout=timeout):
+            raise queue.Full(key)
+        future = concurrent.futures.Future()
+        job = (functools.partial(func, *args, **kwargs), future)
+        with self._lock:
+            lane = self._lanes.get(key)
+            if lane is None:
+                self._lanes[key] = collections.deque([job])
+                self._ready.put(key)
+            else:
+                lane.append(job)
+        return future
+
+    def pending(self) -> int:
+        """Number of jobs not yet done."""
+        with self._lock:
+            return sum(len(lane) for lane in self._lanes.values())
+
+    def stop(self, timeout: float = 10):
+        """Wait up to `timeout` seconds for pending jobs, then stop workers."""
+        deadline = time.monotonic() + timeout
+        while self.pending() and time.monotonic() < deadline:
+            time.sleep(0.05)
+        with self._timer:
+            self._stopped = True
+            self._timer.notify()
+        for _ in self._threads:
+            self._ready.put(None)
+        for thread in self._threads:
+            thread.join(max(0, deadline - time.monotonic()))
+
+    def _work(self):
+        while (key := self._ready.get()) is not None:
+            if self._delay and (seconds := self._delay(key)) > 0:
+                self._put_aside(key, seconds)
+                continue
+            with self._lock:
+                func, future = self._lanes[key][0]
+            try:
+                future.set_result(func())
+            except Postpone:
+                # stays first in its lane, and waits for `delay` again
+                self._ready.put(key)
+                continue
+            except Exception as e:
+                future.set_exception(e)
+            with self._lock:
+                lane = self._lanes[key]
+                lane.popleft()
+                if lane:
+                    # back of the line, so busy keys don't starve the others
+                    self._ready.put(key)
+                else:
+                    del self._lanes[key]
+            if self._slots:
+                self._slots.release()
+
+    def _put_aside(self, key, seconds: float):
+        with self._timer:
+            due = time.monotonic() + seconds
+            heapq.heappush(self._delayed, (due, next(self._order), key))
+            self._timer.notify()
+
+    def _wake(self):
+        """Hand keys put aside back to the workers once their delay is over."""
+        with self._timer:
+            while not self._stopped:
+                now = time.monotonic()
+                while self._delayed and self._delayed[0][0] <= now:
+                    self._ready.put(heapq.heappop(self._delayed)[2])
+                self._timer.wait(self._delayed[0][0] - now if self._delayed else None)
+
+
+class ChatSerialDispatcher(Dispatcher):
+    """Dispatcher handling updates from different chats in parallel on
+    `chat_workers` threads. Updates from the same chat are still handled one
+    after another and in order, so conversation states stay consistent.
+    """
+
+    def __init__(self, *args, chat_workers: int = 4, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.chat_workers = chat_workers
+        self._chats = KeyedExecutor(chat_workers, name="updates")
+
+    def process_update(self, update: object) -> None:
+        if isinstance(update, Update) and update.effective_chat:
+            future = self._chats.submit(
+                update.effective_chat.id, super().process_update, update
+            )
+            future.add_done_callback(self._log_failure)
+        else:
+            super().process_update(update)
+
+    def _log_failure(self, future: concurrent.futures.Future):
+        if future.exception():
+            log.error("🔴 Processing update failed", exc_info=future.exception())
+
+    def pending(self) -> int:
+        """Number of updates taken from the update queue but not yet handled."""
+        return self._chats.pending()
+
+    def stop(self) -> None:
+        super().stop()
+        self._chats.stop()
@@ -1,42 +1,41 @@
 from pathlib import Path
 import json
-
+import logging
+import time
 
 LOGGING_FORMAT = "%(asctime)s [%(funcName)s]: %(message)s"
 
+log = logging.getLogger(__name__)
+
 ROOT = Path(".")
 SECRETS_DIR = ROOT / "unifest-secrets"
+# all secrets in one file, keyed by the names of the separate files without
+# ".json", e.g. {"token": "...", "groups": [...], ..., "mqtt": {}}. Used
+# instead of the separate files if it exists.
+BUNDLE = "config.json"
 
-
-def load_json(filename):
-    with open(SECRETS_DIR / filename, "r") as f:
-        return json.load(f)
-
-
-TOKEN = load_json("token.json")  # str                    # Token of telegram-bot
-GROUPS_LIST = load_json("groups.json")  # [str]           # main list of groups that can write tickets
-MAPPING = load_json("mapping.json")  # dict: str -> str   # maps each group to a location.
-UPDATES_CHANNEL_ID = load_json("channel.json")  # int     # channel to log various updates to
-DEVELOPER_CHAT_ID = load_json("developer.json")  # int    # chat id of developer for additional system messages
-ORGA_GROUPS = load_json("orga.json")  # [str]             # list of orga-groups that can get tickets and work on them
-HIDDEN_GROUPS = load_json("hidden.json")  # [str]         # list of additional (hidden) groups that can write tickets
-
-ALL_GROUPS = GROUPS_LIST + ORGA_GROUPS + HIDDEN_GROUPS
-
-# If not used, create json file with "{}" as file content
-MQTT_HOST = None  # str | None
-MQTT_PORT = None  # int | None
-MQTT_USER = None  # str | None
-MQTT_PASS = None  # str | None
-
-_mqtt = load_json("mqtt.json")
-if _mqtt:
-    MQTT_HOST = _mqtt["host"]
-    MQTT_PORT = _mqtt["port"]
-    MQTT_USER = _mqtt["user"]
-    MQTT_PASS = _mqtt["pass"]
-
-CONNECT_BROKER = MQTT_HOST and MQTT_PORT and MQTT_USER and MQTT_PASS
+# Secrets are read from SECRETS_DIR on first use, e.g. when importing them,
+# not when importing this module, and again when their files changed, see
+# `__getattr__`. Import them where they are used, to see changes:
+# TOKEN               # str             # Token of telegram-bot
+# GROUPS_LIST         # [str]           # main list of groups that can write tickets
+# MAPPING             # dict: str -> str   # maps each group to a location.
+# UPDATES_CHANNEL_ID  # int             # channel to log various updates to
+# DEVELOPER_CHAT_ID   # int             # chat id of developer for additional system messages
+# ORGA_GROUPS         # [str]           # list of orga-groups that can get tickets and work on them
+# HIDDEN_GROUPS       # [str]           # list of additional (hidden) groups that can write tickets
+#
+# ALL_GROUPS          # [str]           # all of the above groups
+# GROUP_NAMES         # dict: str -> str   # case-folded name -> name, of ALL_GROUPS
+#
+# If not used, create mqtt.json with "{}" as file content
+# MQTT_HOST           # str | None
+# MQTT_PORT           # int | None
+# MQTT_USER           # str | None
+# MQTT_PASS           # str | None
+# MQTT_COALESCE_MS    # int    # window to collapse updates of the same ticket in, 0 to disable (default 50)
+# MQTT_WIRE_FORMAT    # str    # encoding of tickets for the dashboard, "json" or "msgpack" (default "json")
+# CONNECT_BROKER      # bool
 
 # options for state machine. You still need to manually adapt regex and
 # functions too.
@@ -51,3 +50,158 @@ AMOUNT_OPTIONS = [["0", "/cancel"], ["~10", "~20", "~50"]]
 INITIAL_KEYBOARD = [["/help", "/register"]]
 MAIN_KEYBOARD = [["/help", "/status"], ["/request"]]
 ORGA_KEYBOARD = [["/help", "/help2", "/all"], ["/tickets", "/wip", "/close"]]
+
+
+class ConfigError(Exception):
+    """The secrets are missing or malformed."""
+
+
+def _is_str_list(value) -> bool:
+    return isinstance(value, list) and all(isinstance(v, str) for v in value)
+
+
+def _is_int(value) -> bool:
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+# file -> (check, expected content)
+SCHEMA = {
+    "token.json": (lambda v: isinstance(v, str) and ":" in v, "the bot token"),
+    "groups.json": (_is_str_list, "a list of group names"),
+    "mapping.json": (
+        lambda v: isinstance(v, dict) and all(isinstance(x, str) for x in v.values()),
+        "an object of group name -> location",
+    ),
+    "channel.json": (_is_int, "a chat id"),
+    "developer.json": (_is_int, "a chat id"),
+    "orga.json": (_is_str_list, "a list of group names"),
+    "hidden.json": (_is_str_list, "a list of group names"),
+    "mqtt.json": (lambda v: isinstance(v, dict), 'an object, "{}" without broker'),
+}
+
+CHECK_INTERVAL = 1  # seconds between checking the files for changes
+
+_cache = None  # (directory, files and their mtimes, values)
+_checked = 0.0  # time.monotonic() of the last check
+
+
+def load_config() -> dict:
+    """Read and validate the secrets, and derive lookups from them. Returns
+    all values by name. Files are parsed once, and again only if changed
+    since, which is checked at most every `CHECK_INTERVAL` seconds. Raises
+    `ConfigError` if they are missing or malformed."""
+    global _cache, _checked
+    if _cache and time.monotonic() - _checked < CHECK_INTERVAL:
+        return _cache[1]
+    _checked = time.monotonic()
+    if (SECRETS_DIR / BUNDLE).exists():
+        files = [BUNDLE]
+    else:
+        files = list(SCHEMA)
+    try:
+        # relative to the working directory, which may have changed
+        signature = (SECRETS_DIR.resolve(), files) + tuple(
+            (SECRETS_DIR / f).stat().st_mtime_ns for f in files
+        )
+    except FileNotFoundError as e:
+        raise ConfigError(f"{e.filename} is missing") from None
+    if _cache and _cache[0] == signature:
+        return _cache[1]
+
+    if files == [BUNDLE]:
+        bundle = _load_json(BUNDLE)
+        if not isinstance(bundle, dict):
+            raise ConfigError(f"{SECRETS_DIR / BUNDLE} is not an object")
+        keys = {f: f.removesuffix(".json") for f in SCHEMA}
+        if missing := [key for key in keys.values() if key not in bundle]:
+            raise ConfigError(f"{SECRETS_DIR / BUNDLE} lacks {', '.join(missing)}")
+        data = {f: bundle[key] for f, key in keys.items()}
+        where = {f: f"{SECRETS_DIR / BUNDLE}, {key}" for f, key in keys.items()}
+    else:
+        data = {f: _load_json(f) for f in SCHEMA}
+        where = {f: str(SECRETS_DIR / f) for f in SCHEMA}
+    for f, (check, expected) in SCHEMA.items():
+        if not check(data[f]):
+            raise ConfigError(f"{where[f]}: expected {expected}")
+
+    values = _derive(data, where)
+    _cache = (signature, values)
+    return values
+
+
+def _load_json(filename):
+    try:
+        with open(SECRETS_DIR / filename, "r") as f:
+            return json.load(f)
+    except json.JSONDecodeError as e:
+        raise ConfigError(f"{SECRETS_DIR / filename} is no valid JSON: {e}") from None
+
+
+def _derive(data: dict, where: dict) -> dict:
+    groups = data["groups.json"]
+    orga = data["orga.json"]
+    hidden = data["hidden.json"]
+    mapping = data["mapping.json"]
+    all_groups = groups + orga + hidden
+
+    names = {}
+    for group in all_groups:
+        if group.casefold() in names:
+            raise ConfigError(f"Group {group} is listed twice")
+        names[group.casefold()] = group
+    unmapped = [group for group in groups + hidden if group not in mapping]
+    if unmapped:
+        raise ConfigError(
+            f"{where['mapping.json']} lacks a location for " + ", ".join(unmapped)
+        )
+
+    mqtt = data["mqtt.json"]
+    if mqtt:
+        missing = [key for key in ("host", "port", "user", "pass") if key not in mqtt]
+        if missing:
+            raise ConfigError(f"{where['mqtt.json']} lacks {', '.join(missing)}")
+        if mqtt.get("wire_format", "json") not in ("json", "msgpack"):
+            raise ConfigError(
+                f"{where['mqtt.json']}: wire_format is neither json nor msgpack"
+            )
+    values = {
+        "TOKEN": data["token.json"],
+        "GROUPS_LIST": groups,
+        "MAPPING": mapping,
+        "UPDATES_CHANNEL_ID": data["channel.json"],
+        "DEVELOPER_CHAT_ID": data["developer.json"],
+        "ORGA_GROUPS": orga,
+        "HIDDEN_GROUPS": hidden,
+        "ALL_GROUPS": all_groups,
+        "GROUP_NAMES": names,
+        "MQTT_HOST": mqtt.get("host"),
+        "MQTT_PORT": mqtt.get("port"),
+        "MQTT_USER": mqtt.get("user"),
+        "MQTT_PASS": mqtt.get("pass"),
+        "MQTT_COALESCE_MS": mqtt.get("coalesce_ms", 50),
+        "MQTT_WIRE_FORMAT": mqtt.get("wire_format", "json"),
+    }
+    values["CONNECT_BROKER"] = bool(
+        values["MQTT_HOST"]
+        and values["MQTT_PORT"]
+        and values["MQTT_USER"]
+        and values["MQTT_PASS"]
+    )
+    return values
+
+
+def __getattr__(name: str):
+    """Look up secrets, loading them on first use and after changes."""
+    if name.startswith("_") or not name.isupper():
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    try:
+        values = load_config()
+    except ConfigError as e:
+        if _cache is None:
+            raise
+        # rather than failing in every handler until the files are fixed
+        log.error(f"🔴 Keeping the previous configuration: {e}")
+        values = _cache[1]
+    if name not in values:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    return values[name]
@@ -1,16 +1,167 @@
+import copy
 import json
 import socket
+import sqlite3
 import logging
+import threading
+import time
 
 import paho.mqtt.client as mqtt
 
-from src.config import MQTT_HOST, MQTT_PASS, MQTT_PORT, MQTT_USER
-from src.tickets_data import Ticket, TicketStatus
+from src.metrics import counter, gauge
+from src.tickets_data import Ticket, TicketStatus, TicketStore
+from src.wire import encode, encode_snapshot, encode_ticket
 
 log = logging.getLogger(__name__)
 
 _client = None
+_connected = False
+_offline = None
 _tickets = {}
+# off where dashboards get snapshots over HTTP instead
+_mqtt_snapshots = True
+
+# ticket updates waiting for the end of the coalescing window, topic -> Ticket
+_pending = {}
+# groups whose snapshot was requested by a dashboard
+_resync = set()
+_pending_lock = threading.Lock()
+_flush_timer = None
+_stats = {"updates": 0, "publishes": 0, "saved": 0, "snapshots": 0, "resyncs": 0}
+
+MQTT_PUBLISHES = counter(
+    "mqtt_publishes_total", "Messages handed to the MQTT client", ["retain"]
+)
+# QoS 1 messages sent but not yet acknowledged by the broker
+gauge(
+    "mqtt_inflight",
+    "MQTT messages waiting for the broker's acknowledgement",
+    func=lambda: len(_client._out_messages) if _client else 0,
+)
+gauge("mqtt_connected", "Whether the bridge is connected", func=lambda: int(_connected))
+for _key, _help in {
+    "updates": "Ticket updates handed to the dashboard bridge",
+    "publishes": "Ticket updates published",
+    "saved": "Ticket updates saved by coalescing",
+    "snapshots": "Snapshots published",
+    "resyncs": "Snapshots requested by dashboards",
+}.items():
+    counter(f"dashboard_{_key}_total", _help, func=lambda key=_key: _stats[key])
+gauge(
+    "dashboard_offline_depth",
+    "Publishes buffered while the broker is unreachable",
+    func=lambda: _offline.depth() if _offline else 0,
+)
+gauge(
+    "dashboard_offline_age_seconds",
+    "Age of the oldest buffered publish",
+    func=lambda: _offline.age() if _offline else 0.0,
+)
+
+# sequence numbers of ticket updates per orga group. A new epoch each run, so
+# dashboards notice when numbering starts over.
+_epoch = int(time.time())
+_seq = {}
+# assigning sequence numbers and publishing happens under this lock, so they
+# reach the broker in order
+_publish_lock = threading.RLock()
+
+# seconds between two refreshes of the retained snapshots after ticket
+# changes. Dashboards follow the updates in between, and ask for a snapshot
+# on `tickets/_resync` when they notice a gap, e.g. after connecting.
+SNAPSHOT_INTERVAL = 5
+_stale = set()  # orga groups changed since their last snapshot
+_snapshot_due = 0.0  # time.monotonic() from which the next refresh may happen
+_snapshot_timer = None
+# whether retained single tickets of earlier versions were cleared
+_retained_cleared = False
+
+OFFLINE_MAX = 10_000
+
+
+class OfflineBuffer:
+    """Publishes held on disk while the broker is unreachable, so they
+    survive a restart of the bot. Only the latest message per topic is kept,
+    and at most `max_messages`, dropping the oldest.
+    """
+
+    def __init__(self, filename: str, max_messages: int = OFFLINE_MAX):
+        self.max_messages = max_messages
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(filename, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS messages (id INTEGER PRIMARY KEY, "
+            "topic TEXT UNIQUE NOT NULL, payload BLOB, retain INTEGER NOT NULL, "
+            "queued_at REAL NOT NULL)"
+        )
+
+    def put(self, topic: str, payload, retain: bool):
+        # replacing moves the topic to the end, so messages stay in order
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO messages (topic, payload, retain, queued_at) "
+                "VALUES (?, ?, ?, ?)",
+                (topic, payload, retain, time.time()),
+            )
+            dropped = self._db.execute(
+                "DELETE FROM messages WHERE id IN (SELECT id FROM messages "
+                "ORDER BY id DESC LIMIT -1 OFFSET ?)",
+                (self.max_messages,),
+            ).rowcount
+        if dropped:
+            log.warning(f"🔴 Dashboard offline buffer full, dropped {dropped}")
+
+    def drain(self, publish) -> int:
+        """Call `publish(topic, payload, retain)` for every message, oldest
+        first, and forget them."""
+        with self._lock, self._db:
+            rows = self._db.execute(
+                "SELECT topic, payload, retain FROM messages ORDER BY id"
+            ).fetchall()
+            for topic, payload, retain in rows:
+                publish(topic, payload, bool(retain))
+            self._db.execute("DELETE FROM messages")
+        return len(rows)
+
+    def depth(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+
+    def age(self) -> float:
+        """Seconds the oldest message has been waiting."""
+        with self._lock:
+            (oldest,) = self._db.execute(
+                "SELECT MIN(queued_at) FROM messages"
+            ).fetchone()
+        return time.time() - oldest if oldest else 0.0
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+def orga_topic(group: str) -> str:
+    """Topic of everything dashboards of orga `group` need to subscribe to,
+    as `tickets/<orga>/#`. Lowercase, as in the dashboard's URL."""
+    name = group.casefold()
+    for c in "/+#":
+        name = name.replace(c, "_")
+    return f"tickets/{name}"
+
+
+def ticket_topic(ticket: Ticket) -> str:
+    return f"{orga_topic(ticket.group_tasked)}/{ticket.uid}"
+
+
+def orga_group(name: str) -> str:
+    """Orga group with topic `tickets/<name>`, or None."""
+    from src.config import ORGA_GROUPS
+
+    for group in ORGA_GROUPS:
+        if orga_topic(group) == orga_topic(name):
+            return group
+    return None
 
 
 def mqtt_set_tickets(tickets: dict):
@@ -18,30 +169,127 @@ def mqtt_set_tickets(tickets: dict):
     _tickets = tickets
 
 
-def mqtt_send_all_tickets():
-    global _tickets
+def mqtt_set_snapshots(enabled: bool):
+    """Whether to publish snapshots (and answer resync requests) over MQTT."""
+    global _mqtt_snapshots
+    _mqtt_snapshots = enabled
+
+
+def dashboard_snapshot(tickets: dict, group: str = None, format: str = "json"):
+    """Snapshot of the open tickets (of orga `group`) in `tickets`, encoded
+    in `format`, including updates numbered up to now."""
+    with _publish_lock:
+        if group is None:
+            selected = tickets.values()
+            seqs = dict(_seq)
+        else:
+            if isinstance(tickets, TicketStore):
+                selected = tickets.tasked(group)
+            else:
+                selected = [t for t in tickets.values() if t.group_tasked == group]
+            seqs = {group: _seq.get(group, 0)}
+        selected = [
+            t for t in selected if t.status in (TicketStatus.OPEN, TicketStatus.WIP)
+        ]
+        return encode_snapshot(selected, _epoch, seqs, format)
+
 
-    for t in _tickets.values():
-        dashboard_publish(f"tickets/{t.group_tasked}/{t.uid}", t)
+def dashboard_sequence(group: str = None) -> int:
+    """Number of ticket updates published so far (for orga `group`), as
+    included in snapshots."""
+    with _publish_lock:
+        return sum(_seq.values()) if group is None else _seq.get(group, 0)
+
+
+def mqtt_send_snapshots(groups: set = None):
+    """Publish retained snapshots of all open tickets, to `tickets/_snapshot`
+    and to `<orga_topic>/_snapshot` of every orga group (or only of
+    `groups`). Dashboards bootstrap from these, ticket updates themselves are
+    not retained.
+    """
+    from src.config import MQTT_WIRE_FORMAT, ORGA_GROUPS
+
+    if not _client or not _mqtt_snapshots:
+        return
+
+    snapshots = {"tickets/_snapshot": None}
+    for group in ORGA_GROUPS if groups is None else groups & set(ORGA_GROUPS):
+        snapshots[f"{orga_topic(group)}/_snapshot"] = group
+    with _publish_lock:
+        for topic, group in snapshots.items():
+            payload = dashboard_snapshot(_tickets, group, MQTT_WIRE_FORMAT)
+            _send(topic, payload, retain=True)
+    with _pending_lock:
+        _stats["snapshots"] += len(snapshots)
 
 
 def on_connect(client, userdata, flags, reasonCode, properties=None):
+    global _connected
     if not reasonCode == 0:
         return
 
-    mqtt_send_all_tickets()
+    client.subscribe("tickets/_resync", qos=1)
+    with _publish_lock:
+        _connected = True
+        if _offline:
+            if sent := _offline.drain(_client_publish):
+                log.info(f"Sent {sent} dashboard updates buffered while offline")
+        _clear_retained_tickets()
+        # the broker might have restarted and lost the retained snapshots
+        mqtt_send_snapshots()
+
+
+def _clear_retained_tickets():
+    """Once per run, clear the retained messages of open tickets, which
+    earlier versions published for every ticket update. Dashboards would
+    replay them on every reconnect."""
+    global _retained_cleared
+    if _retained_cleared:
+        return
+    _retained_cleared = True
+    for ticket in _tickets.values():
+        _client_publish(ticket_topic(ticket), b"", retain=True)
+
+
+def on_disconnect(client, userdata, rc, properties=None):
+    global _connected
+    with _publish_lock:
+        _connected = False
+
+
+def on_resync(client, userdata, message):
+    """A dashboard missed updates, and asks for the snapshot of the orga
+    group in the payload (or of all tickets, if empty)."""
+    name = message.payload.decode(errors="replace").strip()
+    group = orga_group(name)
+    if name and not group or not _mqtt_snapshots:
+        return
+    groups = {group} if group else set()
+    with _pending_lock:
+        _stats["resyncs"] += 1
+        # requests of several dashboards are answered at once
+        _resync.update(groups)
+        _resync.add(None)
+    _schedule_flush()
+
 
+def dashboard_init(offline_file: str = "dashboard_offline.sqlite"):
+    from src.config import MQTT_HOST, MQTT_PASS, MQTT_PORT, MQTT_USER
 
-def dashboard_init():
     log.info("Initializing connection to MQTT broker")
     global _client
     global _tickets
+    global _offline
+    # publishes while the broker is unreachable, kept across restarts
+    _offline = OfflineBuffer(offline_file)
     _client = mqtt.Client(
         client_id=socket.gethostname(), clean_session=False, transport="websockets"
     )
     _client.username_pw_set(MQTT_USER, MQTT_PASS)
     _client.enable_logger()
     _client.on_connect = on_connect
+    _client.on_disconnect = on_disconnect
+    _client.message_callback_add("tickets/_resync", on_resync)
 
     # will not fail if no connection can be established but continuously try (re)connecting
     _client.connect_async(MQTT_HOST, MQTT_PORT)
@@ -53,30 +301,136 @@ def dashboard_init():
 
 
 def dashboard_publish(topic: str, message):
+    """Publish `message` to `topic`. Tickets are held back for a short window
+    (`coalesce_ms` in mqtt.json), so only the latest of several updates to the
+    same ticket within it is published, followed by the affected snapshots.
+    """
     global _client
 
     if not _client:
         return
 
-    retain = True
+    if not isinstance(message, Ticket):
+        _publish(topic, message)
+        return
+
+    with _pending_lock:
+        _stats["updates"] += 1
+        if topic in _pending:
+            _stats["saved"] += 1
+        # copy, the ticket may change again before the window ends
+        _pending[topic] = copy.copy(message)
+    _schedule_flush()
+
+
+def _schedule_flush():
+    from src.config import MQTT_COALESCE_MS
+
+    global _flush_timer
+
+    if MQTT_COALESCE_MS <= 0:
+        dashboard_flush()
+        return
+    with _pending_lock:
+        if _flush_timer is None:
+            _flush_timer = threading.Timer(MQTT_COALESCE_MS / 1000, dashboard_flush)
+            _flush_timer.daemon = True
+            _flush_timer.start()
+
+
+def dashboard_flush():
+    """Publish all held back ticket updates and requested snapshots now."""
+    global _pending, _resync, _flush_timer
+
+    with _publish_lock:
+        with _pending_lock:
+            pending, _pending = _pending, {}
+            resync, _resync = _resync, set()
+            if _flush_timer:
+                _flush_timer.cancel()
+                _flush_timer = None
+        for topic, ticket in pending.items():
+            _publish(topic, ticket)
+        if resync:
+            # dashboards are waiting for these
+            mqtt_send_snapshots(resync - {None})
+        with _pending_lock:
+            _stale.update(ticket.group_tasked for ticket in pending.values())
+        _refresh_snapshots()
+
+
+def _refresh_snapshots(now: bool = False):
+    """Re-publish the snapshots of the orga groups changed since their last
+    one, at most every `SNAPSHOT_INTERVAL` seconds (unless `now`)."""
+    global _stale, _snapshot_due, _snapshot_timer
+
+    with _publish_lock:
+        with _pending_lock:
+            if not _stale:
+                return
+            wait = _snapshot_due - time.monotonic()
+            if wait > 0 and not now:
+                if _snapshot_timer is None:
+                    _snapshot_timer = threading.Timer(wait, _snapshot_timer_fired)
+                    _snapshot_timer.daemon = True
+                    _snapshot_timer.start()
+                return
+            groups, _stale = _stale, set()
+            _snapshot_due = time.monotonic() + SNAPSHOT_INTERVAL
+        mqtt_send_snapshots(groups)
+
+
+def _snapshot_timer_fired():
+    global _snapshot_timer
+    with _pending_lock:
+        _snapshot_timer = None
+    _refresh_snapshots()
+
+
+def dashboard_stats() -> dict:
+    """Counters of ticket updates, MQTT publishes, publishes saved by
+    coalescing and snapshots published, and the number and age in seconds of
+    publishes waiting for the broker."""
+    with _pending_lock:
+        stats = dict(_stats)
+    stats["offline_depth"] = _offline.depth() if _offline else 0
+    stats["offline_age"] = _offline.age() if _offline else 0.0
+    return stats
+
+
+def _publish(topic: str, message):
+    from src.config import MQTT_WIRE_FORMAT
+
     if isinstance(message, Ticket):
-        if (
-            message.status == TicketStatus.CLOSED
-            or message.status == TicketStatus.REVOKED
-        ):
-            _client.publish(topic, None, qos=1, retain=True)
-            retain = False
-        message = {
-            "group_requesting": message.group_requesting,
-            "group_tasked": message.group_tasked,
-            "text": message.text,
-            "uid": message.uid,
-            "who": message.who,
-            "status": message.status.name,
-        }
+        with _pending_lock:
+            _stats["publishes"] += 1
+        group = message.group_tasked
+        with _publish_lock:
+            seq = _seq[group] = _seq.get(group, 0) + 1
+            payload = encode_ticket(message, _epoch, seq, MQTT_WIRE_FORMAT)
+            # current state is in the snapshots, updates are not retained
+            _send(topic, payload, retain=False)
+            if message.status in (TicketStatus.CLOSED, TicketStatus.REVOKED):
+                # in case an earlier version retained the ticket
+                _send(topic, b"", retain=True)
+        return
+
     if not isinstance(message, str):
-        message = json.dumps(message, indent=2)
-    _client.publish(topic, message, qos=1, retain=retain)
+        message = encode(message)
+    _send(topic, message, retain=True)
+
+
+def _send(topic: str, payload, retain: bool):
+    with _publish_lock:
+        if _connected or not _offline:
+            _client_publish(topic, payload, retain)
+        else:
+            _offline.put(topic, payload, retain)
+
+
+def _client_publish(topic: str, payload, retain: bool):
+    _client.publish(topic, payload, qos=1, retain=retain)
+    MQTT_PUBLISHES.inc(retain=str(retain).lower())
 
 
 def is_dashboard():
@@ -102,8 +456,15 @@ def dashboard_stop():
     if not _client:
         return
 
+    dashboard_flush()
+    _refresh_snapshots(now=True)
+    with _pending_lock:
+        if _snapshot_timer:
+            _snapshot_timer.cancel()
+    log.info(f"Dashboard publishing: {dashboard_stats()}")
     _client.loop_stop()
     _client.publish(
         "status", json.dumps({"status": "BOT_DISCONNECTED"}), qos=1, retain=True
     )
     _client.disconnect()
+    _offline.close()
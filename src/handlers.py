@@ -0,0 +1,216 @@
+import functools
+import logging
+
+from telegram.ext import (
+    Dispatcher,
+    Filters,
+    CommandHandler,
+    MessageHandler,
+    CallbackQueryHandler,
+    ConversationHandler,
+    TypeHandler,
+)
+
+from src.commands import (
+    error_handler,
+    start,
+    help,
+    unknown,
+    register,
+    unregister,
+    status,
+    details,
+    register_button,
+    task_button,
+    feature,
+    bug,
+    resetall,
+    closeall,
+    reset_counter,
+    profile,
+    system_status,
+)
+from src.states import (
+    reset_user,
+    cancel,
+    request,
+    money,
+    cups,
+    free_next,
+    ask_amount,
+    amount,
+    collect,
+    change,
+    free,
+    REQUEST,
+    MONEY,
+    CUPS,
+    AMOUNT,
+    FREE,
+)
+from src.tickets import (
+    close,
+    wip,
+    all,
+    tickets,
+    help2,
+    message,
+    dashboard,
+    revoke,
+    history,
+)
+from src.utils import MemberBlocked, remove_blocked_member
+
+log = logging.getLogger(__name__)
+
+# functions `hook(name, call)` run around every handler callback, see `add_hook`
+_hooks = []
+
+
+def add_handlers(dispatcher: Dispatcher):
+    """Register all commands, conversations and buttons of the bot."""
+    dispatcher.add_handler(CommandHandler("start", start))
+
+    dispatcher.add_handler(
+        CallbackQueryHandler(task_button, pattern="^(cancel|wip|close|revoke) #[0-9]+$")
+    )
+    dispatcher.add_handler(CallbackQueryHandler(register_button))
+
+    # large request handler
+    dispatcher.add_handler(
+        ConversationHandler(
+            entry_points=[CommandHandler("request", request)],
+            states={
+                REQUEST: [
+                    MessageHandler(Filters.regex("^Geld$"), money),
+                    MessageHandler(Filters.regex("^Becher$"), cups),
+                    MessageHandler(Filters.regex("^Sonstiges$"), free_next),
+                    MessageHandler(Filters.regex("^(Bier|Cocktail)$"), free_next),
+                    CommandHandler("cancel", cancel),
+                ],
+                MONEY: [
+                    MessageHandler(Filters.regex("^Geld Abholen$"), collect),
+                    MessageHandler(Filters.regex("^Freitext$"), free_next),
+                    MessageHandler(Filters.regex("^Wechselgeld$"), change),
+                    CommandHandler("cancel", cancel),
+                ],
+                CUPS: [
+                    MessageHandler(
+                        Filters.regex("^(Shotbecher|Normale Becher)$"), ask_amount
+                    ),
+                    MessageHandler(Filters.regex("^Normale Becher$"), ask_amount),
+                    MessageHandler(Filters.regex("^Dreckige Abholen$"), collect),
+                    CommandHandler("cancel", cancel),
+                ],
+                # and three options with free text fields
+                # BEER: [free_text],
+                # COCKTAIL: [free_text],
+                # OTHER: [free_text],
+                FREE: [
+                    MessageHandler(Filters.text & ~Filters.command, free),
+                    CommandHandler("cancel", cancel),
+                ],
+                AMOUNT: [
+                    MessageHandler(Filters.text & ~Filters.command, amount),
+                    CommandHandler("cancel", cancel),
+                ],
+            },
+            fallbacks=[
+                CommandHandler("cancel", cancel),
+            ],
+            name="ticket_requests",
+            persistent=True,
+        )
+    )
+
+    # regular commands for users
+    dispatcher.add_handler(CommandHandler("register", register))
+    dispatcher.add_handler(CommandHandler("unregister", unregister))
+
+    dispatcher.add_handler(CommandHandler("request", request))
+    dispatcher.add_handler(CommandHandler("bug", bug))
+    dispatcher.add_handler(CommandHandler("feature", feature))
+    dispatcher.add_handler(CommandHandler("help", help))
+    dispatcher.add_handler(CommandHandler("status", status))
+    dispatcher.add_handler(CommandHandler("revoke", revoke))
+
+    # hidden commands
+    # potentially helpful for debugging problems (not in help)
+    dispatcher.add_handler(CommandHandler("details", details))
+    dispatcher.add_handler(CommandHandler("reset", reset_user))
+
+    # Orga commands
+    # only available for groups in ORGA_GROUPS
+    dispatcher.add_handler(CommandHandler("help2", help2))
+    dispatcher.add_handler(CommandHandler("system", system_status))
+    dispatcher.add_handler(CommandHandler("all", all))
+    dispatcher.add_handler(CommandHandler("tickets", tickets))
+    dispatcher.add_handler(CommandHandler("history", history))
+    dispatcher.add_handler(CommandHandler("message", message))
+    dispatcher.add_handler(CommandHandler("close", close))
+    dispatcher.add_handler(CommandHandler("wip", wip))
+    dispatcher.add_handler(CommandHandler("dashboard", dashboard))
+
+    # Developer commands
+    # only available from DEVELOPER_CHAT_ID
+    dispatcher.add_handler(CommandHandler("resetall", resetall))
+    dispatcher.add_handler(CommandHandler("closeall", closeall))
+    dispatcher.add_handler(CommandHandler("resetcount", reset_counter))
+    dispatcher.add_handler(CommandHandler("profile", profile))
+
+    # members who blocked the bot, found while sending to their group
+    dispatcher.add_handler(TypeHandler(MemberBlocked, remove_blocked_member))
+
+    # register handlers for unknown commands and errors
+    dispatcher.add_handler(MessageHandler(Filters.command, unknown))
+    dispatcher.add_handler(MessageHandler(Filters.text & ~Filters.command, unknown))
+    dispatcher.add_error_handler(error_handler)
+
+    instrument_handlers(dispatcher)
+
+
+def add_hook(hook):
+    """Run `hook(name, call)` around every handler callback from now on.
+    `name` is the name of the callback (e.g. "request" or "amount"), and the
+    hook must return `call()`, the result of the callback. Hooks added later
+    run inside earlier ones.
+    """
+    _hooks.append(hook)
+
+
+def remove_hook(hook):
+    _hooks.remove(hook)
+
+
+def instrument_handlers(dispatcher: Dispatcher):
+    """Let the hooks run around the callbacks of all handlers of `dispatcher`,
+    including those within conversations."""
+    for handlers in dispatcher.handlers.values():
+        for handler in _nested(handlers):
+            if not getattr(handler.callback, "hooked", False):
+                handler.callback = _hooked(handler.callback)
+
+
+def _nested(handlers: list):
+    for handler in handlers:
+        if isinstance(handler, ConversationHandler):
+            yield from _nested(handler.entry_points)
+            for state in handler.states.values():
+                yield from _nested(state)
+            yield from _nested(handler.fallbacks)
+        else:
+            yield handler
+
+
+def _hooked(callback):
+    name = callback.__name__
+
+    @functools.wraps(callback)
+    def hooked(update, context):
+        call = functools.partial(callback, update, context)
+        for hook in reversed(tuple(_hooks)):
+            call = functools.partial(hook, name, call)
+        return call()
+
+    hooked.hooked = True
+    return hooked
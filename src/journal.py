@@ -0,0 +1,177 @@
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+
+from src.tickets_data import Ticket, TicketStatus, TicketStore
+
+log = logging.getLogger(__name__)
+
+SNAPSHOT_EVERY = 1000  # events between two snapshots
+
+_journal = None
+
+
+def ticket_to_dict(ticket: Ticket) -> dict:
+    return {
+        "uid": ticket.uid,
+        "group_requesting": ticket.group_requesting,
+        "group_tasked": ticket.group_tasked,
+        "text": ticket.text,
+        "who": ticket.who,
+        "status": ticket.status.name,
+    }
+
+
+def ticket_from_dict(data: dict) -> Ticket:
+    ticket = Ticket(
+        data["group_requesting"],
+        data["group_tasked"],
+        data["text"],
+        uid=data["uid"],
+        status=TicketStatus[data["status"]],
+    )
+    ticket.who = data["who"]
+    return ticket
+
+
+class TicketJournal:
+    """Append-only journal of all ticket transitions, with periodic snapshots.
+
+    `directory` holds `snapshot.json` with all open and WIP tickets up to some
+    sequence number, `journal.jsonl` with the events since, and the previous
+    journals as `journal-<seq>.jsonl` for auditing. Loading only has to replay
+    the events after the latest snapshot.
+    """
+
+    def __init__(self, directory: str, snapshot_every: int = SNAPSHOT_EVERY):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.snapshot_every = snapshot_every
+        self._lock = threading.Lock()
+        self._seq = 0  # sequence number of the last event
+        self._since_snapshot = 0
+        self._file = None
+
+    @property
+    def snapshot_path(self) -> Path:
+        return self.directory / "snapshot.json"
+
+    @property
+    def journal_path(self) -> Path:
+        return self.directory / "journal.jsonl"
+
+    def is_empty(self) -> bool:
+        return not (self.snapshot_path.exists() or self.journal_path.exists())
+
+    def load(self) -> TicketStore:
+        """Rebuild open and WIP tickets from the latest snapshot and the events
+        recorded after it.
+        """
+        tickets = {}
+        if self.snapshot_path.exists():
+            with open(self.snapshot_path) as file:
+                snapshot = json.load(file)
+            self._seq = snapshot["seq"]
+            for data in snapshot["tickets"]:
+                tickets[data["uid"]] = ticket_from_dict(data)
+        snapshot_seq = self._seq
+        replayed = 0
+        if self.journal_path.exists():
+            with open(self.journal_path) as file:
+                for line in file:
+                    try:
+                        event = json.loads(line)
+                    except json.JSONDecodeError:
+                        # last line was cut off by a crash
+                        log.warning(f"Skipping broken journal line: {line!r}")
+                        continue
+                    if event["seq"] <= snapshot_seq:
+                        continue
+                    self._seq = event["seq"]
+                    replayed += 1
+                    if event["status"] in ("CLOSED", "REVOKED"):
+                        tickets.pop(event["uid"], None)
+                    else:
+                        tickets[event["uid"]] = ticket_from_dict(event)
+        self._since_snapshot = replayed
+        log.info(
+            f"Loaded {len(tickets)} tickets from journal, "
+            f"replayed {replayed} events after snapshot #{snapshot_seq}"
+        )
+        store = TicketStore(tickets)
+        store.pop_dirty()
+        return store
+
+    def record(self, ticket: Ticket, tickets: TicketStore = None):
+        """Append the current state of `ticket`. Every `snapshot_every` events,
+        a snapshot of `tickets` is taken.
+        """
+        with self._lock:
+            if self._file is None:
+                self._file = open(self.journal_path, "a")
+            self._seq += 1
+            event = {"seq": self._seq, "ts": time.time(), **ticket_to_dict(ticket)}
+            self._file.write(json.dumps(event, ensure_ascii=False) + "\n")
+            self._file.flush()
+            self._since_snapshot += 1
+            if tickets is not None and self._since_snapshot >= self.snapshot_every:
+                self._snapshot(tickets)
+
+    def snapshot(self, tickets: TicketStore):
+        with self._lock:
+            self._snapshot(tickets)
+
+    def _snapshot(self, tickets: TicketStore):
+        # closed tickets might not yet be removed from the store
+        live = [
+            ticket_to_dict(t)
+            for t in tickets.values()
+            if t.status in (TicketStatus.OPEN, TicketStatus.WIP)
+        ]
+        tmp = self.snapshot_path.with_suffix(".tmp")
+        with open(tmp, "w") as file:
+            json.dump({"seq": self._seq, "tickets": live}, file, ensure_ascii=False)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp, self.snapshot_path)
+        # keep the events up to here for auditing, and start a new journal
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self.journal_path.exists():
+            self.journal_path.rename(self.directory / f"journal-{self._seq}.jsonl")
+        self._since_snapshot = 0
+        log.info(f"Journal snapshot #{self._seq} with {len(live)} tickets")
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def journal_init(directory: str) -> TicketJournal:
+    global _journal
+    _journal = TicketJournal(directory)
+    return _journal
+
+
+def journal_record(ticket: Ticket, tickets: TicketStore = None):
+    """Record the current state of `ticket` in the journal, if there is one."""
+    if _journal:
+        _journal.record(ticket, tickets)
+
+
+def journal_snapshot(tickets: TicketStore):
+    """Take a snapshot of `tickets` right away, if there is a journal. Events
+    before it are not loaded anymore."""
+    if _journal:
+        _journal.snapshot(tickets)
+
+
+def journal_stop():
+    if _journal:
+        _journal.close()
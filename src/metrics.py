@@ -0,0 +1,194 @@
+import bisect
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+log = logging.getLogger(__name__)
+
+# upper bounds in seconds, from a quick handler to flood control backing off
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+_metrics = {}  # name -> metric, in order of creation
+_server = None
+
+
+class Metric:
+    """Base of all metrics: values per combination of label values, or
+    `func()` to read the value from elsewhere when scraped (either a number,
+    or a dict of label values -> number)."""
+
+    type = None
+
+    def __init__(self, name: str, help: str, labels=(), func=None):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.func = func
+        self._lock = threading.Lock()
+        self._values = {}  # tuple of label values -> value
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels[label]) for label in self.labels)
+
+    def samples(self):
+        """(suffix, label values, value) of all values, to be rendered."""
+        if self.func is None:
+            with self._lock:
+                values = dict(self._values)
+        else:
+            values = self.func()
+            if not isinstance(values, dict):
+                values = {(): values}
+        for key, value in values.items():
+            yield "", key if isinstance(key, tuple) else (key,), value
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labels=(), buckets=BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            if (counts := self._values.get(key)) is None:
+                # observations per bucket (not cumulative), sum
+                counts = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            counts[0][bisect.bisect_left(self.buckets, value)] += 1
+            counts[1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the seconds spent within the `with` block."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        with self._lock:
+            values = {
+                k: (list(counts), total) for k, (counts, total) in self._values.items()
+            }
+        for key, (counts, total) in values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                yield "_bucket", key + (bound,), cumulative
+            yield "_sum", key, total
+            yield "_count", key, cumulative
+
+
+def _register(metric: Metric) -> Metric:
+    if metric.name in _metrics:
+        raise ValueError(f"Metric {metric.name} exists already")
+    _metrics[metric.name] = metric
+    return metric
+
+
+def counter(name: str, help: str, labels=(), func=None) -> Counter:
+    return _register(Counter(name, help, labels, func))
+
+
+def gauge(name: str, help: str, labels=(), func=None) -> Gauge:
+    return _register(Gauge(name, help, labels, func))
+
+
+def histogram(name: str, help: str, labels=(), buckets=BUCKETS) -> Histogram:
+    return _register(Histogram(name, help, labels, buckets))
+
+
+def render() -> str:
+    """All metrics in the Prometheus text exposition format."""
+    lines = []
+    for metric in list(_metrics.values()):
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.type}")
+        names = metric.labels + (("le",) if metric.type == "histogram" else ())
+        for suffix, key, value in metric.samples():
+            labels = ",".join(
+                f'{name}="{_escape(value)}"' for name, value in zip(names, key)
+            )
+            labels = f"{{{labels}}}" if labels else ""
+            lines.append(f"{metric.name}{suffix}{labels} {_number(value)}")
+    return "\n".join(lines) + "\n"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _number(value) -> str:
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+HANDLER_SECONDS = histogram(
+    "bot_handler_seconds", "Time spent in handler callbacks", ["handler"]
+)
+
+
+def time_handler(name: str, call):
+    """Hook for `src.handlers.add_hook`, timing every handler callback."""
+    with HANDLER_SECONDS.time(handler=name):
+        return call()
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """Serves all metrics at `/metrics`, for Prometheus to scrape."""
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        log.debug(format % args)
+
+
+def metrics_server_start(listen: str, port: int):
+    """Serve metrics over HTTP, in the background."""
+    global _server
+    _server = ThreadingHTTPServer((listen, port), MetricsHandler)
+    _server.daemon_threads = True
+    threading.Thread(
+        target=_server.serve_forever, name="metrics-server", daemon=True
+    ).start()
+    log.info(f"Serving metrics at http://{listen}:{port}/metrics")
+
+
+def metrics_server_stop():
+    global _server
+    if _server:
+        _server.shutdown()
+        _server.server_close()
+        _server = None
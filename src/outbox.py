@@ -0,0 +1,231 @@
+import concurrent.futures
+import functools
+import logging
+import queue
+import threading
+import time
+
+import telegram
+
+from src.concurrency import KeyedExecutor, Postpone
+from src.metrics import counter, gauge, histogram
+
+log = logging.getLogger(__name__)
+
+# Telegram allows about 30 messages per second in total, one message per
+# second to the same private chat (short bursts are tolerated) and 20 messages
+# per minute to the same group or channel.
+GLOBAL_RATE = 30  # messages per second
+GLOBAL_BURST = 30
+CHAT_RATE = 1  # messages per second
+CHAT_BURST = 3
+GROUP_RATE = 20 / 60  # messages per second
+GROUP_BURST = 5
+
+WORKERS = 4
+MAX_PENDING = 10000  # messages waiting in total, across all chats
+ENQUEUE_TIMEOUT = 0.5  # seconds a handler may block on a full outbox
+
+_outbox = None
+_outbox_lock = threading.Lock()
+
+SEND_SECONDS = histogram(
+    "telegram_send_seconds",
+    "Duration of sending a message from the outbox, by kind of chat",
+    ["chat"],
+)
+RETRY_AFTER = counter(
+    "telegram_retry_after_total",
+    "Sends hitting flood control, by kind of chat",
+    ["chat"],
+)
+SEND_ERRORS = counter(
+    "telegram_send_errors_total", "Failed sends from the outbox, by error", ["error"]
+)
+gauge(
+    "outbox_pending",
+    "Messages in the outbox not yet delivered",
+    func=lambda: _outbox.pending() if _outbox else 0,
+)
+
+
+class TokenBucket:
+    """Token bucket refilling `rate` tokens per second, holding at most `burst`.
+
+    Tokens are reserved up front, so the bucket may go into debt; the caller
+    then has to wait the returned amount of seconds before sending.
+    """
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.stamp = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """Take one token and return how long to wait until it may be used."""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+            self.stamp = now
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+            return max(wait, self.paused_until - now)
+
+    def delay(self) -> float:
+        """Return how long until a token is available, without taking it."""
+        with self.lock:
+            now = time.monotonic()
+            tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+            wait = (1 - tokens) / self.rate if tokens < 1 else 0.0
+            return max(wait, self.paused_until - now)
+
+    def pause(self, seconds: float):
+        """Hand out no tokens for the next `seconds`, e.g. after flood control."""
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+class OutboxFull(Exception):
+    """Raised (through the future) for messages dropped on a full outbox."""
+
+
+class Delivery:
+    """Handle on a number of enqueued messages, e.g. from one `group_msg`.
+
+    Callers may ignore it, or `wait` for all messages to be sent.
+    """
+
+    def __init__(self, futures=()):
+        self.futures = list(futures)
+
+    def __add__(self, other: "Delivery") -> "Delivery":
+        return Delivery(self.futures + other.futures)
+
+    def done(self) -> bool:
+        return all(f.done() for f in self.futures)
+
+    def wait(self, timeout: float = None) -> bool:
+        """Block until all messages are delivered (or failed). Return False if
+        `timeout` seconds passed before that.
+        """
+        _, pending = concurrent.futures.wait(self.futures, timeout)
+        return not pending
+
+    def errors(self) -> list:
+        """Exceptions of messages that could not be delivered (so far)."""
+        return [f.exception() for f in self.futures if f.done() and f.exception()]
+
+
+class Outbox:
+    """Bounded queue of outgoing messages, drained by a pool of worker threads.
+
+    Messages are kept in one lane per chat (see `KeyedExecutor`), so messages
+    to the same chat keep their order. A chat waiting for its rate limit or
+    under flood control is put aside without occupying a worker.
+    """
+
+    def __init__(self, workers: int = WORKERS, max_pending: int = MAX_PENDING):
+        self._global = TokenBucket(GLOBAL_RATE, GLOBAL_BURST)
+        self._chats = {}  # chat_id -> TokenBucket
+        self._lock = threading.Lock()
+        self._executor = KeyedExecutor(
+            workers, max_pending, name="outbox", delay=self._delay
+        )
+
+    def put(self, chat_id: int, send, on_error=None) -> concurrent.futures.Future:
+        """Schedule `send()` for `chat_id`. The returned future resolves to the
+        result of `send()`, or to `OutboxFull` if the outbox has no room.
+        """
+        try:
+            return self._executor.submit(
+                chat_id, self._deliver, chat_id, send, on_error, timeout=ENQUEUE_TIMEOUT
+            )
+        except queue.Full:
+            log.error(f"🔴 Outbox full, dropping message to {chat_id}")
+            future = concurrent.futures.Future()
+            future.set_exception(OutboxFull(chat_id))
+            return future
+
+    def pending(self) -> int:
+        """Number of messages not yet delivered."""
+        return self._executor.pending()
+
+    def stop(self, timeout: float = 10):
+        """Wait up to `timeout` seconds for pending messages, then stop workers."""
+        self._executor.stop(timeout)
+
+    def _bucket(self, chat_id: int) -> TokenBucket:
+        with self._lock:
+            if (bucket := self._chats.get(chat_id)) is None:
+                # negative ids belong to groups and channels
+                if chat_id < 0:
+                    bucket = TokenBucket(GROUP_RATE, GROUP_BURST)
+                else:
+                    bucket = TokenBucket(CHAT_RATE, CHAT_BURST)
+                self._chats[chat_id] = bucket
+            return bucket
+
+    def _delay(self, chat_id: int) -> float:
+        return self._bucket(chat_id).delay()
+
+    def _deliver(self, chat_id: int, send, on_error):
+        # negative ids belong to groups and channels
+        chat = "group" if chat_id < 0 else "private"
+        # the lane only gets here once the chat has a token, see `_delay`
+        time.sleep(self._bucket(chat_id).reserve())
+        time.sleep(self._global.reserve())
+        try:
+            with SEND_SECONDS.time(chat=chat):
+                return send()
+        except telegram.error.RetryAfter as r:
+            # flood control of this chat, others may still be sent to
+            log.warning(
+                f"🔴 Flood Control for {chat_id}. Backing off for {r.retry_after}s"
+            )
+            RETRY_AFTER.inc(chat=chat)
+            self._bucket(chat_id).pause(r.retry_after)
+            raise Postpone(chat_id) from None
+        except Exception as e:
+            SEND_ERRORS.inc(error=type(e).__name__)
+            if not on_error:
+                log.error(f"🔴 Sending message to {chat_id} failed: {e!r}")
+                raise
+            try:
+                on_error(e)
+            except Exception:
+                log.exception(f"🔴 Error callback for {chat_id} failed")
+            raise
+
+
+def get_outbox() -> Outbox:
+    """Return the process wide outbox, starting it on first use."""
+    global _outbox
+    with _outbox_lock:
+        if _outbox is None:
+            _outbox = Outbox()
+        return _outbox
+
+
+def outbox_send(
+    bot: telegram.Bot, chat_id: int, on_error=None, **kwargs
+) -> concurrent.futures.Future:
+    """Enqueue `bot.send_message(chat_id=chat_id, **kwargs)` and return at once,
+    with a future for the sent message.
+
+    `on_error(exception)` is called from a worker thread if sending fails for
+    any other reason than flood control, which is retried transparently.
+    """
+    send = functools.partial(bot.send_message, chat_id=chat_id, **kwargs)
+    return get_outbox().put(chat_id, send, on_error)
+
+
+def outbox_stop(timeout: float = 10):
+    """Deliver what is still pending (for at most `timeout` seconds) and stop."""
+    global _outbox
+    with _outbox_lock:
+        outbox, _outbox = _outbox, None
+    if outbox:
+        outbox.stop(timeout)
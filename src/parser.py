@@ -1,4 +1,5 @@
 import argparse
+from urllib.parse import urlsplit
 
 
 def create_parser():
@@ -19,4 +20,98 @@ def create_parser():
         "-vv is INFO and -vvv is DEBUG. Can be passed multiple times.",
     )
 
+    parser.add_argument(
+        "--journal",
+        metavar="DIR",
+        help="record all ticket changes in an append-only journal in DIR, and "
+        "restore tickets from it on startup (instead of from the persistence)",
+    )
+    parser.add_argument(
+        "--webhook",
+        action="store_true",
+        help="receive updates pushed by telegram to a local webhook listener, "
+        "instead of polling for them",
+    )
+    parser.add_argument(
+        "--webhook-url",
+        help="public URL under which the webhook listener is reachable (e.g. "
+        "through a reverse proxy); the secret path is appended. Required with "
+        "--webhook, unless --base-url is a local stand-in",
+    )
+    parser.add_argument(
+        "--webhook-listen",
+        default="127.0.0.1",
+        help="address the webhook listener binds to",
+    )
+    parser.add_argument(
+        "--webhook-port", type=int, default=8443, help="port of webhook listener"
+    )
+    parser.add_argument(
+        "--webhook-secret",
+        help="secret path of the webhook, so only telegram can post updates. "
+        "Randomly generated if not given",
+    )
+    parser.add_argument(
+        "--webhook-max-connections",
+        type=int,
+        default=40,
+        help="maximum simultaneous connections telegram opens to the webhook",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=0,
+        help="handle updates from different chats in parallel on this many "
+        "threads (updates of one chat stay in order). 0 handles all updates "
+        "one after another on the dispatcher thread",
+    )
+    parser.add_argument(
+        "--snapshot-port",
+        type=int,
+        help="serve snapshots of the open tickets for dashboards over HTTP on "
+        "this port. MQTT then only carries ticket updates",
+    )
+    parser.add_argument(
+        "--snapshot-listen",
+        default="127.0.0.1",
+        help="address the HTTP snapshot server binds to",
+    )
+    parser.add_argument(
+        "--base-url",
+        help="Bot API URL the token is appended to, e.g. of a local stand-in "
+        "(see tools/fake_bot_api.py). Defaults to https://api.telegram.org/bot",
+    )
+    parser.add_argument(
+        "--record",
+        metavar="FILE",
+        help="append all incoming updates to FILE (JSON lines), to replay them "
+        "later with tools/replay.py",
+    )
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        help="serve metrics (handler latency, sends, persistence, MQTT) in the "
+        "Prometheus text format at /metrics on this port",
+    )
+    parser.add_argument(
+        "--metrics-listen",
+        default="127.0.0.1",
+        help="address the metrics server binds to",
+    )
+
     return parser
+
+
+def parse_args(args: list = None) -> argparse.Namespace:
+    """Parse the command line (or `args`), rejecting combinations that
+    can't work."""
+    parser = create_parser()
+    args = parser.parse_args(args)
+    if args.webhook and not args.webhook_url and not _is_local(args.base_url):
+        # telegram would be told to post to the listener's local address
+        parser.error("--webhook needs --webhook-url, where telegram reaches it")
+    return args
+
+
+def _is_local(url: str) -> bool:
+    return bool(url) and urlsplit(url).hostname in ("localhost", "127.0.0.1", "::1")
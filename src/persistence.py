@@ -0,0 +1,230 @@
+import json
+import logging
+import pickle
+import sqlite3
+import threading
+from collections import defaultdict
+from pathlib import Path
+
+from telegram.ext import BasePersistence
+
+from src.metrics import histogram
+from src.tickets_data import TicketStore
+
+log = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS user_data (id INTEGER PRIMARY KEY, data BLOB NOT NULL);
+CREATE TABLE IF NOT EXISTS chat_data (id INTEGER PRIMARY KEY, data BLOB NOT NULL);
+CREATE TABLE IF NOT EXISTS bot_data (key TEXT PRIMARY KEY, data BLOB NOT NULL);
+CREATE TABLE IF NOT EXISTS tickets (uid INTEGER PRIMARY KEY, data BLOB NOT NULL);
+CREATE TABLE IF NOT EXISTS conversations (
+    name TEXT NOT NULL,
+    key TEXT NOT NULL,
+    state BLOB NOT NULL,
+    PRIMARY KEY (name, key)
+);
+"""
+
+WRITE_SECONDS = histogram(
+    "persistence_write_seconds",
+    "Duration of writing (and committing) changed data after an update",
+    ["data"],
+)
+FLUSH_SECONDS = histogram(
+    "persistence_flush_seconds", "Duration of the final flush on shutdown"
+)
+
+
+class SQLitePersistence(BasePersistence):
+    """Persistence backed by SQLite (in WAL mode), one row per user, chat,
+    conversation, bot_data key and ticket.
+
+    `PicklePersistence` rewrites the whole file whenever anything changes. Here,
+    only rows that actually changed are written: data is compared against what
+    was last written, and tickets are tracked through `TicketStore.pop_dirty`.
+    """
+
+    def __init__(self, filename: str, store_tickets: bool = True):
+        super().__init__(
+            store_user_data=True, store_chat_data=True, store_bot_data=True
+        )
+        # `BasePersistence` wraps the get/update methods to replace references
+        # to the bot in all data, which copies all of the data on every update.
+        # There are no bots in our data, so use the methods directly instead.
+        for name in (
+            "get_user_data",
+            "get_chat_data",
+            "get_bot_data",
+            "update_user_data",
+            "update_chat_data",
+            "update_bot_data",
+        ):
+            self.__dict__.pop(name, None)
+
+        self.filename = filename
+        # tickets might be persisted elsewhere, e.g. by a journal. They are
+        # still loaded then, so they can be taken over.
+        self.store_tickets = store_tickets
+        self._lock = threading.RLock()
+        self._db = sqlite3.connect(filename, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SCHEMA)
+        # pickled data as last written, to skip writing unchanged rows
+        self._written = {}  # (table, key) -> bytes
+        self._tickets = None  # TicketStore last written
+
+    def _write(self, table: str, column: str, key, data) -> bool:
+        """Write `data` into row `key` of `table`, if it changed."""
+        blob = pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL)
+        if self._written.get((table, key)) == blob:
+            return False
+        self._db.execute(
+            f"INSERT OR REPLACE INTO {table} ({column}, data) VALUES (?, ?)",
+            (key, blob),
+        )
+        self._written[table, key] = blob
+        return True
+
+    def _load(self, table: str, column: str) -> dict:
+        rows = self._db.execute(f"SELECT {column}, data FROM {table}").fetchall()
+        for key, blob in rows:
+            self._written[table, key] = blob
+        return {key: pickle.loads(blob) for key, blob in rows}
+
+    def get_user_data(self) -> defaultdict:
+        with self._lock:
+            return defaultdict(dict, self._load("user_data", "id"))
+
+    def get_chat_data(self) -> defaultdict:
+        with self._lock:
+            return defaultdict(dict, self._load("chat_data", "id"))
+
+    def get_bot_data(self) -> dict:
+        with self._lock:
+            bot_data = self._load("bot_data", "key")
+            rows = self._db.execute("SELECT uid, data FROM tickets").fetchall()
+            if rows:
+                tickets = {uid: pickle.loads(blob) for uid, blob in rows}
+                bot_data["tickets"] = TicketStore(tickets)
+                bot_data["tickets"].pop_dirty()
+                if self.store_tickets:
+                    self._tickets = bot_data["tickets"]
+            return bot_data
+
+    def get_conversations(self, name: str) -> dict:
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT key, state FROM conversations WHERE name = ?", (name,)
+            ).fetchall()
+        return {tuple(json.loads(key)): pickle.loads(state) for key, state in rows}
+
+    def update_conversation(self, name: str, key: tuple, new_state) -> None:
+        with WRITE_SECONDS.time(data="conversation"), self._lock, self._db:
+            if new_state is None:
+                self._db.execute(
+                    "DELETE FROM conversations WHERE name = ? AND key = ?",
+                    (name, json.dumps(key)),
+                )
+            else:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO conversations VALUES (?, ?, ?)",
+                    (name, json.dumps(key), pickle.dumps(new_state)),
+                )
+
+    def update_user_data(self, user_id: int, data: dict) -> None:
+        with WRITE_SECONDS.time(data="user"), self._lock, self._db:
+            self._write("user_data", "id", user_id, data)
+
+    def update_chat_data(self, chat_id: int, data: dict) -> None:
+        with WRITE_SECONDS.time(data="chat"), self._lock, self._db:
+            self._write("chat_data", "id", chat_id, data)
+
+    def update_bot_data(self, data: dict) -> None:
+        with WRITE_SECONDS.time(data="bot"), self._lock, self._db:
+            for key, value in data.items():
+                if key == "tickets" and isinstance(value, TicketStore):
+                    if self.store_tickets:
+                        self._update_tickets(value)
+                    continue
+                self._write("bot_data", "key", key, value)
+            # keys removed from bot_data, e.g. by /resetall
+            for table, key in list(self._written):
+                if table == "bot_data" and key not in data:
+                    self._db.execute("DELETE FROM bot_data WHERE key = ?", (key,))
+                    del self._written[table, key]
+            if self._tickets is not None and "tickets" not in data:
+                self._db.execute("DELETE FROM tickets")
+                self._tickets = None
+
+    def _update_tickets(self, tickets: TicketStore):
+        if tickets is not self._tickets:
+            # a new store altogether, rewrite all of it
+            self._db.execute("DELETE FROM tickets")
+            dirty = set(tickets.keys())
+            tickets.pop_dirty()
+            self._tickets = tickets
+        else:
+            dirty = tickets.pop_dirty()
+        for uid in dirty:
+            if (ticket := tickets.get(uid)) is None:
+                self._db.execute("DELETE FROM tickets WHERE uid = ?", (uid,))
+            else:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO tickets (uid, data) VALUES (?, ?)",
+                    (uid, pickle.dumps(ticket, protocol=pickle.HIGHEST_PROTOCOL)),
+                )
+
+    def clear_tickets(self) -> None:
+        """Delete the persisted tickets, once persisted elsewhere (see
+        `store_tickets`). A later run without would bring them back
+        otherwise."""
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM tickets")
+            self._tickets = None
+
+    def refresh_user_data(self, user_id: int, user_data: dict) -> None:
+        pass
+
+    def refresh_chat_data(self, chat_id: int, chat_data: dict) -> None:
+        pass
+
+    def refresh_bot_data(self, bot_data: dict) -> None:
+        pass
+
+    def flush(self) -> None:
+        with FLUSH_SECONDS.time(), self._lock:
+            self._db.commit()
+            self._db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            self._db.close()
+
+    def import_pickle(self, filename: str) -> bool:
+        """Take over state of a `PicklePersistence` in `filename`, if this
+        database is still empty. Return whether anything was imported.
+        """
+        if not Path(filename).exists():
+            return False
+        with self._lock:
+            for table in ("user_data", "chat_data", "bot_data", "conversations"):
+                if self._db.execute(f"SELECT 1 FROM {table} LIMIT 1").fetchone():
+                    return False
+            with open(filename, "rb") as file:
+                data = pickle.load(file)
+        log.warning(f"Importing persisted state from {filename}")
+        for user_id, user_data in data.get("user_data", {}).items():
+            self.update_user_data(user_id, user_data)
+        for chat_id, chat_data in data.get("chat_data", {}).items():
+            self.update_chat_data(chat_id, chat_data)
+        bot_data = data.get("bot_data", {})
+        if "tickets" in bot_data:
+            # even without `store_tickets`, for a journal to take them over
+            # from here, see `clear_tickets`
+            with self._lock, self._db:
+                self._update_tickets(TicketStore(bot_data.pop("tickets")))
+                self._tickets = None
+        self.update_bot_data(bot_data)
+        for name, conversations in data.get("conversations", {}).items():
+            for key, state in conversations.items():
+                self.update_conversation(name, key, state)
+        return True
@@ -0,0 +1,100 @@
+import cProfile
+import io
+import logging
+import pstats
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+_session = None
+_session_lock = threading.Lock()
+
+
+class ProfilingSession:
+    """Profiles handler callbacks with cProfile, through `hook` (see
+    `src.handlers.add_hook`), until `seconds` have passed or `updates`
+    callbacks were profiled, whichever comes first. Then `on_done(session)`
+    is called.
+
+    Only one callback is profiled at a time: callbacks running in parallel
+    on other chat workers meanwhile are not profiled, but counted in
+    `skipped`, as cProfile can't follow several threads at once.
+    """
+
+    def __init__(self, on_done, seconds: float = None, updates: int = None):
+        self.on_done = on_done
+        self.updates = updates
+        self.calls = 0
+        self.skipped = 0
+        self.started = time.monotonic()
+        self.stopped = None
+        self._profiler = cProfile.Profile()
+        self._profiling = threading.Lock()
+        self._lock = threading.Lock()
+        self._timer = threading.Timer(seconds, self.stop) if seconds else None
+        if self._timer:
+            self._timer.daemon = True
+            self._timer.start()
+
+    def hook(self, name: str, call):
+        if self.stopped or not self._profiling.acquire(blocking=False):
+            with self._lock:
+                self.skipped += not self.stopped
+            return call()
+        try:
+            return self._profiler.runcall(call)
+        finally:
+            self._profiling.release()
+            with self._lock:
+                self.calls += 1
+                done = self.updates and self.calls >= self.updates
+            if done:
+                self.stop()
+
+    def stop(self):
+        with self._lock:
+            if self.stopped:
+                return
+            self.stopped = time.monotonic()
+        if self._timer:
+            self._timer.cancel()
+        try:
+            self.on_done(self)
+        except Exception:
+            log.exception("🔴 Reporting profile failed")
+
+    def report(self, sort: str = "tottime", limit: int = None) -> str:
+        """Hot spots as printed by `pstats`, `limit` functions at most."""
+        with self._profiling:
+            if not self._profiler.getstats():
+                return "Nothing was handled."
+            stream = io.StringIO()
+            stats = pstats.Stats(self._profiler, stream=stream).strip_dirs()
+        stats.sort_stats(sort).print_stats(limit)
+        # skip the header naming the (in-memory) profiler
+        text = stream.getvalue()
+        return text[text.find("   ncalls") :] if "   ncalls" in text else text
+
+
+def profiling_start(on_done, seconds: float = None, updates: int = None):
+    """Start a profiling session, unless one is running already. Returns the
+    new session, or None."""
+    global _session
+    with _session_lock:
+        if _session and not _session.stopped:
+            return None
+        _session = ProfilingSession(on_done, seconds, updates)
+        return _session
+
+
+def profiling_stop() -> bool:
+    """Stop the running session early. Returns whether there was one."""
+    with _session_lock:
+        session = _session
+    if session and not session.stopped:
+        # the calling handler may be the one being profiled, holding the
+        # profiler until it returns
+        threading.Thread(target=session.stop, name="profiling-stop").start()
+        return True
+    return False
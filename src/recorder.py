@@ -0,0 +1,66 @@
+import json
+import logging
+import threading
+import time
+
+from telegram import Update
+from telegram.ext import Dispatcher
+
+log = logging.getLogger(__name__)
+
+_file = None
+_lock = threading.Lock()
+
+
+def recorder_init(filename: str):
+    """Append every incoming update to `filename`, one JSON object per line:
+    `{"t": <unix time received>, "u": <update as sent by telegram>}`.
+    See `tools/replay.py` for feeding them back into the handlers.
+    """
+    global _file
+    _file = open(filename, "a", encoding="utf-8")
+    log.info(f"Recording updates to {filename}")
+
+
+def record_updates(dispatcher: Dispatcher):
+    """Record every update as `dispatcher` takes it from the update queue, in
+    order of arrival. Handlers may run later and out of order, on chat
+    workers."""
+    process_update = dispatcher.process_update
+
+    def recording(update: object):
+        record_update(update)
+        process_update(update)
+
+    dispatcher.process_update = recording
+
+
+def record_update(update: object):
+    if not _file or not isinstance(update, Update):
+        return
+    line = json.dumps(
+        {"t": round(time.time(), 3), "u": _compact(update.to_dict())},
+        ensure_ascii=False,
+        separators=(",", ":"),
+    )
+    with _lock:
+        _file.write(line + "\n")
+        # a crash must not take the recent updates with it
+        _file.flush()
+
+
+def _compact(data):
+    """Drop the empty lists `to_dict` adds for absent fields."""
+    if isinstance(data, dict):
+        return {k: _compact(v) for k, v in data.items() if v != []}
+    if isinstance(data, list):
+        return [_compact(v) for v in data]
+    return data
+
+
+def recorder_stop():
+    global _file
+    with _lock:
+        if _file:
+            _file.close()
+            _file = None
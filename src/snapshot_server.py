@@ -0,0 +1,95 @@
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from src.dashboard_bridge import dashboard_sequence, dashboard_snapshot, orga_group
+from src.tickets_data import ticket_store
+
+log = logging.getLogger(__name__)
+
+_server = None
+# ETags of earlier runs must not match, ticket versions and sequence numbers
+# start over
+_started = int(time.time())
+
+
+class SnapshotHandler(BaseHTTPRequestHandler):
+    """Serves snapshots of the open tickets, as sent over MQTT, at `/tickets`
+    and `/tickets/<orga>`. Answers 304 to `If-None-Match` while the tickets
+    and the sequence numbers of their updates are unchanged, so dashboards
+    can poll cheaply.
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        parts = self.path.split("?")[0].strip("/").split("/")
+        group = None
+        if parts[0] != "tickets" or len(parts) > 2:
+            return self._reply(404)
+        if len(parts) == 2:
+            group = orga_group(parts[1])
+            if group is None:
+                return self._reply(404)
+
+        tickets = ticket_store(self.server.bot_data, create=False)
+        accept = self.headers.get("Accept", "")
+        format = "msgpack" if "application/msgpack" in accept else "json"
+        # updates are numbered when published, after the tickets changed
+        seq = dashboard_sequence(group)
+        etag = f'"{_started}-{tickets.version}-{seq}-{format}"'
+        if etag in self.headers.get("If-None-Match", ""):
+            return self._reply(304, etag=etag)
+
+        key = (group, format)
+        cached = self.server.cache.get(key)
+        if cached and cached[0] == etag:
+            body = cached[1]
+        else:
+            body = dashboard_snapshot(tickets, group, format)
+            self.server.cache[key] = (etag, body)
+        self._reply(200, body, etag, f"application/{format}")
+
+    def do_OPTIONS(self):
+        self._reply(204)
+
+    def _reply(self, code: int, body: bytes = b"", etag=None, content_type=None):
+        self.send_response(code)
+        # dashboards are served from elsewhere
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.send_header("Access-Control-Allow-Headers", "If-None-Match")
+        self.send_header("Access-Control-Expose-Headers", "ETag")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Vary", "Accept")
+        if etag:
+            self.send_header("ETag", etag)
+        if content_type:
+            self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        log.debug(format % args)
+
+
+def snapshot_server_start(bot_data: dict, listen: str, port: int):
+    """Serve ticket snapshots from `bot_data` over HTTP, in the background."""
+    global _server
+    _server = ThreadingHTTPServer((listen, port), SnapshotHandler)
+    _server.daemon_threads = True
+    _server.bot_data = bot_data
+    _server.cache = {}  # (group, format) -> (etag, body)
+    threading.Thread(
+        target=_server.serve_forever, name="snapshot-server", daemon=True
+    ).start()
+    log.info(f"Serving ticket snapshots at http://{listen}:{port}/tickets")
+
+
+def snapshot_server_stop():
+    global _server
+    if _server:
+        _server.shutdown()
+        _server.server_close()
+        _server = None
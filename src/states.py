@@ -10,7 +10,6 @@ from telegram.ext import (
 
 
 from src.config import (
-    MAPPING,
     REQUEST_OPTIONS,
     MONEY_OPTIONS,
     CUP_OPTIONS,
@@ -162,6 +161,8 @@ def ask_amount(update: Update, context: CallbackContext) -> int:
 
 
 def amount(update: Update, context: CallbackContext) -> int:
+    from src.config import MAPPING
+
     amount = update.message.text
     group = context.user_data["group_association"]
     location = MAPPING[group]
@@ -185,6 +186,8 @@ def amount(update: Update, context: CallbackContext) -> int:
 
 def collect(update: Update, context: CallbackContext) -> int:
     """Collection of either Money or Cups."""
+    from src.config import MAPPING
+
     category = context.user_data["first_choice"]
     group = context.user_data["group_association"]
     location = MAPPING[group]
@@ -210,6 +213,8 @@ def free(update: Update, context: CallbackContext) -> int:
     Specifically, for category `Sonstiges`, as well as to
     specify what is missing in case of Beer and Cocktail.
     """
+    from src.config import MAPPING
+
     # for beer and cocktail, and other requests
     group = context.user_data["group_association"]
     category = context.user_data["first_choice"]
@@ -232,6 +237,8 @@ def free(update: Update, context: CallbackContext) -> int:
 
 
 def change(update: Update, context: CallbackContext) -> int:
+    from src.config import MAPPING
+
     group = context.user_data["group_association"]
     category = context.user_data["first_choice"]
     location = MAPPING[group]
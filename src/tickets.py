@@ -3,13 +3,15 @@ from telegram.ext import (
     CallbackContext,
 )
 
-from src.dashboard_bridge import dashboard_publish, mqtt_set_tickets
-from src.config import ORGA_GROUPS
+from src.dashboard_bridge import dashboard_publish, mqtt_set_tickets, ticket_topic
+from src.journal import journal_record
+from src.archive import archive_query, archive_ticket
 from src.utils import who, dev_msg, channel_msg, group_msg, autoselect_keyboard
-from src.tickets_data import Ticket, TicketStatus
+from src.tickets_data import Ticket, TicketStatus, TicketStore, ticket_store
 
+import functools
 import logging
-
+import time
 
 log = logging.getLogger(__name__)
 
@@ -17,12 +19,28 @@ log = logging.getLogger(__name__)
 def add_ticket(context, ticket: Ticket):
     """Add ticket to bot data, or update ticket in bot data under its uid"""
     tickets = context.bot_data.get("tickets")
-    if not tickets:
-        context.bot_data["tickets"] = {}
-        mqtt_set_tickets(context.bot_data["tickets"])
-
-    context.bot_data["tickets"][ticket.uid] = ticket
-    dashboard_publish(f"tickets/{ticket.group_tasked}/{ticket.uid}", ticket)
+    if not isinstance(tickets, TicketStore):
+        # the first ticket, or the first after /resetall
+        tickets = ticket_store(context.bot_data)
+        mqtt_set_tickets(tickets)
+    tickets.add(ticket, record=functools.partial(journal_record, tickets=tickets))
+    dashboard_publish(ticket_topic(ticket), ticket)
+
+
+def change_ticket(context, uid: int, statuses: tuple, change) -> Ticket:
+    """Apply `change(ticket)` to ticket `uid` if it is in one of `statuses`,
+    see `TicketStore.transition`. Closed and revoked tickets are archived.
+    Returns the ticket, or None if it is gone or in another status, e.g.
+    because another chat changed it first."""
+    tickets = ticket_store(context.bot_data, create=False)
+    ticket = tickets.transition(
+        uid, statuses, change, record=functools.partial(journal_record, tickets=tickets)
+    )
+    if ticket:
+        dashboard_publish(ticket_topic(ticket), ticket)
+        if ticket.status in (TicketStatus.CLOSED, TicketStatus.REVOKED):
+            archive_ticket(ticket)
+    return ticket
 
 
 def create_ticket(
@@ -64,7 +82,10 @@ def create_ticket(
 def orga_command(func):
     """Decorator for commands only groups in `orga.json` are allowed to execute."""
 
+    @functools.wraps(func)
     def wrapper(update: Update, context: CallbackContext):
+        from src.config import ORGA_GROUPS
+
         if context.user_data.get("group_association") in ORGA_GROUPS:
             func(update, context)
         else:
@@ -95,8 +116,9 @@ def close(update: Update, context: CallbackContext) -> None:
         group_tasked = context.user_data.get("group_association")
         keyboard = [
             [InlineKeyboardButton(str(t), callback_data=f"close #{t.uid}")]
-            for t in context.bot_data["tickets"].values()
-            if t.is_wip() and t.is_tasked(group_tasked)
+            for t in ticket_store(context.bot_data, create=False).tasked(
+                group_tasked, TicketStatus.WIP
+            )
         ]
 
         if keyboard:
@@ -112,15 +134,14 @@ def close(update: Update, context: CallbackContext) -> None:
             )
 
 
-def close_uid(update: Update, context: CallbackContext, uid) -> None:
-    """Close ticket with `uid`."""
+def close_uid(update: Update, context: CallbackContext, uid) -> Ticket:
+    """Close ticket with `uid`. Returns the ticket, or None if it was closed
+    already."""
     from src.commands import channel_msg
 
-    if ticket := context.bot_data["tickets"].get(uid):
-        # delete ticket
-        ticket.close()
-        add_ticket(context, ticket)
-        del context.bot_data["tickets"][uid]
+    # of several closing it at once, only one gets it
+    open_or_wip = (TicketStatus.OPEN, TicketStatus.WIP)
+    if ticket := change_ticket(context, uid, open_or_wip, Ticket.close):
         # notify others in same orga-group
         close_text = (
             f"{str(TicketStatus.CLOSED)}: {who(update)} von "
@@ -151,11 +172,12 @@ def close_uid(update: Update, context: CallbackContext, uid) -> None:
             )
         except AttributeError:
             pass
-    else:
-        update.message.reply_text(
-            f"Ticket #{uid} wurde bereits geschlossen oder existiert noch nicht.",
-            reply_markup=autoselect_keyboard(update, context),
-        )
+        return ticket
+    update.effective_message.reply_text(
+        f"Ticket #{uid} wurde bereits geschlossen oder existiert noch nicht.",
+        reply_markup=autoselect_keyboard(update, context),
+    )
+    return None
 
 
 @orga_command
@@ -170,8 +192,9 @@ def wip(update: Update, context: CallbackContext) -> None:
         group_tasked = context.user_data.get("group_association")
         keyboard = [
             [InlineKeyboardButton(str(t), callback_data=f"wip #{t.uid}")]
-            for t in context.bot_data["tickets"].values()
-            if t.is_open() and t.is_tasked(group_tasked)
+            for t in ticket_store(context.bot_data, create=False).tasked(
+                group_tasked, TicketStatus.OPEN
+            )
         ]
 
         if keyboard:
@@ -187,55 +210,61 @@ def wip(update: Update, context: CallbackContext) -> None:
             )
 
 
-def wip_uid(update: Update, context: CallbackContext, uid: int):
-    """Change status of ticket with `uid` to WIP."""
+def wip_uid(update: Update, context: CallbackContext, uid: int) -> Ticket:
+    """Change status of ticket with `uid` to WIP. Returns the ticket, or None
+    if that was not possible."""
     worker = who(update)
     try:
         worker = " ".join(context.args[1:])
     except (ValueError, IndexError, TypeError):
         pass
-    if ticket := context.bot_data["tickets"].get(uid):
-        if ticket.is_wip():
-            # someone is already working on it.
+    # of several starting it at once, only one gets it
+    ticket = change_ticket(
+        context, uid, (TicketStatus.OPEN,), lambda ticket: ticket.set_wip(worker)
+    )
+    if ticket:
+        group_msg(
+            update,
+            context,
+            context.user_data["group_association"],
+            f"{worker} arbeitet jetzt an Ticket #{uid}.",
+        )
+        channel_msg(
+            f"{str(TicketStatus.WIP)}: {worker} von "
+            f"[{context.user_data['group_association']}] arbeitet jetzt "
+            f"an Ticket #{uid}."
+        )
+        # notify group of ticket creators
+        group_msg(
+            update,
+            context,
+            ticket.group_requesting,
+            f"{str(TicketStatus.WIP)}: Euer Ticket #{uid} wurde angefangen "
+            "zu bearbeiten.",
+        )
+        try:
+            # no message object in case of inline response
             update.message.reply_text(
-                "Jemand arbeitet bereits daran.",
+                f"Ticket #{uid} ist jetzt {str(TicketStatus.WIP)}.",
                 reply_markup=autoselect_keyboard(update, context),
             )
-        else:
-            ticket.set_wip(worker)
-            add_ticket(context, ticket)
-            group_msg(
-                update,
-                context,
-                context.user_data["group_association"],
-                f"{worker} arbeitet jetzt an Ticket #{uid}.",
-            )
-            channel_msg(
-                f"{str(TicketStatus.WIP)}: {worker} von "
-                f"[{context.user_data['group_association']}] arbeitet jetzt "
-                f"an Ticket #{uid}."
-            )
-            # notify group of ticket creators
-            group_msg(
-                update,
-                context,
-                ticket.group_requesting,
-                f"{str(TicketStatus.WIP)}: Euer Ticket #{uid} wurde angefangen "
-                "zu bearbeiten.",
-            )
-            try:
-                # no message object in case of inline response
-                update.message.reply_text(
-                    f"Ticket #{uid} ist jetzt {str(TicketStatus.WIP)}.",
-                    reply_markup=autoselect_keyboard(update, context),
-                )
-            except AttributeError:
-                pass
+        except AttributeError:
+            pass
+        return ticket
+    if (
+        ticket := ticket_store(context.bot_data, create=False).get(uid)
+    ) and ticket.is_wip():
+        # someone is already working on it.
+        update.effective_message.reply_text(
+            "Jemand arbeitet bereits daran.",
+            reply_markup=autoselect_keyboard(update, context),
+        )
     else:
-        update.message.reply_text(
+        update.effective_message.reply_text(
             f"Ticket #{uid} wurde bereits geschlossen oder existiert noch nicht.",
             reply_markup=autoselect_keyboard(update, context),
         )
+    return None
 
 
 def revoke(update: Update, context: CallbackContext) -> None:
@@ -249,8 +278,9 @@ def revoke(update: Update, context: CallbackContext) -> None:
         group_requesting = context.user_data.get("group_association")
         keyboard = [
             [InlineKeyboardButton(str(t), callback_data=f"revoke #{t.uid}")]
-            for t in context.bot_data["tickets"].values()
-            if t.is_requesting(group_requesting) and t.is_open()
+            for t in ticket_store(context.bot_data, create=False).requesting(
+                group_requesting, TicketStatus.OPEN
+            )
         ]
 
         if keyboard:
@@ -266,11 +296,11 @@ def revoke(update: Update, context: CallbackContext) -> None:
             )
 
 
-def revoke_uid(update: Update, context: CallbackContext, uid: int) -> None:
-    if ticket := context.bot_data["tickets"].get(uid):
-        ticket.revoke()
-        add_ticket(context, ticket)
-        del context.bot_data["tickets"][uid]
+def revoke_uid(update: Update, context: CallbackContext, uid: int) -> Ticket:
+    """Revoke ticket with `uid`. Returns the ticket, or None if that was not
+    possible."""
+    open_or_wip = (TicketStatus.OPEN, TicketStatus.WIP)
+    if ticket := change_ticket(context, uid, open_or_wip, Ticket.revoke):
         revoke_text = (
             f"{str(TicketStatus.REVOKED)}: {who(update)} von "
             f"[{context.user_data['group_association']}] hat "
@@ -283,26 +313,26 @@ def revoke_uid(update: Update, context: CallbackContext, uid: int) -> None:
             ticket.group_requesting,
             f"{str(TicketStatus.REVOKED)}: {who(update)} in deiner Gruppe hat gerade ticket '{ticket.text}' zurückgezogen.",
         )
-    else:
-        update.message.reply_text(
-            f"Ticket #{uid} wurde bereits geschlossen, existiert noch nicht, oder ist bereits in arbeit.",
-            reply_markup=autoselect_keyboard(update, context),
-        )
+        return ticket
+    update.effective_message.reply_text(
+        f"Ticket #{uid} wurde bereits geschlossen, existiert noch nicht, oder ist bereits in arbeit.",
+        reply_markup=autoselect_keyboard(update, context),
+    )
+    return None
 
 
 @orga_command
 def all(update: Update, context: CallbackContext) -> None:
     """Show list of all tickets, OPEN or WIP."""
-    message = ""
+    from src.config import ORGA_GROUPS
 
-    tickets_list = {orga_group: [] for orga_group in ORGA_GROUPS}
-    for ticket in context.bot_data["tickets"].values():
-        tickets_list[ticket.group_tasked].append(str(ticket))
+    message = ""
 
+    store = ticket_store(context.bot_data, create=False)
     for orga_group in ORGA_GROUPS:
-        if tickets := tickets_list[orga_group]:
+        if tickets := store.tasked(orga_group):
             message += f"\n\n\n🔷 Offene Tickets für [{orga_group}]:\n\n"
-            message += "\n\n".join(tickets)
+            message += "\n\n".join(map(str, tickets))
 
     if not message:
         message = "Momentan gibt es keine offenen Tickets."
@@ -320,8 +350,7 @@ def tickets(update: Update, context: CallbackContext) -> None:
 
     message = "\n\n".join(
         str(ticket)
-        for ticket in context.bot_data["tickets"].values()
-        if ticket.is_tasked(user_group)
+        for ticket in ticket_store(context.bot_data, create=False).tasked(user_group)
     )
 
     if message:
@@ -335,6 +364,37 @@ def tickets(update: Update, context: CallbackContext) -> None:
     )
 
 
+@orga_command
+def history(update: Update, context: CallbackContext) -> None:
+    """Show tickets of the users [ORGA-GROUP] closed or revoked in the last
+    hours (default: one).
+    """
+    user_group = context.user_data.get("group_association")
+    try:
+        hours = float(context.args[0])
+    except (ValueError, IndexError):
+        hours = 1
+
+    since = time.time() - hours * 3600
+    lines = [
+        f"{time.strftime('%H:%M', time.localtime(archived_at))} {ticket}"
+        for archived_at, ticket in archive_query(user_group, since, limit=30)
+    ]
+
+    if lines:
+        message = (
+            f"Erledigte Tickets von [{user_group}] der letzten {hours:g}h "
+            "(höchstens 30):\n\n" + "\n\n".join(lines)
+        )
+    else:
+        message = f"Keine erledigten Tickets von [{user_group}] der letzten {hours:g}h."
+
+    update.message.reply_text(
+        message,
+        reply_markup=autoselect_keyboard(update, context),
+    )
+
+
 @orga_command
 def help2(update: Update, context: CallbackContext) -> None:
     message = """Zusätzlich verfügbare Kommandos für [ORGA]:
@@ -360,6 +420,10 @@ def help2(update: Update, context: CallbackContext) -> None:
     Ticket durch Auswahl.
     Alternativ: sende die <ticket-id>
     mit, um die Auswahl zu überspringen.
+/history [stunden]
+    Zeige die in den letzten Stunden
+    (standard: eine) erledigten oder
+    zurückgezogenen Tickets deiner Gruppe.
 /message <ticket-id> <text>
     Sende eine Nachricht an alle Mitglieder
     der Gruppe, die Ticket <ticket-id>
@@ -389,7 +453,7 @@ def message(update: Update, context: CallbackContext) -> None:
         return
     try:
         uid = int(context.args[0])
-        ticket = context.bot_data["tickets"][uid]
+        ticket = ticket_store(context.bot_data, create=False)[uid]
         message = (
             f"🟣 Nachricht von {context.user_data['group_association']}: "
             + " ".join(context.args[1:])
@@ -416,6 +480,7 @@ def message(update: Update, context: CallbackContext) -> None:
 @orga_command
 def dashboard(update: Update, context: CallbackContext) -> None:
     from src.dashboard_bridge import is_dashboard
+
     message = """Du kannst das dashboard unter den folgenden Links finden:
 
     Alle Tickets:
@@ -1,15 +1,45 @@
+from collections import defaultdict
 from enum import Enum
+import itertools
 import json
+import threading
 
 from telegram.ext import (
     CallbackContext,
 )
 
+# canonical instances of group names, shared by all tickets instead of each
+# ticket holding its own copies. Seeded from `ALL_GROUPS` on first use.
+_group_names = None
+
+
+def register_groups(names: list):
+    """Seed the group name registry, e.g. where no config is available."""
+    global _group_names
+    _group_names = {name: name for name in names}
+
+
+def intern_group(name: str) -> str:
+    """Return the canonical instance of group `name`."""
+    if _group_names is None:
+        from src.config import ALL_GROUPS
+
+        register_groups(ALL_GROUPS)
+    return _group_names.setdefault(name, name)
+
+
+# versions of all ticket stores, see `TicketStore.version`
+_versions = itertools.count(1)
+
+_highest_id_lock = threading.Lock()
+
 
 def increase_highest_id(context: CallbackContext):
     """Keep internal counter of 'next' ticket id."""
-    highest = context.bot_data.get("highest_id", 0)
-    context.bot_data["highest_id"] = highest + 1
+    # updates of different chats might be handled concurrently
+    with _highest_id_lock:
+        highest = context.bot_data.get("highest_id", 0)
+        context.bot_data["highest_id"] = highest + 1
     return highest
 
 
@@ -34,6 +64,9 @@ class TicketStatus(Enum):
 class Ticket:
     """Collection of fields and functions directly related to Tickets."""
 
+    # no per-instance __dict__, there might be a lot of tickets
+    __slots__ = ("uid", "status", "group_requesting", "group_tasked", "text", "who")
+
     def __init__(
         self,
         group_requesting: str,
@@ -43,18 +76,33 @@ class Ticket:
         uid: int = None,
         status: TicketStatus = TicketStatus.OPEN,
     ):
-        assert uid or context is not None
+        assert uid is not None or context is not None
 
-        if uid:
+        if uid is not None:
             self.uid = uid
         else:
             self.uid = increase_highest_id(context)
         self.status = status
-        self.group_requesting = group_requesting
-        self.group_tasked = group_tasked
+        self.group_requesting = intern_group(group_requesting)
+        self.group_tasked = intern_group(group_tasked)
         self.text = text
         self.who = ""
 
+    def __getstate__(self):
+        # same state as tickets had before using __slots__
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __setstate__(self, state):
+        if isinstance(state, tuple):
+            # default state of objects with __slots__: (None, slots)
+            state = state[1]
+        self.uid = state["uid"]
+        self.status = state["status"]
+        self.group_requesting = intern_group(state["group_requesting"])
+        self.group_tasked = intern_group(state["group_tasked"])
+        self.text = state["text"]
+        self.who = state.get("who", "")
+
     def __repr__(self):
         return (
             f"Ticket(group_requesting='{self.group_requesting}', group_tasked="
@@ -92,6 +140,177 @@ class Ticket:
         return repr(self)
 
 
+class TicketStore:
+    """Open and WIP tickets by uid, with secondary indexes on `group_tasked`,
+    `group_requesting` and `status`.
+
+    Behaves like a dict uid -> Ticket, but listings per group or status cost
+    O(result) instead of O(all tickets). A ticket needs to be (re-)added with
+    `add` after each change of its status, to keep the indexes up to date.
+
+    Uids of added or removed tickets are remembered until `pop_dirty`, so
+    persistence only needs to write what changed. `version` grows with every
+    change, e.g. to tell whether a snapshot is still current. It is never the
+    same for two stores, e.g. after /resetall. All methods are thread-safe,
+    iterating returns a copy.
+    """
+
+    def __init__(self, tickets: dict = None):
+        self._lock = threading.RLock()
+        self.version = next(_versions)
+        self._tickets = {}
+        # (group, status) -> {uid: Ticket}, status None for all of the group
+        self._tasked = defaultdict(dict)
+        self._requesting = defaultdict(dict)
+        self._status = defaultdict(dict)  # status -> {uid: Ticket}
+        self._indexed = {}  # uid -> index keys the ticket is listed under
+        self._dirty = set()  # uids changed since the last `pop_dirty`
+        for ticket in (tickets or {}).values():
+            self.add(ticket)
+
+    def _index_keys(self, ticket: Ticket) -> tuple:
+        return (
+            (self._tasked, (ticket.group_tasked, ticket.status)),
+            (self._tasked, (ticket.group_tasked, None)),
+            (self._requesting, (ticket.group_requesting, ticket.status)),
+            (self._requesting, (ticket.group_requesting, None)),
+            (self._status, ticket.status),
+        )
+
+    def add(self, ticket: Ticket, record=None):
+        """Insert `ticket`, or re-index it after a change. `record(ticket)` is
+        called before releasing the lock, see `transition`."""
+        uid = ticket.uid
+        new = self._index_keys(ticket)
+        with self._lock:
+            if old := self._indexed.get(uid):
+                for (index, key), (_, new_key) in zip(old, new):
+                    if key != new_key:
+                        self._unlist(uid, index, key)
+            # unchanged entries keep their position, i.e. listings stay in
+            # order of creation
+            for index, key in new:
+                index[key][uid] = ticket
+            self._tickets[uid] = ticket
+            self._indexed[uid] = new
+            self._dirty.add(uid)
+            self.version = next(_versions)
+            if record:
+                record(ticket)
+
+    def transition(self, uid: int, statuses: tuple, change, record=None) -> Ticket:
+        """Apply `change(ticket)` to ticket `uid` if it is in one of
+        `statuses`, and re-index it, or remove it once CLOSED or REVOKED. As
+        one step: of two chats changing the same ticket at once, the second
+        sees the result of the first. `record(ticket)` is called before
+        releasing the lock, e.g. to journal changes in the order they happen.
+
+        Returns the changed ticket, or None if there is no ticket `uid` in
+        `statuses` (anymore).
+        """
+        with self._lock:
+            ticket = self._tickets.get(uid)
+            if ticket is None or ticket.status not in statuses:
+                return None
+            change(ticket)
+            if ticket.status in (TicketStatus.CLOSED, TicketStatus.REVOKED):
+                del self[uid]
+                if record:
+                    record(ticket)
+            else:
+                self.add(ticket, record)
+        return ticket
+
+    def _unlist(self, uid: int, index: dict, key):
+        del index[key][uid]
+        if not index[key]:
+            del index[key]
+
+    def tasked(self, group: str, status: TicketStatus = None) -> list:
+        """Tickets `group` is tasked with, optionally only those in `status`."""
+        with self._lock:
+            return list(self._tasked.get((group, status), {}).values())
+
+    def requesting(self, group: str, status: TicketStatus = None) -> list:
+        """Tickets requested by `group`, optionally only those in `status`."""
+        with self._lock:
+            return list(self._requesting.get((group, status), {}).values())
+
+    def with_status(self, status: TicketStatus) -> list:
+        with self._lock:
+            return list(self._status.get(status, {}).values())
+
+    def __getitem__(self, uid: int) -> Ticket:
+        return self._tickets[uid]
+
+    def __delitem__(self, uid: int):
+        with self._lock:
+            del self._tickets[uid]
+            for entry in self._indexed.pop(uid):
+                self._unlist(uid, *entry)
+            self._dirty.add(uid)
+            self.version = next(_versions)
+
+    def pop_dirty(self) -> set:
+        """Return uids of tickets added, changed or removed since the last call."""
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+        return dirty
+
+    def __contains__(self, uid: int) -> bool:
+        return uid in self._tickets
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self) -> int:
+        return len(self._tickets)
+
+    def get(self, uid: int, default=None):
+        return self._tickets.get(uid, default)
+
+    def keys(self) -> list:
+        with self._lock:
+            return list(self._tickets.keys())
+
+    def values(self) -> list:
+        with self._lock:
+            return list(self._tickets.values())
+
+    def items(self) -> list:
+        with self._lock:
+            return list(self._tickets.items())
+
+    def __getstate__(self):
+        # indexes are rebuilt when loading, no need to persist them
+        return {"tickets": dict(self.items())}
+
+    def __setstate__(self, state):
+        self.__init__(state["tickets"])
+
+    def __repr__(self):
+        return f"TicketStore({self._tickets!r})"
+
+    def toJSON(self):
+        return {str(uid): repr(ticket) for uid, ticket in self.items()}
+
+
+def ticket_store(bot_data: dict, create: bool = True) -> TicketStore:
+    """Return the TicketStore in `bot_data`, creating it if necessary.
+    Tickets persisted as plain dict by earlier versions are taken over.
+
+    Without `create`, e.g. for only reading tickets, a missing store is not
+    put into `bot_data`, but an empty one returned. Stores are only created
+    where the dashboard bridge is told about them, see `add_ticket`.
+    """
+    tickets = bot_data.get("tickets")
+    if not isinstance(tickets, TicketStore):
+        tickets = TicketStore(tickets)
+        if create:
+            bot_data["tickets"] = tickets
+    return tickets
+
+
 class TicketEncoder(json.JSONEncoder):
     """JSON-Encoder also providing serialization of Ticket and TicketStatus."""
 
@@ -100,5 +319,7 @@ class TicketEncoder(json.JSONEncoder):
             return obj.toJSON()
         elif isinstance(obj, TicketStatus):
             return obj.toJSON()
+        elif isinstance(obj, TicketStore):
+            return obj.toJSON()
         # Let the base class default method raise the TypeError
-        return json.JSONEncoder.default(self, obj)
\ No newline at end of file
+        return json.JSONEncoder.default(self, obj)
@@ -1,16 +1,31 @@
 import json
 import logging
-import time
+import threading
 
 from telegram import Update, Bot, ReplyKeyboardMarkup, ParseMode
 import telegram
 
 from telegram.ext import CallbackContext
 
-from src.config import INITIAL_KEYBOARD, MAIN_KEYBOARD, ORGA_KEYBOARD, ORGA_GROUPS
+from src.config import INITIAL_KEYBOARD, MAIN_KEYBOARD, ORGA_KEYBOARD
+from src.metrics import counter
+from src.outbox import Delivery, outbox_send, WORKERS as OUTBOX_WORKERS
 
 log = logging.getLogger(__name__)
 
+# connections kept alive for the shared bot: dispatcher workers, updater
+# and job queue (see `telegram.ext.Updater`), plus one per outbox worker.
+CON_POOL_SIZE = 8 + OUTBOX_WORKERS
+
+_bot = None
+_bot_lock = threading.Lock()
+
+MEMBERS_REMOVED = counter(
+    "group_members_removed_total",
+    "Members removed from a group after they blocked the bot",
+    ["group"],
+)
+
 
 def set_log_level_format(logging_level, format):
     logging.addLevelName(logging_level, format % logging.getLevelName(logging_level))
@@ -49,80 +64,129 @@ def who(update: Update) -> str:
     return f"{first_name} {last_name} <@{chat.username}>"
 
 
+def get_bot(con_pool_size: int = CON_POOL_SIZE, base_url: str = None) -> Bot:
+    """Return the bot shared by all helpers (and the updater), creating it
+    on first use. All requests go through its pool of keep-alive connections,
+    to `base_url` if given (instead of api.telegram.org).
+    """
+    global _bot
+    with _bot_lock:
+        if _bot is None:
+            from telegram.utils.request import Request
+            from src.config import TOKEN
+
+            _bot = Bot(
+                token=TOKEN,
+                base_url=base_url,
+                request=Request(con_pool_size=con_pool_size),
+            )
+        return _bot
+
+
 def dev_msg(message):
     """Send message to developer.
 
     For longer and formatted messages consider `dev_html` instead.
     """
-    from src.config import TOKEN, DEVELOPER_CHAT_ID
+    from src.config import DEVELOPER_CHAT_ID
 
-    bot = Bot(token=TOKEN)
     log.info(f"to dev: {message}")
-    bot.send_message(
-        chat_id=DEVELOPER_CHAT_ID,
-        text=message,
-    )
+    outbox_send(get_bot(), DEVELOPER_CHAT_ID, text=message)
 
 
 def channel_msg(message):
     """Send notification to channel for logging purposes."""
-    from src.config import TOKEN, UPDATES_CHANNEL_ID
-
-    bot = Bot(token=TOKEN)
+    from src.config import UPDATES_CHANNEL_ID
 
     log.info(f"to channel: {message}")
-    try:
-        bot.send_message(
-            chat_id=UPDATES_CHANNEL_ID,
-            text=message,
-        )
-    except telegram.error.RetryAfter as r:
-        dev_msg(f"🔴 Flood Control. Backing off for {r.retry_after}s")
-        time.sleep(r.retry_after)
-        channel_msg(message)
+    # flood control is handled by the outbox, without blocking the caller
+    outbox_send(get_bot(), UPDATES_CHANNEL_ID, text=message)
 
 
 def group_msg(
     update: Update, context: CallbackContext, group: str, message: str
-) -> None:
+) -> Delivery:
     """Send `message` to all members of `group` except current user
     (in case the user is member of that group).
+
+    Messages are only enqueued and sent to all members concurrently; wait on
+    the returned `Delivery` if needed. Members who blocked the bot are removed
+    from the group once sending to them fails.
     """
     log.info(f"to {group}: {message}")
-    remove = []
-    for chat_id in context.bot_data["group_association"].get(group, []):
+    sender_group = (context.user_data or {}).get("group_association")
+    futures = []
+    # a copy, members who blocked the bot are removed from another thread
+    for chat_id in list(context.bot_data["group_association"].get(group, [])):
         if chat_id == update.effective_chat.id:
             # don't send message to current user
             continue
-        try:
-            context.bot.send_message(
-                chat_id=chat_id,
-                text=message,
-                reply_markup=autoselect_keyboard(update, context, group),
-            )
-        except telegram.error.Unauthorized:
-            # user blocked bot.
-            text = (
-                f"⚠️ Unauthorized for sending message to {chat_id} from "
-                f"{context.user_data['group_association']} in list of [{group}]. "
-                "Removing from list."
-            )
-            log.warn(text)
-            dev_msg(text)
-            context.dispatcher.user_data[chat_id].clear()
-            context.dispatcher.update_persistence()
-            remove.append(chat_id)
-    if remove:
-        for rid in remove:
-            context.bot_data["group_association"].get(group, []).remove(rid)
+        future = outbox_send(
+            context.bot,
+            chat_id,
+            on_error=_unauthorized_handler(context, group, sender_group, chat_id),
+            text=message,
+            reply_markup=autoselect_keyboard(update, context, group),
+        )
+        futures.append(future)
+    return Delivery(futures)
+
+
+def _unauthorized_handler(
+    context: CallbackContext, group: str, sender_group: str, chat_id: int
+):
+    """Create error callback for `group_msg`, removing `chat_id` from `group`
+    in case the user blocked the bot.
+    """
+
+    def on_error(error: Exception):
+        if not isinstance(error, telegram.error.Unauthorized):
+            log.error(f"🔴 Sending to {chat_id} in [{group}] failed: {error!r}")
+            return
+        # user blocked bot. Called on an outbox worker, so leave changing the
+        # data to the dispatcher.
+        context.dispatcher.update_queue.put(MemberBlocked(chat_id, group, sender_group))
+
+    return on_error
+
 
+class MemberBlocked:
+    """Put on the update queue when sending to `chat_id`, a member of `group`,
+    failed because they blocked the bot. See `remove_blocked_member`."""
 
-def orga_msg(update: Update, context: CallbackContext, message: str) -> None:
+    def __init__(self, chat_id: int, group: str, sender_group: str):
+        self.chat_id = chat_id
+        self.group = group
+        self.sender_group = sender_group
+
+
+def remove_blocked_member(blocked: MemberBlocked, context: CallbackContext) -> None:
+    """Remove a member who blocked the bot from their group."""
+    members = context.bot_data["group_association"].get(blocked.group, [])
+    try:
+        members.remove(blocked.chat_id)
+    except ValueError:
+        # another failed message removed them already
+        return
+    text = (
+        f"⚠️ Unauthorized for sending message to {blocked.chat_id} from "
+        f"{blocked.sender_group} in list of [{blocked.group}]. "
+        "Removing from list."
+    )
+    log.warning(text)
+    dev_msg(text)
+    context.dispatcher.user_data[blocked.chat_id].clear()
+    MEMBERS_REMOVED.inc(group=blocked.group)
+
+
+def orga_msg(update: Update, context: CallbackContext, message: str) -> Delivery:
     """Send message to all groups in `orga.json`"""
     from src.config import ORGA_GROUPS
 
+    delivery = Delivery()
     for group in ORGA_GROUPS:
-        group_msg(update, context, group, message)
+        delivery += group_msg(update, context, group, message)
+    return delivery
 
 
 initial_keyboard = ReplyKeyboardMarkup(
@@ -137,9 +201,11 @@ orga_keyboard = ReplyKeyboardMarkup(
 
 
 def autoselect_keyboard(
-        update: Update, context: CallbackContext, group: str = None
+    update: Update, context: CallbackContext, group: str = None
 ) -> ReplyKeyboardMarkup:
     """Select keyboard with commands automatically based on group membership."""
+    from src.config import ORGA_GROUPS
+
     if not context.user_data:
         return initial_keyboard
     if group:
@@ -163,23 +229,26 @@ def dev_html(
     from src.config import DEVELOPER_CHAT_ID
 
     n = 4096 - 11  # for tags <pre></pre>
+    reply_markup = autoselect_keyboard(update, context)
     if len(message) > n:
-        # need to split messages
+        # need to split messages, the outbox keeps them in order
         for i in range(0, len(message), n):
             prefix = "<pre>" if i != 0 else ""
             suffix = "</pre>" if i + n < len(message) else ""
             text = prefix + message[i : i + n] + suffix
-            context.bot.send_message(
-                chat_id=DEVELOPER_CHAT_ID,
+            outbox_send(
+                context.bot,
+                DEVELOPER_CHAT_ID,
                 text=text,
                 parse_mode=ParseMode.HTML,
-                reply_markup=autoselect_keyboard(update, context),
+                reply_markup=reply_markup,
             )
     else:
         # send full message directly
-        context.bot.send_message(
-            chat_id=DEVELOPER_CHAT_ID,
+        outbox_send(
+            context.bot,
+            DEVELOPER_CHAT_ID,
             text=message,
             parse_mode=ParseMode.HTML,
-            reply_markup=autoselect_keyboard(update, context),
+            reply_markup=reply_markup,
         )
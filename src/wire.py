@@ -0,0 +1,217 @@
+import json
+import struct
+
+from src.tickets_data import Ticket, TicketStatus
+
+# Tickets are sent to the dashboard as a map with short keys and a version:
+#   {"v": 1, "e": epoch, "q": seq, "u": uid, "s": status,
+#    "r": group_requesting, "g": group_tasked, "t": text, "w": who}
+# where `q` counts the updates of tickets tasked to group `g` within `epoch`
+# (one run of the bot). Snapshots of all open tickets are sent as
+#   {"v": 1, "e": epoch, "q": {group: seq}, "ts": [tickets without v/e/q]}
+# with the last `seq` of each group they include. Both are encoded either as
+# minified JSON or as MessagePack, told apart by the first byte: `{` for
+# JSON, a MessagePack map otherwise.
+VERSION = 1
+FORMATS = ("json", "msgpack")
+
+
+def ticket_to_wire(ticket: Ticket) -> dict:
+    return {
+        "u": ticket.uid,
+        "s": ticket.status.name,
+        "r": ticket.group_requesting,
+        "g": ticket.group_tasked,
+        "t": ticket.text,
+        "w": ticket.who,
+    }
+
+
+def ticket_from_wire(message: dict) -> Ticket:
+    ticket = Ticket(
+        message["r"],
+        message["g"],
+        message["t"],
+        uid=message["u"],
+        status=TicketStatus[message["s"]],
+    )
+    ticket.who = message["w"]
+    return ticket
+
+
+def encode(message, format: str = "json") -> bytes:
+    """Encode `message` (anything JSON serializable) in `format`."""
+    if format == "msgpack":
+        return msgpack_dumps(message)
+    return json.dumps(message, separators=(",", ":"), ensure_ascii=False).encode()
+
+
+def encode_ticket(ticket: Ticket, epoch: int, seq: int, format: str = "json") -> bytes:
+    """Encode an update of `ticket`, number `seq` of its group, in `format`."""
+    return encode(
+        {"v": VERSION, "e": epoch, "q": seq, **ticket_to_wire(ticket)}, format
+    )
+
+
+def encode_snapshot(
+    tickets: list, epoch: int, seqs: dict, format: str = "json"
+) -> bytes:
+    """Encode all `tickets` as one snapshot message in `format`, including
+    updates up to `seqs` (group -> seq)."""
+    return encode(
+        {
+            "v": VERSION,
+            "e": epoch,
+            "q": seqs,
+            "ts": [ticket_to_wire(ticket) for ticket in tickets],
+        },
+        format,
+    )
+
+
+def decode(payload: bytes):
+    """Decode a payload of either format."""
+    if payload[:1] == b"{":
+        return json.loads(payload)
+    return msgpack_loads(payload)
+
+
+def msgpack_dumps(obj) -> bytes:
+    """Minimal MessagePack encoder, for what JSON can hold as well."""
+    out = bytearray()
+    _pack(obj, out)
+    return bytes(out)
+
+
+def _pack(obj, out: bytearray):
+    if obj is None:
+        out.append(0xC0)
+    elif obj is True:
+        out.append(0xC3)
+    elif obj is False:
+        out.append(0xC2)
+    elif isinstance(obj, int):
+        if 0 <= obj < 0x80:
+            out.append(obj)
+        elif -32 <= obj < 0:
+            out.append(obj & 0xFF)
+        else:
+            # smallest fitting of uint 8/16/32/64 or int 8/16/32/64
+            ints = _UINTS if obj > 0 else _INTS
+            for code, fmt in ints:
+                try:
+                    out += struct.pack(fmt, code, obj)
+                    break
+                except struct.error:
+                    pass
+            else:
+                raise OverflowError(f"{obj} does not fit into 64 bits")
+    elif isinstance(obj, float):
+        out += struct.pack(">Bd", 0xCB, obj)
+    elif isinstance(obj, str):
+        data = obj.encode()
+        _header(len(data), 0xA0, 32, (0xD9, 0xDA, 0xDB), out)
+        out += data
+    elif isinstance(obj, (list, tuple)):
+        _header(len(obj), 0x90, 16, (None, 0xDC, 0xDD), out)
+        for item in obj:
+            _pack(item, out)
+    elif isinstance(obj, dict):
+        _header(len(obj), 0x80, 16, (None, 0xDE, 0xDF), out)
+        for key, value in obj.items():
+            _pack(key, out)
+            _pack(value, out)
+    else:
+        raise TypeError(f"Cannot encode {type(obj).__name__} as MessagePack")
+
+
+_UINTS = [(0xCC, ">BB"), (0xCD, ">BH"), (0xCE, ">BI"), (0xCF, ">BQ")]
+_INTS = [(0xD0, ">Bb"), (0xD1, ">Bh"), (0xD2, ">Bi"), (0xD3, ">Bq")]
+
+
+def _header(n: int, fix: int, fix_max: int, codes: tuple, out: bytearray):
+    # length prefix of strings, arrays and maps: in the type byte if short
+    # enough, else with 8 (strings only), 16 or 32 bits
+    code8, code16, code32 = codes
+    if n < fix_max:
+        out.append(fix | n)
+    elif code8 is not None and n <= 0xFF:
+        out += struct.pack(">BB", code8, n)
+    elif n <= 0xFFFF:
+        out += struct.pack(">BH", code16, n)
+    else:
+        out += struct.pack(">BI", code32, n)
+
+
+def msgpack_loads(data: bytes):
+    """Decode MessagePack as written by `msgpack_dumps`."""
+    obj, _ = _unpack(memoryview(data), 0)
+    return obj
+
+
+def _unpack(data: memoryview, pos: int):
+    code = data[pos]
+    pos += 1
+    if code < 0x80:
+        return code, pos
+    if code >= 0xE0:
+        return code - 0x100, pos
+    if code <= 0x8F:
+        return _unpack_map(data, pos, code & 0x0F)
+    if code <= 0x9F:
+        return _unpack_array(data, pos, code & 0x0F)
+    if code <= 0xBF:
+        return _unpack_str(data, pos, code & 0x1F)
+    if code in _FIXED:
+        return _FIXED[code], pos
+    fmt, kind = _SIZED[code]
+    (value,) = struct.unpack_from(fmt, data, pos)
+    pos += struct.calcsize(fmt)
+    if kind == "str":
+        return _unpack_str(data, pos, value)
+    if kind == "array":
+        return _unpack_array(data, pos, value)
+    if kind == "map":
+        return _unpack_map(data, pos, value)
+    return value, pos
+
+
+_FIXED = {0xC0: None, 0xC2: False, 0xC3: True}
+_SIZED = {
+    0xCB: (">d", None),
+    0xCC: (">B", None),
+    0xCD: (">H", None),
+    0xCE: (">I", None),
+    0xCF: (">Q", None),
+    0xD0: (">b", None),
+    0xD1: (">h", None),
+    0xD2: (">i", None),
+    0xD3: (">q", None),
+    0xD9: (">B", "str"),
+    0xDA: (">H", "str"),
+    0xDB: (">I", "str"),
+    0xDC: (">H", "array"),
+    0xDD: (">I", "array"),
+    0xDE: (">H", "map"),
+    0xDF: (">I", "map"),
+}
+
+
+def _unpack_str(data: memoryview, pos: int, n: int):
+    return str(data[pos : pos + n], "utf-8"), pos + n
+
+
+def _unpack_array(data: memoryview, pos: int, n: int):
+    items = []
+    for _ in range(n):
+        item, pos = _unpack(data, pos)
+        items.append(item)
+    return items, pos
+
+
+def _unpack_map(data: memoryview, pos: int, n: int):
+    result = {}
+    for _ in range(n):
+        key, pos = _unpack(data, pos)
+        result[key], pos = _unpack(data, pos)
+    return result, pos
@@ -0,0 +1,67 @@
+"""Compare per-message latency of a new `Bot` per message (as `channel_msg`
+and `dev_msg` used to do) against one shared bot with a connection pool.
+
+    python -m tools.bench_bot_session [-n MESSAGES]
+
+Runs against the local Bot API stand-in, so there is no TLS handshake; the
+gap to api.telegram.org is considerably larger.
+"""
+import argparse
+import statistics
+import time
+
+from telegram import Bot
+from telegram.utils.request import Request
+
+from tools.fake_bot_api import FakeBotApi
+
+TOKEN = "123456:bench"
+
+
+def measure(send, n: int) -> list:
+    latencies = []
+    for i in range(n):
+        start = time.perf_counter()
+        send(f"message {i}")
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def report(name: str, latencies: list, connections: int):
+    latencies = sorted(latencies)
+    print(
+        f"{name:<12} mean {statistics.mean(latencies) * 1000:7.3f}ms  "
+        f"p50 {latencies[len(latencies) // 2] * 1000:7.3f}ms  "
+        f"p99 {latencies[int(len(latencies) * 0.99)] * 1000:7.3f}ms  "
+        f"connections {connections}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-n", type=int, default=500, help="messages per variant")
+    args = parser.parse_args()
+
+    api = FakeBotApi().start()
+
+    def fresh(text):
+        Bot(token=TOKEN, base_url=api.base_url).send_message(chat_id=1, text=text)
+
+    try:
+        latencies = measure(fresh, args.n)
+        report("new Bot", latencies, api.connections)
+
+        api.connections = 0
+        shared = Bot(
+            token=TOKEN, base_url=api.base_url, request=Request(con_pool_size=8)
+        )
+        latencies = measure(
+            lambda text: shared.send_message(chat_id=1, text=text), args.n
+        )
+        report("shared Bot", latencies, api.connections)
+    finally:
+        api.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+"""Measure latency and throughput of dashboard updates, from `add_ticket` and
+`close_uid` in the bot to a dashboard subscribed at the broker, optionally
+with forced disconnects of all broker connections in between.
+
+    python -m tools.bench_dashboard [-n TICKETS] [--rate PER_SECOND]
+        [--coalesce-ms MS] [--disconnect-every SECONDS]
+
+Runs against local stand-ins for the broker and the Bot API, in a throwaway
+sandbox directory.
+"""
+import argparse
+import statistics
+import threading
+import time
+from queue import Queue
+
+import paho.mqtt.client as mqtt
+from telegram import Bot, Update
+from telegram.ext import CallbackContext, Dispatcher
+from telegram.utils.request import Request
+
+from tools.fake_bot_api import FakeBotApi
+from tools.fake_broker import FakeBroker
+from tools.sandbox import ORGA, TOKEN, enter_sandbox
+
+# tickets kept open, each is closed this many tickets after its creation
+OPEN_TICKETS = 20
+
+
+class Dashboard:
+    """Subscriber like `dashboard/main.js`, noting when updates arrive."""
+
+    def __init__(self, host: str, port: int, decode):
+        self.decode = decode
+        self.received = {}  # (uid, status) -> time of arrival
+        self.snapshots = 0
+        self.gaps = 0
+        self._seqs = {}
+        self._client = mqtt.Client(transport="websockets")
+        self._client.on_connect = lambda c, u, f, rc: c.subscribe("tickets/#", 0)
+        self._client.on_message = self._on_message
+        self._client.connect_async(host, port)
+        self._client.loop_start()
+
+    def _on_message(self, client, userdata, message):
+        now = time.perf_counter()
+        if not message.payload:
+            # clears a retained message
+            return
+        if message.topic.startswith("tickets/_") or message.topic.endswith(
+            "/_snapshot"
+        ):
+            self.snapshots += 1
+            return
+        ticket = self.decode(message.payload)
+        self.received.setdefault((ticket["u"], ticket["s"]), now)
+        last = self._seqs.get(ticket["g"])
+        if last is not None and ticket["q"] > last + 1:
+            # the dashboard would ask for a snapshot
+            self.gaps += 1
+        self._seqs[ticket["g"]] = max(ticket["q"], last or 0)
+
+    def stop(self):
+        self._client.loop_stop()
+        self._client.disconnect()
+
+
+def percentile(values: list, p: float) -> float:
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-n", type=int, default=500, help="tickets to create")
+    parser.add_argument("--rate", type=float, default=50, help="tickets per second")
+    parser.add_argument(
+        "--coalesce-ms", type=int, default=50, help="coalescing window of the bridge"
+    )
+    parser.add_argument(
+        "--disconnect-every",
+        type=float,
+        default=0,
+        metavar="SECONDS",
+        help="drop all broker connections this often (0 never)",
+    )
+    args = parser.parse_args()
+
+    broker = FakeBroker().start()
+    api = FakeBotApi().start()
+    mqtt_config = {
+        "host": broker.host,
+        "port": broker.port,
+        "user": "bot",
+        "pass": "bench",
+        "coalesce_ms": args.coalesce_ms,
+    }
+    enter_sandbox(mqtt_config)
+
+    # reads the sandbox's secrets
+    import src.utils
+    from src.dashboard_bridge import (
+        dashboard_flush,
+        dashboard_init,
+        dashboard_start,
+        dashboard_stats,
+        dashboard_stop,
+        mqtt_set_tickets,
+    )
+    from src.outbox import outbox_stop
+    from src.tickets import add_ticket, close_uid
+    from src.tickets_data import Ticket, ticket_store
+    from src.wire import decode
+
+    bot = Bot(token=TOKEN, base_url=api.base_url, request=Request(con_pool_size=8))
+    src.utils._bot = bot
+    dispatcher = Dispatcher(bot, Queue(), use_context=True)
+    dispatcher.bot_data["group_association"] = {}
+    mqtt_set_tickets(ticket_store(dispatcher.bot_data))
+    dashboard_init()
+    dashboard_start()
+    dashboard = Dashboard(broker.host, broker.port, decode)
+    time.sleep(1)
+
+    update = Update.de_json({"update_id": 1, "message": api.message(10, "/close")}, bot)
+    context = CallbackContext.from_update(update, dispatcher)
+    context.user_data["group_association"] = ORGA[0]
+
+    disconnects = 0
+    stopped = threading.Event()
+
+    def disconnect():
+        nonlocal disconnects
+        while not stopped.wait(args.disconnect_every):
+            broker.disconnect_all()
+            disconnects += 1
+
+    if args.disconnect_every:
+        threading.Thread(target=disconnect, daemon=True).start()
+
+    sent = {}  # (uid, status) -> time of the call
+    uids = []
+    start = time.perf_counter()
+    for i in range(args.n + OPEN_TICKETS):
+        due = start + i / args.rate
+        time.sleep(max(0, due - time.perf_counter()))
+        if i < args.n:
+            ticket = Ticket("Stand 1", ORGA[i % len(ORGA)], f"bench {i}", context)
+            sent[ticket.uid, "OPEN"] = time.perf_counter()
+            add_ticket(context, ticket)
+            uids.append(ticket.uid)
+        if i >= OPEN_TICKETS:
+            uid = uids[i - OPEN_TICKETS]
+            sent[uid, "CLOSED"] = time.perf_counter()
+            close_uid(update, context, uid)
+    stopped.set()
+    dashboard_flush()
+    deadline = time.perf_counter() + 15
+    while len(dashboard.received) < len(sent) and time.perf_counter() < deadline:
+        time.sleep(0.1)
+    elapsed = max(dashboard.received.values(), default=start) - start
+
+    latencies = sorted(
+        dashboard.received[key] - sent[key] for key in sent if key in dashboard.received
+    )
+    print(
+        f"{len(sent)} updates at {args.rate * 2:.0f}/s, "
+        f"coalescing {args.coalesce_ms}ms, {disconnects} forced disconnects"
+    )
+    print(
+        f"  received {len(latencies)}/{len(sent)}  "
+        f"({len(latencies) / elapsed:.1f}/s), {dashboard.snapshots} snapshots, "
+        f"{dashboard.gaps} gaps noticed by the dashboard"
+    )
+    if latencies:
+        print(
+            f"  latency  p50 {percentile(latencies, 0.5) * 1000:7.2f}ms  "
+            f"p95 {percentile(latencies, 0.95) * 1000:7.2f}ms  "
+            f"p99 {percentile(latencies, 0.99) * 1000:7.2f}ms  "
+            f"max {latencies[-1] * 1000:7.2f}ms  "
+            f"mean {statistics.mean(latencies) * 1000:7.2f}ms"
+        )
+    print(f"  bridge   {dashboard_stats()}")
+    print(f"  broker   {broker.connects} connects, {broker.published} publishes")
+
+    dashboard.stop()
+    dashboard_stop()
+    outbox_stop(timeout=1)
+    broker.stop()
+    api.stop()
+
+
+if __name__ == "__main__":
+    main()
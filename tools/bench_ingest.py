@@ -0,0 +1,86 @@
+"""Compare update ingestion latency of long polling against a webhook, from
+the moment the (stand-in) Bot API has an update until a handler runs.
+
+    python -m tools.bench_ingest [-n UPDATES] [--rate PER_SECOND] [--latency MS]
+
+With `--latency`, every request to the stand-in is delayed, and so is every
+update on its way to the bot, whether fetched or posted to the webhook, as a
+stand-in for the network to api.telegram.org.
+"""
+import argparse
+import socket
+import statistics
+import threading
+import time
+
+from telegram import Bot, Update
+from telegram.ext import TypeHandler, Updater
+from telegram.utils.request import Request
+
+from tools.fake_bot_api import FakeBotApi
+
+TOKEN = "123456:bench"
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def run(mode: str, n: int, rate: float, latency: float) -> list:
+    api = FakeBotApi(latency=latency).start()
+    bot = Bot(token=TOKEN, base_url=api.base_url, request=Request(con_pool_size=8))
+    updater = Updater(bot=bot)
+    pushed, handled = {}, {}
+    done = threading.Event()
+
+    def record(update: Update, context):
+        handled[update.update_id] = time.perf_counter()
+        if len(handled) == n:
+            done.set()
+
+    updater.dispatcher.add_handler(TypeHandler(Update, record))
+    if mode == "webhook":
+        port = free_port()
+        updater.start_webhook(
+            listen="127.0.0.1",
+            port=port,
+            url_path="secret",
+            webhook_url=f"http://127.0.0.1:{port}/secret",
+        )
+    else:
+        updater.start_polling(poll_interval=0, timeout=10)
+    time.sleep(0.5)
+
+    for i in range(n):
+        start = time.perf_counter()
+        pushed[api.push_message(1, f"message {i}")] = start
+        time.sleep(max(0, 1 / rate - (time.perf_counter() - start)))
+    done.wait(30)
+    updater.stop()
+    api.stop()
+    return [handled[uid] - pushed[uid] for uid in pushed if uid in handled]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-n", type=int, default=500, help="updates per mode")
+    parser.add_argument("--rate", type=float, default=50, help="updates per second")
+    parser.add_argument(
+        "--latency", type=float, default=20, help="simulated network latency in ms"
+    )
+    args = parser.parse_args()
+
+    for mode in ("polling", "webhook"):
+        latencies = sorted(run(mode, args.n, args.rate, args.latency / 1000))
+        print(
+            f"{mode:<8} received {len(latencies)}/{args.n}  "
+            f"mean {statistics.mean(latencies) * 1000:7.3f}ms  "
+            f"p50 {latencies[len(latencies) // 2] * 1000:7.3f}ms  "
+            f"p99 {latencies[int(len(latencies) * 0.99)] * 1000:7.3f}ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
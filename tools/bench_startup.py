@@ -0,0 +1,105 @@
+"""Measure how long `python main.py --help` takes, and how much of it is
+spent importing each module and reading the configuration.
+
+    python -m tools.bench_startup [-n RUNS] [--secrets DIR] [--top N]
+
+Runs in a sandbox (see `tools.sandbox`), or with the secrets directory given.
+"""
+import argparse
+import os
+import re
+import shutil
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+MAIN = Path(__file__).resolve().parent.parent / "main.py"
+
+
+def startup(args: list) -> float:
+    start = time.perf_counter()
+    subprocess.run([sys.executable, str(MAIN), *args], check=True, capture_output=True)
+    return time.perf_counter() - start
+
+
+def import_times(top: int) -> list:
+    """(cumulative seconds, module) of the slowest top-level imports."""
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", str(MAIN), "--help"],
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stderr
+    times = []
+    # import time: self [us] | cumulative | imported package
+    for match in re.finditer(
+        r"^import time:\s+\d+ \|\s+(\d+) \| (\S.*)$", stderr, re.M
+    ):
+        # indented are imported by others, and part of their cumulative time
+        if not match.group(2).startswith(" "):
+            times.append((int(match.group(1)) / 1e6, match.group(2)))
+    return sorted(times, reverse=True)[:top]
+
+
+def config_times(runs: int) -> tuple:
+    """Seconds to read and validate the secrets, to check that they are
+    unchanged, and to look one up (as handlers do)."""
+    from src import config
+
+    cold, checked = [], []
+    for _ in range(runs):
+        config._cache = None
+        start = time.perf_counter()
+        config.load_config()
+        cold.append(time.perf_counter() - start)
+    for _ in range(runs):
+        config._checked = 0.0
+        start = time.perf_counter()
+        config.load_config()
+        checked.append(time.perf_counter() - start)
+    start = time.perf_counter()
+    for _ in range(runs):
+        config.ORGA_GROUPS
+    lookup = (time.perf_counter() - start) / runs
+    return statistics.median(cold), statistics.median(checked), lookup
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-n", type=int, default=10, help="runs of main.py --help")
+    parser.add_argument("--secrets", help="secrets directory to read")
+    parser.add_argument("--top", type=int, default=10, help="imports to list")
+    args = parser.parse_args()
+
+    from tools.sandbox import enter_sandbox
+
+    secrets = os.path.abspath(args.secrets) if args.secrets else None
+    directory = enter_sandbox()
+    if secrets:
+        shutil.rmtree(f"{directory}/unifest-secrets")
+        shutil.copytree(secrets, f"{directory}/unifest-secrets")
+
+    # the first run warms up the bytecode cache and file system
+    startup(["--help"])
+    times = sorted(startup(["--help"]) for _ in range(args.n))
+    print(
+        f"main.py --help: median {statistics.median(times) * 1000:.0f} ms, "
+        f"min {times[0] * 1000:.0f} ms, max {times[-1] * 1000:.0f} ms "
+        f"({args.n} runs)\n"
+    )
+    print("slowest imports (cumulative):")
+    for seconds, module in import_times(args.top):
+        print(f"  {seconds * 1000:8.1f} ms  {module}")
+
+    cold, checked, lookup = config_times(100)
+    print(
+        f"\nconfiguration: {cold * 1000:.2f} ms to read and validate, "
+        f"{checked * 1e6:.0f} µs to check for changes, "
+        f"{lookup * 1e6:.1f} µs per lookup"
+    )
+
+
+if __name__ == "__main__":
+    main()
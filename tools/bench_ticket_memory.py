@@ -0,0 +1,77 @@
+"""Measure memory per ticket, for the slotted Ticket with interned group names
+against a plain object holding its own copies (as Ticket used to).
+
+    python -m tools.bench_ticket_memory [-n TICKETS]
+"""
+import argparse
+import gc
+import pickle
+import random
+import tracemalloc
+
+from src.tickets_data import Ticket, TicketStatus, register_groups
+
+ORGA = ["Zentrale", "Finanz", "BiMi"]
+STALLS = [f"Stand {i}" for i in range(60)]
+
+
+class DictTicket:
+    """Ticket as it was before: per-instance __dict__, no interning."""
+
+    def __init__(self, group_requesting, group_tasked, text, uid, status):
+        self.uid = uid
+        self.status = status
+        self.group_requesting = group_requesting
+        self.group_tasked = group_tasked
+        self.text = text
+        self.who = ""
+
+
+def copy(name: str) -> str:
+    # names usually arrive fresh from telegram updates or unpickling
+    return "".join(list(name))
+
+
+def build(cls, n: int) -> list:
+    rng = random.Random(n)
+    return [
+        cls(
+            copy(rng.choice(STALLS)),
+            copy(rng.choice(ORGA)),
+            f"Stand {uid % 60} [Stand {uid % 60}] hat noch ~20 Normale Becher",
+            uid=uid,
+            status=TicketStatus.OPEN,
+        )
+        for uid in range(n)
+    ]
+
+
+def measure(cls, n: int) -> float:
+    gc.collect()
+    tracemalloc.start()
+    tickets = build(cls, n)
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del tickets
+    return size / n
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-n", type=int, default=100_000, help="number of tickets")
+    args = parser.parse_args()
+    register_groups(ORGA + STALLS)
+
+    before = measure(DictTicket, args.n)
+    after = measure(Ticket, args.n)
+    print(f"{args.n} tickets, including text")
+    print(f"  __dict__, own copies:   {before:7.1f} bytes per ticket")
+    print(f"  __slots__, interned:    {after:7.1f} bytes per ticket")
+
+    tickets = {t.uid: t for t in build(Ticket, 1000)}
+    size = len(pickle.dumps(tickets, protocol=pickle.HIGHEST_PROTOCOL))
+    print(f"  pickled:                {size / 1000:7.1f} bytes per ticket")
+
+
+if __name__ == "__main__":
+    main()
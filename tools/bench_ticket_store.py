@@ -0,0 +1,86 @@
+"""Compare per-group ticket listings of a plain dict scan (as `/wip`, `/close`,
+`/tickets` and `/status` used to do) against the indexed TicketStore.
+
+    python -m tools.bench_ticket_store [--sizes 10000 100000]
+"""
+import argparse
+import random
+import time
+
+from src.tickets_data import Ticket, TicketStatus, TicketStore, register_groups
+
+ORGA = ["Zentrale", "Finanz", "BiMi"]
+STALLS = [f"Stand {i}" for i in range(60)]
+
+
+def make_tickets(n: int) -> dict:
+    rng = random.Random(n)
+    tickets = {}
+    for uid in range(1, n + 1):
+        ticket = Ticket(rng.choice(STALLS), rng.choice(ORGA), f"ticket {uid}", uid=uid)
+        if rng.random() < 0.3:
+            ticket.set_wip("bench")
+        tickets[uid] = ticket
+    return tickets
+
+
+def timed(func, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000])
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+    register_groups(ORGA + STALLS)
+
+    for n in args.sizes:
+        tickets = make_tickets(n)
+        start = time.perf_counter()
+        store = TicketStore(tickets)
+        build = time.perf_counter() - start
+        values = tickets.values()
+
+        queries = {
+            "/wip": (
+                lambda: [t for t in values if t.is_open() and t.is_tasked("Finanz")],
+                lambda: store.tasked("Finanz", TicketStatus.OPEN),
+            ),
+            "/tickets": (
+                lambda: [t for t in values if t.is_tasked("Finanz")],
+                lambda: store.tasked("Finanz"),
+            ),
+            "/status": (
+                lambda: [t for t in values if t.is_requesting("Stand 7")],
+                lambda: store.requesting("Stand 7"),
+            ),
+        }
+        print(f"{n} tickets (building indexes: {build * 1000:.1f}ms)")
+        for name, (scan, indexed) in queries.items():
+            assert scan() == indexed()
+            t_scan = timed(scan, args.repeat)
+            t_indexed = timed(indexed, args.repeat)
+            print(
+                f"  {name:<9} scan {t_scan * 1000:8.3f}ms  "
+                f"indexed {t_indexed * 1000:8.3f}ms  "
+                f"({t_scan / t_indexed:6.1f}x)"
+            )
+
+        uid = n // 2
+        ticket = store[uid]
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            ticket.status = TicketStatus.OPEN
+            store.add(ticket)
+            ticket.set_wip("bench")
+            store.add(ticket)
+        update = (time.perf_counter() - start) / (2 * args.repeat)
+        print(f"  status change with re-indexing {update * 1e6:.2f}µs")
+
+
+if __name__ == "__main__":
+    main()
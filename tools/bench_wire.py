@@ -0,0 +1,77 @@
+"""Compare payload size and encode time of ticket messages for the dashboard:
+indented JSON (as published before), and the compact JSON and MessagePack
+wire formats.
+
+    python -m tools.bench_wire [-n TICKETS]
+"""
+import argparse
+import json
+import random
+import time
+
+from src.tickets_data import Ticket, TicketStatus, register_groups
+from src.wire import encode_ticket
+
+ORGA = ["Zentrale", "Finanz", "BiMi"]
+STALLS = [f"Stand {i}" for i in range(60)]
+EPOCH = int(time.time())
+
+
+def indented(ticket: Ticket) -> bytes:
+    return json.dumps(
+        {
+            "group_requesting": ticket.group_requesting,
+            "group_tasked": ticket.group_tasked,
+            "text": ticket.text,
+            "uid": ticket.uid,
+            "who": ticket.who,
+            "status": ticket.status.name,
+        },
+        indent=2,
+    ).encode()
+
+
+def make_tickets(n: int) -> list:
+    rng = random.Random(n)
+    tickets = []
+    for uid in range(n):
+        stall = rng.choice(STALLS)
+        ticket = Ticket(
+            stall,
+            rng.choice(ORGA),
+            f"Ort {uid % 60} [{stall}] hat noch ~20 Normale Becher",
+            uid=uid,
+        )
+        if rng.random() < 0.5:
+            ticket.set_wip("Jo")
+        tickets.append(ticket)
+    return tickets
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-n", type=int, default=10_000, help="number of tickets")
+    args = parser.parse_args()
+    register_groups(ORGA + STALLS)
+    tickets = make_tickets(args.n)
+
+    encoders = {
+        "indented JSON": indented,
+        "compact JSON": lambda t: encode_ticket(t, EPOCH, t.uid, "json"),
+        "MessagePack": lambda t: encode_ticket(t, EPOCH, t.uid, "msgpack"),
+    }
+    baseline = None
+    print(f"{args.n} tickets ({TicketStatus.OPEN.name} and {TicketStatus.WIP.name})")
+    for name, func in encoders.items():
+        start = time.perf_counter()
+        size = sum(len(func(ticket)) for ticket in tickets)
+        elapsed = time.perf_counter() - start
+        baseline = baseline or size
+        print(
+            f"  {name:<14} {size / args.n:6.1f} bytes per ticket "
+            f"({size / baseline:4.0%})  encode {elapsed / args.n * 1e6:6.2f}µs"
+        )
+
+
+if __name__ == "__main__":
+    main()
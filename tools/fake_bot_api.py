@@ -0,0 +1,440 @@
+"""Local stand-in for the Telegram Bot API, for benchmarks and load tests.
+
+Point a bot at `FakeBotApi.base_url` (e.g. `Bot(token, base_url=api.base_url)`)
+and every request is answered locally instead of by api.telegram.org.
+Incoming updates are injected with `push_update`, and are either handed out
+by getUpdates or posted to the webhook, once one is set. Flood control and
+blocked chats are simulated with `retry_after` and `block`.
+
+It can also run on its own, for `main.py --base-url`:
+
+    python -m tools.fake_bot_api [--port PORT] [--latency SECONDS]
+        [--retry-after-rate P] [--blocked CHAT_ID ...]
+"""
+import argparse
+import functools
+import http.client
+import itertools
+import json
+import logging
+import queue
+import random
+import socket
+import threading
+import time
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+log = logging.getLogger(__name__)
+
+BOT_USER = {
+    "id": 1,
+    "is_bot": True,
+    "first_name": "UnifestBestellBot",
+    "username": "UnifestBestellBot",
+}
+
+
+class FakeBotApi:
+    """Answers Bot API requests on localhost, keeping a log of what was sent.
+
+    `latency` seconds are added to every response, and pass between pushing
+    an update and handing it out by getUpdates or posting it to the webhook,
+    to simulate the network to api.telegram.org. A share of `retry_after_rate` of all sent messages
+    fails with flood control, asking to wait `retry_after_seconds`.
+    """
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        latency: float = 0,
+        retry_after_rate: float = 0,
+        retry_after_seconds: int = 1,
+    ):
+        handler = functools.partial(_Handler, self)
+        self.server = ThreadingHTTPServer((host, port), handler)
+        self.server.daemon_threads = True
+        self.latency = latency
+        self.retry_after_rate = retry_after_rate
+        self.retry_after_seconds = retry_after_seconds
+        self._random = random.Random(0)
+        self.lock = threading.Lock()
+        self.calls = []  # (method, params) of every request
+        self.connections = 0  # tcp connections opened by clients
+        self._message_ids = itertools.count(1)
+        self._update_ids = itertools.count(1)
+        self._thread = None
+        # (due, update) not yet fetched by getUpdates, due after `latency`
+        self.updates = []
+        self.updates_changed = threading.Condition(self.lock)
+        self.webhook_url = None
+        self._webhook_queue = queue.Queue()
+        self._webhook_thread = None
+        self.failures = []  # injected errors: [method, chat_id, times, error]
+        self.blocked = set()  # chat ids that blocked the bot
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/bot"
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self.server.serve_forever, name="fake-bot-api", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._webhook_thread:
+            self._webhook_queue.put(None)
+        self.server.shutdown()
+        self.server.server_close()
+
+    def push_update(self, update: dict) -> int:
+        """Deliver `update` (without update_id) to the bot. Returns its id."""
+        update = {"update_id": next(self._update_ids), **update}
+        due = time.monotonic() + self.latency
+        with self.lock:
+            if self.webhook_url:
+                self._webhook_queue.put((due, self.webhook_url, update))
+            else:
+                self.updates.append((due, update))
+                self.updates_changed.notify_all()
+        return update["update_id"]
+
+    def push_message(self, chat_id: int, text: str, user: dict = None) -> int:
+        """Deliver a text message from private chat `chat_id` to the bot."""
+        user = user or {"id": chat_id, "is_bot": False, "first_name": f"U{chat_id}"}
+        message = self.message(chat_id, text, **{"from": user})
+        message["chat"].update(first_name=user["first_name"], username=None)
+        if text.startswith("/"):
+            command = text.split()[0]
+            message["entities"] = [
+                {"type": "bot_command", "offset": 0, "length": len(command)}
+            ]
+        return self.push_update({"message": message})
+
+    def push_callback_query(self, chat_id: int, data: str, message: dict = None):
+        """Deliver a press of an inline keyboard button with `data`, below
+        `message` (a message sent to `chat_id` if not given)."""
+        user = {"id": chat_id, "is_bot": False, "first_name": f"U{chat_id}"}
+        message = message or self.message(chat_id)
+        message["chat"].update(first_name=user["first_name"], username=None)
+        query = {
+            "id": str(next(self._update_ids)),
+            "from": user,
+            "chat_instance": str(chat_id),
+            "message": message,
+            "data": data,
+        }
+        return self.push_update({"callback_query": query})
+
+    def fail(
+        self,
+        method: str,
+        error: "ApiError",
+        times: int = 1,
+        chat_id: int = None,
+    ):
+        """Answer the next `times` calls of `method` (to `chat_id`, if given)
+        with `error` instead."""
+        with self.lock:
+            self.failures.append([method.lower(), chat_id, times, error])
+
+    def retry_after(self, seconds: int, method: str = "sendMessage", times: int = 1):
+        """Make the next `times` calls of `method` hit flood control."""
+        self.fail(method, flood_control(seconds), times)
+
+    def block(self, chat_id: int):
+        """Make every call addressed to `chat_id` fail as Unauthorized, as
+        after a user blocked the bot."""
+        with self.lock:
+            self.blocked.add(int(chat_id))
+
+    def unblock(self, chat_id: int):
+        with self.lock:
+            self.blocked.discard(int(chat_id))
+
+    def _injected_error(self, method: str, params: dict):
+        chat_id = params.get("chat_id")
+        chat_id = int(chat_id) if chat_id not in (None, "") else None
+        with self.lock:
+            if chat_id in self.blocked:
+                return ApiError(403, "Forbidden: bot was blocked by the user")
+            for failure in self.failures:
+                if failure[0] == method and failure[1] in (None, chat_id):
+                    failure[2] -= 1
+                    if not failure[2]:
+                        self.failures.remove(failure)
+                    return failure[3]
+            if (
+                method == "sendmessage"
+                and self.retry_after_rate
+                and self._random.random() < self.retry_after_rate
+            ):
+                return flood_control(self.retry_after_seconds)
+        return None
+
+    def _post_webhooks(self):
+        """Post queued updates to the webhook, in order, over one connection."""
+        connection = None
+        while (item := self._webhook_queue.get()) is not None:
+            due, url, update = item
+            time.sleep(max(0, due - time.monotonic()))
+            parts = urlsplit(url)
+            if connection is None or connection.host != parts.hostname:
+                connection = http.client.HTTPConnection(parts.hostname, parts.port)
+            try:
+                connection.request(
+                    "POST",
+                    parts.path,
+                    body=json.dumps(update),
+                    headers={"Content-Type": "application/json"},
+                )
+                connection.getresponse().read()
+            except (OSError, http.client.HTTPException) as e:
+                log.warning(f"Posting update to webhook failed: {e!r}")
+                connection = None
+
+    def call(self, method: str, params: dict):
+        """Answer API `method`. Returns the `result` of the response."""
+        with self.lock:
+            self.calls.append((method, params))
+        api = getattr(self, f"api_{method.lower()}", None)
+        if api is None:
+            raise ApiError(404, f"Not Found: method {method} not found")
+        time.sleep(self.latency)
+        if error := self._injected_error(method.lower(), params):
+            raise error
+        return api(params)
+
+    def message(self, chat_id, text="", **fields) -> dict:
+        """Build a Message as the API would return it."""
+        chat_id = int(chat_id)
+        return {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "group"},
+            "from": BOT_USER,
+            "text": text,
+            **fields,
+        }
+
+    def api_getme(self, params):
+        return BOT_USER
+
+    def api_getupdates(self, params):
+        offset = int(params.get("offset") or 0)
+        limit = int(params.get("limit") or 100)
+        deadline = time.monotonic() + float(params.get("timeout") or 0)
+        with self.updates_changed:
+            if self.webhook_url:
+                raise ApiError(409, "Conflict: can't use getUpdates with a webhook")
+            # updates below offset are confirmed by the client
+            self.updates = [e for e in self.updates if e[1]["update_id"] >= offset]
+            while True:
+                now = time.monotonic()
+                # in order, an update never overtakes an earlier one
+                due = list(itertools.takewhile(lambda e: e[0] <= now, self.updates))
+                if due or now >= deadline:
+                    return [update for _, update in due[:limit]]
+                wait = deadline - now
+                if self.updates:
+                    wait = min(wait, self.updates[0][0] - now)
+                self.updates_changed.wait(wait)
+
+    def api_setwebhook(self, params):
+        with self.lock:
+            self.webhook_url = params.get("url") or None
+            if self.webhook_url and self._webhook_thread is None:
+                self._webhook_thread = threading.Thread(
+                    target=self._post_webhooks, name="fake-webhook", daemon=True
+                )
+                self._webhook_thread.start()
+            # pending updates go to the webhook from now on
+            if self.webhook_url:
+                for due, update in self.updates:
+                    self._webhook_queue.put((due, self.webhook_url, update))
+                self.updates = []
+        return True
+
+    def api_deletewebhook(self, params):
+        with self.lock:
+            self.webhook_url = None
+            if params.get("drop_pending_updates") in (True, "true", "True"):
+                self.updates = []
+        return True
+
+    def api_getwebhookinfo(self, params):
+        return {
+            "url": self.webhook_url or "",
+            "has_custom_certificate": False,
+            "pending_update_count": len(self.updates),
+        }
+
+    def api_sendmessage(self, params):
+        return self.message(params["chat_id"], params.get("text", ""))
+
+    def api_editmessagetext(self, params):
+        if "inline_message_id" in params:
+            return True
+        message = self.message(params["chat_id"], params.get("text", ""))
+        message.update(message_id=int(params["message_id"]), edit_date=message["date"])
+        return message
+
+    def api_answercallbackquery(self, params):
+        return True
+
+    def api_senddocument(self, params):
+        document = params.get("document")
+        name = document[0] if isinstance(document, tuple) else "document"
+        return self.message(
+            params["chat_id"],
+            caption=params.get("caption", ""),
+            document={"file_id": name, "file_unique_id": name, "file_name": name},
+        )
+
+
+class ApiError(Exception):
+    """Error to be reported to the client in the Bot API error format."""
+
+    def __init__(self, code: int, description: str, parameters: dict = None):
+        super().__init__(description)
+        self.code = code
+        self.description = description
+        self.parameters = parameters
+
+
+def flood_control(seconds: int) -> ApiError:
+    """Error raised as `telegram.error.RetryAfter` by the client."""
+    return ApiError(
+        429,
+        f"Too Many Requests: retry after {seconds}",
+        {"retry_after": seconds},
+    )
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # keep connections alive, like api.telegram.org does
+    protocol_version = "HTTP/1.1"
+
+    def __init__(self, api: FakeBotApi, *args, **kwargs):
+        self.api = api
+        super().__init__(*args, **kwargs)
+
+    def setup(self):
+        super().setup()
+        # headers and body are written separately, don't wait for acks in between
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        with self.api.lock:
+            self.api.connections += 1
+
+    def do_GET(self):
+        self.do_POST()
+
+    def do_POST(self):
+        # paths look like /bot<token>/<method>
+        method = self.path.rstrip("/").rsplit("/", 1)[-1].split("?")[0]
+        try:
+            result = self.api.call(method, self._params())
+            self._reply(200, {"ok": True, "result": result})
+        except ApiError as e:
+            body = {"ok": False, "error_code": e.code, "description": e.description}
+            if e.parameters:
+                body["parameters"] = e.parameters
+            self._reply(e.code, body)
+
+    def _params(self) -> dict:
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        if "?" in self.path:
+            body = body or self.path.split("?", 1)[1].encode()
+        if not body:
+            return {}
+        content_type = self.headers.get("Content-Type", "")
+        if content_type.startswith("application/json"):
+            return json.loads(body)
+        if content_type.startswith("multipart/form-data"):
+            return self._multipart(content_type, body)
+        return dict(parse_qsl(body.decode()))
+
+    @staticmethod
+    def _multipart(content_type: str, body: bytes) -> dict:
+        """Form fields of an upload, files as (filename, content)."""
+        form = BytesParser(policy=HTTP).parsebytes(
+            f"Content-Type: {content_type}\r\n\r\n".encode() + body
+        )
+        params = {}
+        for part in form.iter_parts():
+            name = part.get_param("name", header="content-disposition")
+            if part.get_filename():
+                params[name] = (part.get_filename(), part.get_payload(decode=True))
+            else:
+                params[name] = part.get_payload(decode=True).decode()
+        return params
+
+    def _reply(self, status: int, body: dict):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        log.debug(format % args)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--listen", default="127.0.0.1", help="address to bind to")
+    parser.add_argument("--port", type=int, default=8081, help="port to bind to")
+    parser.add_argument(
+        "--latency", type=float, default=0, help="seconds added to every response"
+    )
+    parser.add_argument(
+        "--retry-after-rate",
+        type=float,
+        default=0,
+        metavar="P",
+        help="share of sent messages failing with flood control",
+    )
+    parser.add_argument(
+        "--retry-after",
+        type=int,
+        default=1,
+        metavar="SECONDS",
+        help="seconds to wait, as asked by flood control",
+    )
+    parser.add_argument(
+        "--blocked",
+        type=int,
+        nargs="*",
+        default=[],
+        metavar="CHAT_ID",
+        help="chats that blocked the bot",
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    api = FakeBotApi(
+        args.listen, args.port, args.latency, args.retry_after_rate, args.retry_after
+    )
+    for chat_id in args.blocked:
+        api.block(chat_id)
+    api.start()
+    log.info(
+        f"Bot API stand-in at {api.base_url}, run main.py --base-url {api.base_url}"
+    )
+    try:
+        api._thread.join()
+    except KeyboardInterrupt:
+        api.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,309 @@
+"""Local stand-in for the MQTT broker (mosquitto), speaking MQTT 3.1.1 over
+websockets like the dashboard bridge and the dashboards do.
+
+Supports what these need: QoS 0 and 1, retained messages, `+` and `#`
+wildcards and last wills. Sessions are not kept across connections, and
+there is no authentication or ACL. `disconnect_all` drops every connection
+without notice, as a broker restart or network failure would.
+"""
+import base64
+import hashlib
+import itertools
+import logging
+import socket
+import struct
+import threading
+from socketserver import StreamRequestHandler, ThreadingTCPServer
+
+log = logging.getLogger(__name__)
+
+WS_GUID = b"258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+CONNECT = 1
+PUBLISH = 3
+PUBACK = 4
+SUBSCRIBE = 8
+UNSUBSCRIBE = 10
+PINGREQ = 12
+DISCONNECT = 14
+
+
+def topic_matches(topic_filter: str, topic: str) -> bool:
+    if topic.startswith("$"):
+        return False
+    parts = topic.split("/")
+    for i, level in enumerate(topic_filter.split("/")):
+        if level == "#":
+            return True
+        if i >= len(parts) or level not in ("+", parts[i]):
+            return False
+    return len(parts) == i + 1
+
+
+class FakeBroker:
+    """MQTT-over-websockets broker on localhost, at `host`:`port`."""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0):
+        self.server = ThreadingTCPServer((host, port), _Handler)
+        self.server.daemon_threads = True
+        self.server.broker = self
+        self.host, self.port = self.server.server_address[:2]
+        self.lock = threading.Lock()
+        self.sessions = set()
+        self.retained = {}  # topic -> payload
+        self.published = 0  # PUBLISH packets received from clients
+        self.connects = 0  # successful CONNECTs, including reconnects
+
+    def start(self):
+        threading.Thread(
+            target=self.server.serve_forever, name="fake-broker", daemon=True
+        ).start()
+        return self
+
+    def stop(self):
+        self.disconnect_all()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def disconnect_all(self):
+        """Drop all connections, wills are published."""
+        with self.lock:
+            sessions = list(self.sessions)
+        for session in sessions:
+            session.drop()
+
+    def publish(self, topic: str, payload: bytes, qos: int = 0, retain: bool = False):
+        """Deliver a message to all matching subscriptions."""
+        with self.lock:
+            if retain:
+                if payload:
+                    self.retained[topic] = payload
+                else:
+                    self.retained.pop(topic, None)
+            sessions = list(self.sessions)
+        for session in sessions:
+            session.deliver(topic, payload, qos)
+
+
+class _Handler(StreamRequestHandler):
+    """One client connection: websocket handshake, then MQTT packets."""
+
+    def setup(self):
+        super().setup()
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.broker = self.server.broker
+        self.write_lock = threading.Lock()
+        self.subscriptions = {}  # topic filter -> qos
+        self.packet_ids = itertools.cycle(range(1, 0x10000))
+        self.will = None
+        self.connected = False
+
+    def handle(self):
+        if not self._handshake():
+            return
+        buffer = b""
+        try:
+            while (data := self._read_frame()) is not None:
+                buffer += data
+                while packet := _split_packet(buffer):
+                    header, body, buffer = packet
+                    if not self._handle_packet(header, body):
+                        # clean disconnect, no will
+                        self.will = None
+                        return
+        except (ConnectionError, OSError, struct.error):
+            pass
+        finally:
+            with self.broker.lock:
+                self.broker.sessions.discard(self)
+            if self.will:
+                self.broker.publish(*self.will)
+
+    def _handshake(self) -> bool:
+        request = self.rfile.readline()
+        headers = {}
+        while (line := self.rfile.readline()) not in (b"\r\n", b"\n", b""):
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        if not request or "sec-websocket-key" not in headers:
+            return False
+        accept = base64.b64encode(
+            hashlib.sha1(headers["sec-websocket-key"].encode() + WS_GUID).digest()
+        )
+        response = [
+            "HTTP/1.1 101 Switching Protocols",
+            "Upgrade: websocket",
+            "Connection: Upgrade",
+            f"Sec-WebSocket-Accept: {accept.decode()}",
+        ]
+        if "mqtt" in headers.get("sec-websocket-protocol", ""):
+            response.append("Sec-WebSocket-Protocol: mqtt")
+        self.wfile.write(("\r\n".join(response) + "\r\n\r\n").encode())
+        return True
+
+    def _read_frame(self):
+        """Payload of the next data frame, None once the connection closes."""
+        while True:
+            head = self.rfile.read(2)
+            if len(head) < 2:
+                return None
+            opcode = head[0] & 0x0F
+            length = head[1] & 0x7F
+            if length == 126:
+                (length,) = struct.unpack(">H", self.rfile.read(2))
+            elif length == 127:
+                (length,) = struct.unpack(">Q", self.rfile.read(8))
+            mask = self.rfile.read(4) if head[1] & 0x80 else b"\0\0\0\0"
+            data = _unmask(self.rfile.read(length), mask)
+            if opcode == 0x8:
+                return None
+            if opcode == 0x9:
+                self._write_frame(data, opcode=0xA)
+            elif opcode in (0x0, 0x1, 0x2):
+                return data
+
+    def _write_frame(self, data: bytes, opcode: int = 0x2):
+        length = len(data)
+        if length < 126:
+            head = struct.pack(">BB", 0x80 | opcode, length)
+        elif length < 0x10000:
+            head = struct.pack(">BBH", 0x80 | opcode, 126, length)
+        else:
+            head = struct.pack(">BBQ", 0x80 | opcode, 127, length)
+        with self.write_lock:
+            self.wfile.write(head + data)
+
+    def _send(self, header: int, body: bytes):
+        self._write_frame(bytes([header]) + _varint(len(body)) + body)
+
+    def _handle_packet(self, header: int, body: bytes) -> bool:
+        kind = header >> 4
+        if kind == CONNECT:
+            self._connect(body)
+        elif kind == PUBLISH:
+            qos = (header >> 1) & 0x03
+            topic, pos = _read_str(body, 0)
+            if qos:
+                packet_id = body[pos : pos + 2]
+                pos += 2
+                self._send(PUBACK << 4, packet_id)
+            with self.broker.lock:
+                self.broker.published += 1
+            self.broker.publish(topic, body[pos:], qos, bool(header & 0x01))
+        elif kind == SUBSCRIBE:
+            self._subscribe(body)
+        elif kind == UNSUBSCRIBE:
+            pos = 2
+            while pos < len(body):
+                topic_filter, pos = _read_str(body, pos)
+                self.subscriptions.pop(topic_filter, None)
+            self._send(0xB0, body[:2])
+        elif kind == PINGREQ:
+            self._send(0xD0, b"")
+        elif kind == DISCONNECT:
+            return False
+        return True
+
+    def _connect(self, body: bytes):
+        _, pos = _read_str(body, 0)  # protocol name
+        flags = body[pos + 1]
+        _, pos = _read_str(body, pos + 4)  # client id, after level and keepalive
+        if flags & 0x04:
+            topic, pos = _read_str(body, pos)
+            message, pos = _read_bytes(body, pos)
+            self.will = (topic, message, (flags >> 3) & 0x03, bool(flags & 0x20))
+        # username and password are not checked
+        self._send(0x20, b"\x00\x00")
+        self.connected = True
+        with self.broker.lock:
+            self.broker.sessions.add(self)
+            self.broker.connects += 1
+
+    def _subscribe(self, body: bytes):
+        pos = 2
+        granted = []
+        new = []
+        while pos < len(body):
+            topic_filter, pos = _read_str(body, pos)
+            qos = min(body[pos], 1)
+            pos += 1
+            self.subscriptions[topic_filter] = qos
+            granted.append(qos)
+            new.append(topic_filter)
+        self._send(0x90, body[:2] + bytes(granted))
+        with self.broker.lock:
+            retained = list(self.broker.retained.items())
+        for topic, payload in retained:
+            for topic_filter in new:
+                if topic_matches(topic_filter, topic):
+                    qos = self.subscriptions[topic_filter]
+                    self._publish(topic, payload, qos, retain=True)
+                    break
+
+    def deliver(self, topic: str, payload: bytes, qos: int):
+        qos_granted = [
+            q for f, q in list(self.subscriptions.items()) if topic_matches(f, topic)
+        ]
+        if qos_granted:
+            try:
+                self._publish(topic, payload, min(qos, max(qos_granted)))
+            except OSError:
+                pass
+
+    def _publish(self, topic: str, payload: bytes, qos: int, retain: bool = False):
+        body = _str(topic)
+        if qos:
+            body += struct.pack(">H", next(self.packet_ids))
+        self._send((PUBLISH << 4) | (qos << 1) | retain, body + payload)
+
+    def drop(self):
+        try:
+            self.request.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+
+def _unmask(data: bytes, mask: bytes) -> bytes:
+    n = len(data)
+    key = (mask * (n // 4 + 1))[:n]
+    return (int.from_bytes(data, "big") ^ int.from_bytes(key, "big")).to_bytes(n, "big")
+
+
+def _varint(n: int) -> bytes:
+    out = bytearray()
+    while True:
+        n, digit = divmod(n, 128)
+        out.append(digit | (0x80 if n else 0))
+        if not n:
+            return bytes(out)
+
+
+def _split_packet(buffer: bytes):
+    """(header, body, rest) of the first complete packet in `buffer`."""
+    length, multiplier, pos = 0, 1, 1
+    while True:
+        if pos >= len(buffer):
+            return None
+        length += (buffer[pos] & 0x7F) * multiplier
+        multiplier *= 128
+        pos += 1
+        if not buffer[pos - 1] & 0x80:
+            break
+    if len(buffer) < pos + length:
+        return None
+    return buffer[0], buffer[pos : pos + length], buffer[pos + length :]
+
+
+def _read_bytes(body: bytes, pos: int):
+    (length,) = struct.unpack_from(">H", body, pos)
+    return body[pos + 2 : pos + 2 + length], pos + 2 + length
+
+
+def _read_str(body: bytes, pos: int):
+    data, pos = _read_bytes(body, pos)
+    return data.decode(), pos
+
+
+def _str(s: str) -> bytes:
+    data = s.encode()
+    return struct.pack(">H", len(data)) + data
@@ -0,0 +1,367 @@
+"""Simulate festival load against the whole bot, wired to the local Bot API
+stand-in: stalls register and request cups (or change, or something else)
+and sometimes revoke, orga workers take tickets with /wip, /close them and
+look at /all. Reports handler latency percentiles, sends per second and
+queue depths, to tell how many stalls one instance can serve.
+
+    python -m tools.loadgen [--stalls N] [--orga M] [--rate TICKETS_PER_SECOND]
+        [--ramp SECONDS] [--duration SECONDS] [--latency SECONDS] [BOT OPTIONS]
+
+Options not known here (e.g. `--workers 8`) are passed on to the bot.
+Handler latency is the time from delivering an update to the bot until its
+answer in the same chat reaches the stand-in.
+"""
+import argparse
+import json
+import logging
+import os
+import queue
+import random
+import re
+import signal
+import statistics
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from tools.fake_bot_api import FakeBotApi
+from tools.sandbox import ORGA, enter_sandbox, stalls
+
+# seconds to wait for an answer before counting a timeout
+TIMEOUT = 30
+# how often queue depths are sampled, in seconds
+SAMPLE_INTERVAL = 0.5
+# share of tickets a stall revokes right away
+REVOKE_RATE = 0.1
+# (share, steps) of the request flows, as (sent text, expected answer)
+FLOWS = [
+    (
+        0.6,
+        [
+            ("/request", "Kategorie"),
+            ("Becher", "dreckige Becher abgeholt oder neue"),
+            ("Normale Becher", "Wie viel habt ihr noch"),
+            ("~20", r"Ticket #\d+ erstellt"),
+        ],
+    ),
+    (
+        0.2,
+        [
+            ("/request", "Kategorie"),
+            ("Geld", "Geld abgeholt oder Wechselgeld"),
+            ("Wechselgeld", r"Ticket #\d+ erstellt"),
+        ],
+    ),
+    (
+        0.2,
+        [
+            ("/request", "Kategorie"),
+            ("Sonstiges", "Was braucht Ihr"),
+            ("Kabeltrommel, haben keine mehr", r"Ticket #\d+ erstellt"),
+        ],
+    ),
+]
+
+
+class LoadApi(FakeBotApi):
+    """Bot API stand-in handing what the bot sends to the simulated users."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.inboxes = {}  # chat_id -> queue of (method, params, result)
+        self.sends = []  # times of sent and edited messages
+
+    def call(self, method: str, params: dict):
+        result = super().call(method, params)
+        if method in ("sendMessage", "editMessageText"):
+            self.sends.append(time.perf_counter())
+            inbox = self.inboxes.get(int(params["chat_id"]))
+            if inbox:
+                inbox.put((method, params, result))
+        return result
+
+
+class User:
+    """Someone chatting with the bot, waiting for each answer before going on."""
+
+    def __init__(self, api: LoadApi, chat_id: int, report: "Report"):
+        self.api = api
+        self.chat_id = chat_id
+        self.report = report
+        self.inbox = api.inboxes[chat_id] = queue.Queue()
+
+    def send(self, text: str, expect: str, step: str = None):
+        """Send `text`, return the answer matching `expect` (or None)."""
+        self._drain()
+        start = time.perf_counter()
+        self.api.push_message(self.chat_id, text)
+        if not step:
+            step = text.split()[0] if text.startswith("/") else text[:16]
+        return self._wait(start, "sendMessage", expect, step)
+
+    def press(self, data: str, message: dict, step: str):
+        """Press the inline button with `data` below `message`."""
+        self._drain()
+        start = time.perf_counter()
+        self.api.push_callback_query(self.chat_id, data, dict(message))
+        return self._wait(start, "editMessageText", "", step)
+
+    def _drain(self):
+        # notifications, e.g. about tickets of the group
+        while not self.inbox.empty():
+            self.inbox.get_nowait()
+
+    def _wait(self, start: float, method: str, expect: str, step: str):
+        deadline = start + TIMEOUT
+        while (timeout := deadline - time.perf_counter()) > 0:
+            try:
+                sent, params, result = self.inbox.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if sent == method and re.search(expect, params.get("text", "")):
+                self.report.latency(step, time.perf_counter() - start)
+                return params, result
+        self.report.timeout(step)
+        return None
+
+
+def buttons(answer, prefix: str) -> list:
+    """callback_data of the inline buttons in `answer` starting with `prefix`."""
+    markup = answer[0].get("reply_markup") or {}
+    if isinstance(markup, str):
+        markup = json.loads(markup)
+    return [
+        button["callback_data"]
+        for row in markup.get("inline_keyboard", [])
+        for button in row
+        if button.get("callback_data", "").startswith(prefix)
+    ]
+
+
+class Report:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.start = None
+        self.steady = float("inf")  # end of the ramp
+        self.latencies = defaultdict(list)  # step -> [seconds] after the ramp
+        self.timeouts = defaultdict(int)
+        self.tickets = 0
+        self.skipped = 0  # tickets not started, all stalls were busy
+        self.samples = defaultdict(list)  # queue name -> [depth]
+
+    def latency(self, step: str, seconds: float):
+        if time.perf_counter() >= self.steady:
+            with self.lock:
+                self.latencies[step].append(seconds)
+
+    def timeout(self, step: str):
+        with self.lock:
+            self.timeouts[step] += 1
+
+    def sample(self, depths: dict):
+        if time.perf_counter() >= self.steady:
+            for name, depth in depths.items():
+                self.samples[name].append(depth)
+
+    def print(self, sends: list, end: float):
+        print(
+            f"{self.tickets} tickets requested, {self.skipped} skipped as all "
+            f"stalls were busy, {sum(self.timeouts.values())} timeouts"
+        )
+        print("\nhandler latency after the ramp (ms):")
+        print(f"  {'':<16} {'n':>6} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>8}")
+        everything = []
+        for step, latencies in sorted(self.latencies.items()):
+            everything += latencies
+            self._row(step, latencies)
+        if everything:
+            self._row("all", everything)
+
+        steady = [t for t in sends if self.steady <= t <= end]
+        per_second = defaultdict(int)
+        for t in steady:
+            per_second[int(t - self.steady)] += 1
+        seconds = max(end - self.steady, 1e-9)
+        print(
+            f"\nsends {len(steady) / seconds:.1f}/s on average, "
+            f"{max(per_second.values(), default=0)}/s at most"
+        )
+        print("\nqueue depths      mean      max")
+        for name, depths in self.samples.items():
+            print(f"  {name:<12} {statistics.mean(depths):7.1f} {max(depths):8}")
+
+    def _row(self, step: str, latencies: list):
+        latencies = sorted(latencies)
+
+        def ms(p):
+            return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000
+
+        print(
+            f"  {step:<16} {len(latencies):>6} {ms(0.5):8.1f} {ms(0.95):8.1f} "
+            f"{ms(0.99):8.1f} {latencies[-1] * 1000:8.1f}"
+        )
+
+
+def request_ticket(user: User, group: str, rng: random.Random, report: Report):
+    """One ticket request of a stall, registered at `group`."""
+    flow = rng.choices([f for _, f in FLOWS], [share for share, _ in FLOWS])[0]
+    answer = None
+    for text, expect in flow:
+        if not (answer := user.send(text, expect)):
+            user.send("/cancel", "abgebrochen")
+            return
+    with report.lock:
+        report.tickets += 1
+    if rng.random() < REVOKE_RATE:
+        uid = re.search(r"#(\d+)", answer[0]["text"])[1]
+        answer = user.send("/revoke", "Offene Tickets|Keine offenen")
+        if answer and f"revoke #{uid}" in buttons(answer, "revoke #"):
+            user.press(f"revoke #{uid}", answer[1], "revoke button")
+
+
+def orga_worker(user: User, rng: random.Random, think: float, stop: threading.Event):
+    """Take open tickets of the orga group, close them, now and then look at all."""
+    while not stop.wait(rng.expovariate(1 / think)):
+        if rng.random() < 0.1:
+            user.send("/all", "Tickets")
+            continue
+        answer = user.send("/wip", "Offene Tickets|Keine offenen")
+        if answer and (open_tickets := buttons(answer, "wip #")):
+            user.press(rng.choice(open_tickets), answer[1], "wip button")
+        if stop.wait(rng.expovariate(1 / think)):
+            return
+        answer = user.send("/close", "WIP Tickets|Keine Tickets WIP")
+        if answer and (wip_tickets := buttons(answer, "close #")):
+            user.press(rng.choice(wip_tickets), answer[1], "close button")
+
+
+def get_dispatcher():
+    """The bot's dispatcher, of whichever class `main` chose."""
+    from telegram.ext import Dispatcher
+
+    from src.concurrency import ChatSerialDispatcher
+
+    for cls in (ChatSerialDispatcher, Dispatcher):
+        try:
+            return cls.get_instance()
+        except RuntimeError:
+            pass
+
+
+def run(api: LoadApi, args, report: Report):
+    """Drive the load, once the bot is polling. Stops the bot when done."""
+    try:
+        drive(api, args, report)
+    finally:
+        os.kill(os.getpid(), signal.SIGINT)
+
+
+def drive(api: LoadApi, args, report: Report):
+    from src.outbox import get_outbox
+
+    while not any(method == "getUpdates" for method, _ in list(api.calls)):
+        time.sleep(0.1)
+    dispatcher = get_dispatcher()
+    rng = random.Random(0)
+    stop = threading.Event()
+
+    # register everybody before the load starts
+    idle = queue.Queue()
+    for i, group in enumerate(stalls(args.stalls)):
+        user = User(api, 1000 + i, report)
+        if answer := user.send("/register", "Mögliche Gruppen"):
+            user.press(group, answer[1], "register button")
+        idle.put((user, group))
+    workers = []
+    for i in range(args.orga):
+        user = User(api, 2000 + i, report)
+        user.send(f"/register {ORGA[i % len(ORGA)]}", "Anmelden bei Gruppe")
+        workers.append(
+            threading.Thread(
+                target=orga_worker,
+                args=(user, random.Random(i), args.think, stop),
+                daemon=True,
+            )
+        )
+
+    def sample():
+        while not stop.wait(SAMPLE_INTERVAL):
+            depths = {
+                "bot api": len(api.updates),
+                "dispatcher": dispatcher.update_queue.qsize(),
+                "outbox": get_outbox().pending(),
+            }
+            if hasattr(dispatcher, "pending"):
+                depths["chat workers"] = dispatcher.pending()
+            report.sample(depths)
+
+    def request(user, group):
+        try:
+            request_ticket(user, group, random.Random(rng.random()), report)
+        finally:
+            idle.put((user, group))
+
+    report.start = time.perf_counter()
+    report.steady = report.start + args.ramp
+    for worker in workers:
+        worker.start()
+    threading.Thread(target=sample, daemon=True).start()
+    end = report.steady + args.duration
+    started = 0
+    with ThreadPoolExecutor(args.stalls) as pool:
+        while (now := time.perf_counter()) < end:
+            # tickets due by now, ramping up linearly to the target rate
+            t = now - report.start
+            if t < args.ramp:
+                due = args.rate * t * t / (2 * args.ramp)
+            else:
+                due = args.rate * (t - args.ramp / 2)
+            while started < int(due):
+                started += 1
+                try:
+                    pool.submit(request, *idle.get_nowait())
+                except queue.Empty:
+                    report.skipped += 1
+            time.sleep(0.01)
+        stop.set()
+    report.print(api.sends, end)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--stalls", type=int, default=60, help="stalls")
+    parser.add_argument("--orga", type=int, default=6, help="orga workers")
+    parser.add_argument(
+        "--rate", type=float, default=2, help="target tickets per second, overall"
+    )
+    parser.add_argument(
+        "--ramp", type=float, default=10, help="seconds to reach the target rate"
+    )
+    parser.add_argument(
+        "--duration", type=float, default=30, help="seconds at the target rate"
+    )
+    parser.add_argument(
+        "--think", type=float, default=1, help="mean pause of orga workers"
+    )
+    parser.add_argument(
+        "--latency", type=float, default=0.05, help="latency of the Bot API"
+    )
+    args, bot_args = parser.parse_known_args()
+
+    api = LoadApi(latency=args.latency).start()
+    enter_sandbox(groups=stalls(args.stalls))
+    logging.basicConfig(level=logging.CRITICAL)
+    # reads the sandbox's secrets
+    import main as bot
+    from src.parser import parse_args
+
+    bot_args = parse_args(bot_args + ["--base-url", api.base_url])
+    report = Report()
+    threading.Thread(target=run, args=(api, args, report), daemon=True).start()
+    bot.main(**vars(bot_args))
+    api.stop()
+
+
+if __name__ == "__main__":
+    main()
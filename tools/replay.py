@@ -0,0 +1,120 @@
+"""Feed updates recorded with `main.py --record FILE` back through the bot's
+handlers, offline against the Bot API stand-in, and report the time spent
+per handler. Run it before and after a change to catch regressions with real
+festival traffic.
+
+    python -m tools.replay FILE [--speed FACTOR] [--latency SECONDS]
+        [--secrets DIR] [--persistence FILE]
+
+Updates are handled one after another, as fast as possible, or at their
+recorded timing with `--speed` (1 is the original pace, 2 twice as fast).
+The bot starts from scratch, or from a copy of the `bot_persistence.sqlite`
+from when the recording began. Recordings of a real event need the event's
+secrets directory, for its groups.
+"""
+import argparse
+import json
+import shutil
+import time
+from collections import defaultdict
+from queue import Queue
+
+from telegram import Update
+from telegram.ext import Dispatcher
+
+from tools.fake_bot_api import FakeBotApi
+from tools.sandbox import enter_sandbox
+
+
+def percentile(values: list, p: float) -> float:
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def report(timings: dict, elapsed: float, updates: int):
+    print(
+        f"{updates} updates in {elapsed:.2f}s ({updates / elapsed:.0f}/s)\n\n"
+        f"  {'handler':<16} {'n':>6} {'total s':>8} {'mean':>8} {'p50':>8} "
+        f"{'p95':>8} {'p99':>8} {'max':>8}  (ms)"
+    )
+    for name, times in sorted(timings.items(), key=lambda item: -sum(item[1])):
+        times = sorted(times)
+        print(
+            f"  {name:<16} {len(times):>6} {sum(times):8.3f} "
+            f"{sum(times) / len(times) * 1000:8.2f} "
+            f"{percentile(times, 0.5) * 1000:8.2f} "
+            f"{percentile(times, 0.95) * 1000:8.2f} "
+            f"{percentile(times, 0.99) * 1000:8.2f} {times[-1] * 1000:8.2f}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("file", help="recorded updates")
+    parser.add_argument(
+        "--speed",
+        type=float,
+        help="replay at the recorded timing, this many times faster",
+    )
+    parser.add_argument(
+        "--latency", type=float, default=0, help="latency of the Bot API"
+    )
+    parser.add_argument("--secrets", help="secrets directory of the recording")
+    parser.add_argument("--persistence", help="bot_persistence.sqlite to start from")
+    args = parser.parse_args()
+    with open(args.file, encoding="utf-8") as file:
+        recorded = [json.loads(line) for line in file if line.strip()]
+
+    api = FakeBotApi(latency=args.latency).start()
+    directory = enter_sandbox()
+    if args.secrets:
+        shutil.copytree(
+            args.secrets, f"{directory}/unifest-secrets", dirs_exist_ok=True
+        )
+    if args.persistence:
+        shutil.copy(args.persistence, f"{directory}/bot_persistence.sqlite")
+
+    # reads the sandbox's secrets
+    from src.archive import archive_init, archive_stop
+    from src.handlers import add_handlers, add_hook
+    from src.outbox import outbox_stop
+    from src.persistence import SQLitePersistence
+    from src.utils import get_bot
+
+    archive_init("ticket_archive.sqlite")
+    persistence = SQLitePersistence(filename="bot_persistence.sqlite")
+    bot = get_bot(base_url=api.base_url)
+    dispatcher = Dispatcher(bot, Queue(), persistence=persistence, use_context=True)
+    add_handlers(dispatcher)
+
+    timings = defaultdict(list)
+
+    def timing(name, call):
+        start = time.perf_counter()
+        try:
+            return call()
+        finally:
+            timings[name].append(time.perf_counter() - start)
+
+    add_hook(timing)
+    start = time.perf_counter()
+    for entry in recorded:
+        if args.speed:
+            due = start + (entry["t"] - recorded[0]["t"]) / args.speed
+            time.sleep(max(0, due - time.perf_counter()))
+        update_start = time.perf_counter()
+        dispatcher.process_update(Update.de_json(entry["u"], bot))
+        # besides the handlers, includes finding them and writing the persistence
+        timings["(update)"].append(time.perf_counter() - update_start)
+    flush_start = time.perf_counter()
+    persistence.flush()
+    timings["(flush)"].append(time.perf_counter() - flush_start)
+    elapsed = time.perf_counter() - start
+
+    report(timings, elapsed, len(recorded))
+    outbox_stop(timeout=1)
+    archive_stop()
+    api.stop()
+
+
+if __name__ == "__main__":
+    main()
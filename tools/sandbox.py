@@ -0,0 +1,51 @@
+"""Throwaway configuration for running the bot's modules against the local
+stand-ins, without the real secrets directory.
+
+`src.config` reads `unifest-secrets/` relative to the working directory when
+its secrets are first used, so call `enter_sandbox` before using anything
+from `src`.
+"""
+import json
+import os
+import tempfile
+from pathlib import Path
+
+TOKEN = "123456:sandbox"
+
+
+def stalls(n: int) -> list:
+    return [f"Stand {i}" for i in range(1, n + 1)]
+
+
+GROUPS = stalls(20)
+ORGA = ["Zentrale", "Finanz", "BiMi"]
+CHANNEL_ID = -100
+DEVELOPER_ID = 99
+
+
+def write_secrets(directory, mqtt: dict = None, groups: list = GROUPS):
+    """Write a secrets directory below `directory`. Without `mqtt`, the bot
+    does not connect to a broker."""
+    secrets = Path(directory) / "unifest-secrets"
+    secrets.mkdir(parents=True, exist_ok=True)
+    files = {
+        "token.json": TOKEN,
+        "groups.json": groups,
+        "mapping.json": {group: f"Ort {group[6:]}" for group in groups},
+        "channel.json": CHANNEL_ID,
+        "developer.json": DEVELOPER_ID,
+        "orga.json": ORGA,
+        "hidden.json": [],
+        "mqtt.json": mqtt or {},
+    }
+    for name, content in files.items():
+        (secrets / name).write_text(json.dumps(content))
+
+
+def enter_sandbox(mqtt: dict = None, groups: list = GROUPS) -> str:
+    """Change into a new temporary directory with secrets (and room for the
+    bot's database files). Returns its path."""
+    directory = tempfile.mkdtemp(prefix="unifest-")
+    write_secrets(directory, mqtt, groups)
+    os.chdir(directory)
+    return directory